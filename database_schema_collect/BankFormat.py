@@ -0,0 +1,609 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import struct
+import marshal
+import logging
+from array import array
+
+from marshmallow import fields
+
+from database_schema_collect.MetaDataBank import EMPTY_LIST
+from database_schema_collect.MetaDataBank import SCHEMA_MAP
+from database_schema_collect.MetaDataBank import DatabaseMetaDataBank
+from database_schema_collect.MetaDataBank import DatabaseMetaData
+from database_schema_collect.MetaDataBank import TablespaceMetaData
+from database_schema_collect.MetaDataBank import SchemaMetaData
+from database_schema_collect.MetaDataBank import FServerMetaData
+from database_schema_collect.MetaDataBank import TableMetaData
+from database_schema_collect.MetaDataBank import ViewMetaData
+from database_schema_collect.MetaDataBank import FTableMetaData
+from database_schema_collect.MetaDataBank import full_object_name
+from database_schema_collect.MetaDataBank import LARGE_TEXT_FIELDS
+from database_schema_collect.TextBlob import DEFAULT_MIN_SIZE
+from database_schema_collect.TextBlob import TextBlobWriter
+from database_schema_collect.TextBlob import TextBlobReader
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+# Layout of a binary bank file:
+#
+#   header      MAGIC | version u16 | flags u16 | section count u32
+#   directory   section count * (tag 4s | offset u64 | length u64)
+#   sections    STRS: all distinct strings. Version 1: marshal of a list.
+#                     Version 2: u32 count | count * u32 end offsets |
+#                     utf-8 bytes of all strings, so one string can be
+#                     read without reading the others.
+#               INDX: marshal of {tag: [(schema id, name id, offset, length)]}
+#                     for TABL, VIEW and FTAB, offsets are relative to the
+#                     start of the section (since version 2).
+#               BLOB: large texts stored out of line, see TextBlobWriter
+#                     (since version 3).
+#               DBAS: one record, the database object.
+#               TBSP, SCHM, FSVR, TABL, VIEW, FTAB: records of objects.
+#
+# A record section is u32 count followed by count * (u32 length | payload).
+# Payloads are marshal dumps of tuples with the values of an object in the
+# order of its field_names(), strings replaced by their id in STRS. Large
+# text fields hold -(blob id + 1) instead if the text is in BLOB.
+MAGIC = b"DSCBANK\x00"
+FORMAT_VERSION = 3
+MARSHAL_VERSION = 2
+
+_HEADER = struct.Struct("<8sHHI")
+_SECTION = struct.Struct("<4sQQ")
+_U32 = struct.Struct("<I")
+
+SECTION_STRINGS = b"STRS"
+SECTION_DATABASE = b"DBAS"
+SECTION_INDEX = b"INDX"
+SECTION_BLOBS = b"BLOB"
+
+# tag -> (attribute of DatabaseMetaDataBank, class of its objects)
+OBJECT_SECTIONS = ((b"TBSP", "tablespaces", TablespaceMetaData),
+                   (b"SCHM", "schemas", SchemaMetaData),
+                   (b"FSVR", "foreign_servers", FServerMetaData),
+                   (b"TABL", "tables", TableMetaData),
+                   (b"VIEW", "views", ViewMetaData),
+                   (b"FTAB", "foreign_tables", FTableMetaData))
+
+# tag -> (schema name field, object name field) of sections in INDX.
+INDEXED_SECTIONS = {b"TABL": ("table_schemaname", "table_name"),
+                    b"VIEW": ("view_schemaname", "view_name"),
+                    b"FTAB": ("foreign_schemaname", "foreign_tablename")}
+
+# Kinds of fields in a codec.
+_RAW = 0
+_STR = 1
+_NESTED = 2
+_TEXT = 3
+
+
+class _Codec(object):
+    """Encode objects of one metadata class to tuples, and back."""
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.names = cls.field_names()
+
+        schema_fields = SCHEMA_MAP[cls]._declared_fields
+        text_fields = LARGE_TEXT_FIELDS.get(cls, ())
+        self.kinds = []
+        for each_name in self.names:
+            each_field = schema_fields.get(each_name)
+            if each_name in text_fields:
+                self.kinds.append((_TEXT, None))
+            elif isinstance(each_field, fields.Nested):
+                nested_cls = _class_of_schema(each_field.nested)
+                self.kinds.append((_NESTED, nested_cls))
+            elif isinstance(each_field, fields.Str):
+                self.kinds.append((_STR, None))
+            else:
+                self.kinds.append((_RAW, None))
+
+
+    def encode(self, obj, strings, blobs=None):
+        values = []
+        for each_name, (kind, nested_cls) in zip(self.names, self.kinds):
+            value = getattr(obj, each_name, None)
+            if value is None:
+                values.append(None)
+            elif kind == _STR:
+                values.append(strings.encode(value))
+            elif kind == _TEXT:
+                blob_id = blobs.add(value) if blobs is not None else None
+                values.append(strings.encode(value) if blob_id is None else -(blob_id + 1))
+            elif kind == _NESTED:
+                codec = get_codec(nested_cls)
+                values.append([codec.encode(v, strings, blobs) for v in value])
+            else:
+                values.append(value)
+        return tuple(values)
+
+
+    def decode(self, values, strings, blobs=None):
+        obj = self.cls.__new__(self.cls)
+        for each_name, (kind, nested_cls), value in zip(self.names, self.kinds, values):
+            if value is None:
+                pass
+            elif kind == _STR:
+                value = strings[value]
+            elif kind == _TEXT:
+                value = strings[value] if value >= 0 else blobs.deferred(-value - 1)
+            elif kind == _NESTED:
+                if value:
+                    codec = get_codec(nested_cls)
+                    value = [codec.decode(v, strings, blobs) for v in value]
+                else:
+                    value = EMPTY_LIST
+            setattr(obj, each_name, value)
+        for each_name in self.names[len(values):]:
+            # Fields added to the class after the record was written.
+            setattr(obj, each_name, None)
+        return obj
+
+
+def _class_of_schema(schema_ref):
+    """Return metadata class of a nested schema name or class."""
+    for each_cls, each_schema in SCHEMA_MAP.items():
+        if each_schema is schema_ref or each_schema.__name__ == schema_ref:
+            return each_cls
+    raise ValueError("No metadata class for schema {}".format(schema_ref))
+
+
+_CODECS = {}
+
+
+def get_codec(cls):
+    """Return the codec of a metadata class, built once per class."""
+    codec = _CODECS.get(cls)
+    if codec is None:
+        codec = _Codec(cls)
+        _CODECS[cls] = codec
+    return codec
+
+
+class _StringTableWriter(object):
+    """Collect distinct strings and hand out their ids."""
+
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+
+
+    def encode(self, value):
+        value_id = self._ids.get(value)
+        if value_id is None:
+            if not isinstance(value, unicode):
+                value = str(value).decode("utf-8")
+            value_id = self._ids.get(value)
+            if value_id is None:
+                value_id = len(self.values)
+                self.values.append(value)
+                self._ids[value] = value_id
+        return value_id
+
+
+def _pack_records(payloads):
+    parts = [_U32.pack(len(payloads))]
+    for each_payload in payloads:
+        parts.append(_U32.pack(len(each_payload)))
+        parts.append(each_payload)
+    return b"".join(parts)
+
+
+def _record_spans(payloads):
+    """Return (offset, length) of payloads in a packed record section."""
+    spans = []
+    pos = _U32.size
+    for each_payload in payloads:
+        pos += _U32.size
+        spans.append((pos, len(each_payload)))
+        pos += len(each_payload)
+    return spans
+
+
+def _iter_records(data, offset, length):
+    """Yield (offset, length) of payloads in a record section."""
+    count, = _U32.unpack_from(data, offset)
+    pos = offset + _U32.size
+    for i in xrange(count):
+        rec_len, = _U32.unpack_from(data, pos)
+        pos += _U32.size
+        yield pos, rec_len
+        pos += rec_len
+
+
+def _pack_strings(values):
+    encoded = [v.encode("utf-8") for v in values]
+    ends = array('I')
+    end = 0
+    for each_value in encoded:
+        end += len(each_value)
+        ends.append(end)
+    if sys.byteorder == "big":
+        ends.byteswap()
+    return b"".join([_U32.pack(len(encoded)), ends.tostring()] + encoded)
+
+
+class _PackedStrings(object):
+    """String table of a version 2 bank, a string is decoded on first access."""
+
+    def __init__(self, data, offset, length):
+        count, = _U32.unpack_from(data, offset)
+        ends_offset = offset + _U32.size
+        self._ends = array('I')
+        self._ends.fromstring(data[ends_offset:ends_offset + self._ends.itemsize * count])
+        if sys.byteorder == "big":
+            self._ends.byteswap()
+        self._data = data
+        self._base = ends_offset + self._ends.itemsize * count
+        self._cache = {}
+
+
+    def __len__(self):
+        return len(self._ends)
+
+
+    def __getitem__(self, string_id):
+        value = self._cache.get(string_id)
+        if value is None:
+            start = self._ends[string_id - 1] if string_id > 0 else 0
+            value = self._data[self._base + start:self._base + self._ends[string_id]].decode("utf-8")
+            self._cache[string_id] = value
+        return value
+
+
+    def to_list(self):
+        """Decode all strings at once."""
+        blob = self._data[self._base:self._base + (self._ends[-1] if len(self._ends) else 0)]
+        start = 0
+        values = []
+        for end in self._ends:
+            values.append(blob[start:end].decode("utf-8"))
+            start = end
+        return values
+
+
+def _read_strings(data, version, sections):
+    str_offset, str_length = sections[SECTION_STRINGS]
+    if version < 2:
+        return marshal.loads(data[str_offset:str_offset + str_length])
+    return _PackedStrings(data, str_offset, str_length)
+
+
+def _read_blobs(data, sections):
+    if SECTION_BLOBS not in sections:
+        return None
+    blob_offset, blob_length = sections[SECTION_BLOBS]
+    return TextBlobReader(data, blob_offset, blob_length)
+
+
+def _encode_optional(strings, value):
+    return None if value is None else strings.encode(value)
+
+
+def is_binary_bank(data):
+    """Check whether the content of a bank file is in binary bank format."""
+    return data is not None and data[:len(MAGIC)] == MAGIC
+
+
+def dump_bank(bank_obj, wf, text_min_size=DEFAULT_MIN_SIZE, compress_text=True):
+    """Write a bank in binary bank format.
+
+    :param bank_obj: The meta data container.
+    :type bank_obj: An instance of DatabaseMetaDataBank.
+    :param wf: A file object opened for binary writing.
+    :type wf: file.
+    :param text_min_size: Large text fields of at least this many bytes are
+                          stored out of line, 0 keeps all of them inline.
+    :type text_min_size: int.
+    :param compress_text: Compress texts stored out of line.
+    :type compress_text: bool.
+    """
+    strings = _StringTableWriter()
+    blobs = TextBlobWriter(text_min_size, compress_text)
+    sections = []
+
+    db_payload = marshal.dumps(get_codec(DatabaseMetaData).encode(bank_obj.database, strings, blobs),
+                               MARSHAL_VERSION)
+    sections.append((SECTION_DATABASE, _pack_records([db_payload])))
+
+    index = {}
+    for tag, attr_name, cls in OBJECT_SECTIONS:
+        codec = get_codec(cls)
+        objs = getattr(bank_obj, attr_name)
+        payloads = [marshal.dumps(codec.encode(o, strings, blobs), MARSHAL_VERSION)
+                    for o in objs]
+        sections.append((tag, _pack_records(payloads)))
+
+        if tag in INDEXED_SECTIONS:
+            schema_field, name_field = INDEXED_SECTIONS[tag]
+            index[tag] = [(_encode_optional(strings, getattr(o, schema_field, None)),
+                           _encode_optional(strings, getattr(o, name_field, None)),
+                           offset, length)
+                          for o, (offset, length) in zip(objs, _record_spans(payloads))]
+
+    # Texts are read least often, keep them after all objects.
+    logger.debug("Store %d large texts out of line." % len(blobs))
+    sections.append((SECTION_BLOBS, blobs.pack()))
+    sections.insert(0, (SECTION_INDEX, marshal.dumps(index, MARSHAL_VERSION)))
+    sections.insert(0, (SECTION_STRINGS, _pack_strings(strings.values)))
+
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    wf.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(sections)))
+    for tag, body in sections:
+        wf.write(_SECTION.pack(tag, offset, len(body)))
+        offset += len(body)
+    for tag, body in sections:
+        wf.write(body)
+
+
+def read_sections(data):
+    """Read header and section directory of a binary bank.
+
+    :param data: Content of a bank file.
+    :type data: str, buffer or mmap.
+    :returns: (version, flags, {tag: (offset, length)}).
+    :raises: ValueError.
+    """
+    magic, version, flags, section_count = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a binary metabank file.")
+    if version > FORMAT_VERSION:
+        raise ValueError("Unsupported metabank format version {}, newest supported is {}".format(version, FORMAT_VERSION))
+
+    sections = {}
+    pos = _HEADER.size
+    for i in xrange(section_count):
+        tag, offset, length = _SECTION.unpack_from(data, pos)
+        sections[tag] = (offset, length)
+        pos += _SECTION.size
+    return version, flags, sections
+
+
+def load_bank(data):
+    """Rebuild a bank from content in binary bank format.
+
+    :param data: Content of a bank file.
+    :type data: str, buffer or mmap.
+    :returns: An instance of DatabaseMetaDataBank.
+    """
+    version, flags, sections = read_sections(data)
+
+    strings = _read_strings(data, version, sections)
+    if isinstance(strings, _PackedStrings):
+        strings = strings.to_list()
+    blobs = _read_blobs(data, sections)
+
+    bank_obj = DatabaseMetaDataBank()
+    db_offset, db_length = sections[SECTION_DATABASE]
+    for rec_offset, rec_len in _iter_records(data, db_offset, db_length):
+        bank_obj.database = get_codec(DatabaseMetaData).decode(marshal.loads(data[rec_offset:rec_offset + rec_len]),
+                                                               strings, blobs)
+
+    for tag, attr_name, cls in OBJECT_SECTIONS:
+        if tag not in sections:
+            continue
+        codec = get_codec(cls)
+        sec_offset, sec_length = sections[tag]
+        setattr(bank_obj, attr_name,
+                [codec.decode(marshal.loads(data[o:o + l]), strings, blobs)
+                 for o, l in _iter_records(data, sec_offset, sec_length)])
+
+    bank_obj.rebuild_indexes()
+    return bank_obj
+
+
+class LazyObjectList(object):
+    """Read only list of objects in a binary bank, decoded on access.
+
+    Decoded objects are not kept, every access decodes its record again,
+    so memory use follows what the caller holds on to.
+    """
+
+    def __init__(self, data, strings, blobs, codec, spans):
+        self._data = data
+        self._strings = strings
+        self._blobs = blobs
+        self._codec = codec
+        self._spans = spans
+
+
+    def _decode(self, span):
+        offset, length = span
+        return self._codec.decode(marshal.loads(self._data[offset:offset + length]), self._strings, self._blobs)
+
+
+    def __len__(self):
+        return len(self._spans)
+
+
+    def __nonzero__(self):
+        return len(self._spans) > 0
+
+
+    __bool__ = __nonzero__
+
+
+    def __iter__(self):
+        for each_span in self._spans:
+            yield self._decode(each_span)
+
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._decode(s) for s in self._spans[key]]
+        return self._decode(self._spans[key])
+
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, LazyObjectList)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+
+    def __repr__(self):
+        return "<LazyObjectList of {} {}>".format(len(self), self._codec.cls.__name__)
+
+
+class LazyBank(object):
+    """Bank over the content of a binary bank file, objects are decoded on access.
+
+    Offers the read interface of DatabaseMetaDataBank used by exporters.
+    Only the section directory, the index and the database object are read
+    when it is opened.
+    """
+
+    def __init__(self, data):
+        """
+        :param data: Content of a bank file, version 2 or newer.
+        :type data: str, buffer or mmap.
+        :raises: ValueError.
+        """
+        version, flags, sections = read_sections(data)
+        if SECTION_INDEX not in sections:
+            raise ValueError("Metabank format version {} has no index, can not load it lazily.".format(version))
+
+        self._data = data
+        self._strings = _read_strings(data, version, sections)
+        self._blobs = _read_blobs(data, sections)
+        idx_offset, idx_length = sections[SECTION_INDEX]
+        index = marshal.loads(data[idx_offset:idx_offset + idx_length])
+
+        self.database = None
+        db_offset, db_length = sections[SECTION_DATABASE]
+        for rec_offset, rec_len in _iter_records(data, db_offset, db_length):
+            self.database = get_codec(DatabaseMetaData).decode(marshal.loads(data[rec_offset:rec_offset + rec_len]),
+                                                               self._strings, self._blobs)
+
+        # schema name id -> {attribute name: [span, ...]}
+        self._schema_index = {}
+        # (attribute name, name id, span) of indexed objects, for _name_index.
+        self._named_spans = []
+        # "schemaname.objectname" -> (attribute name, span), built on first lookup.
+        self._name_index = None
+        self._fk_ref_index = None
+        self.column_store = None
+
+        for tag, attr_name, cls in OBJECT_SECTIONS:
+            if tag not in sections:
+                setattr(self, attr_name, LazyObjectList(data, self._strings, self._blobs, get_codec(cls), []))
+                continue
+
+            sec_offset, sec_length = sections[tag]
+            if tag in index:
+                spans = []
+                for schema_id, name_id, offset, length in index[tag]:
+                    span = (sec_offset + offset, length)
+                    spans.append(span)
+                    self._schema_index.setdefault(schema_id, {}).setdefault(attr_name, []).append(span)
+                    self._named_spans.append((attr_name, schema_id, name_id, span))
+            else:
+                spans = list(_iter_records(data, sec_offset, sec_length))
+            setattr(self, attr_name, LazyObjectList(data, self._strings, self._blobs, get_codec(cls), spans))
+
+        self._schema_ids = dict((self._string(i), i) for i in self._schema_index)
+
+
+    def _string(self, string_id):
+        return None if string_id is None else self._strings[string_id]
+
+
+    def _objects_in_schema(self, schemaname, attr_name):
+        schema_id = self._schema_ids.get(schemaname, -1)
+        spans = self._schema_index.get(schema_id, {}).get(attr_name, [])
+        return LazyObjectList(self._data, self._strings, self._blobs, getattr(self, attr_name)._codec, spans)
+
+
+    def tables_in_schema(self, schemaname):
+        """Return tables belong to a schema."""
+        return self._objects_in_schema(schemaname, "tables")
+
+
+    def views_in_schema(self, schemaname):
+        """Return views belong to a schema."""
+        return self._objects_in_schema(schemaname, "views")
+
+
+    def foreign_tables_in_schema(self, schemaname):
+        """Return foreign tables belong to a schema."""
+        return self._objects_in_schema(schemaname, "foreign_tables")
+
+
+    def schema_names(self):
+        """Return names of schemas which hold tables, views or foreign tables."""
+        return sorted(self._schema_ids.keys())
+
+
+    def iter_tables(self, schemaname=None):
+        """Iterate tables, of one schema if schemaname is given."""
+        return iter(self.tables if schemaname is None else self.tables_in_schema(schemaname))
+
+
+    def iter_views(self, schemaname=None):
+        """Iterate views, of one schema if schemaname is given."""
+        return iter(self.views if schemaname is None else self.views_in_schema(schemaname))
+
+
+    def get_object(self, schemaname, objectname):
+        """Look up a table, view or foreign table by its name, see DatabaseMetaDataBank.get_object."""
+        if self._name_index is None:
+            self._name_index = {}
+            for attr_name, schema_id, name_id, span in self._named_spans:
+                self._name_index[full_object_name(self._string(schema_id), self._string(name_id))] = (attr_name, span)
+
+        key = objectname if schemaname is None else full_object_name(schemaname, objectname)
+        entry = self._name_index.get(key)
+        if entry is None:
+            return None
+        attr_name, span = entry
+        return getattr(self, attr_name)._decode(span)
+
+
+    def get_referencing_fks(self, schemaname, tablename):
+        """Return foreign keys reference to the given table.
+
+        The first call decodes all tables once to build the reference index.
+        """
+        if self._fk_ref_index is None:
+            self._fk_ref_index = {}
+            for each_table in self.tables:
+                for each_fk in each_table.foreign_keys:
+                    ref_name = each_fk.fk_ref_tablename
+                    if ref_name is None:
+                        continue
+                    if '.' not in ref_name:
+                        ref_name = full_object_name(each_table.table_schemaname, ref_name)
+                    self._fk_ref_index.setdefault(ref_name, []).append((each_table, each_fk))
+        return self._fk_ref_index.get(full_object_name(schemaname, tablename), [])
+
+
+def open_bank(data, lazy=True):
+    """Open content of a binary bank file.
+
+    :param data: Content of a bank file.
+    :type data: str, buffer or mmap.
+    :param lazy: Return a LazyBank if the file has an index.
+    :type lazy: bool.
+    :returns: An instance of LazyBank or DatabaseMetaDataBank.
+    """
+    if lazy:
+        version, flags, sections = read_sections(data)
+        if SECTION_INDEX in sections:
+            return LazyBank(data)
+        logger.debug("Metabank format version %d has no index, load it at once." % version)
+    return load_bank(data)
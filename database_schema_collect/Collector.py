@@ -4,9 +4,13 @@
 from __future__ import absolute_import
 
 import sys
+import re
+import marshal
+import hashlib
 import logging
 from abc import abstractmethod
 from collections import namedtuple
+from collections import OrderedDict
 
 from database_schema_collect.util import PGAgent
 from database_schema_collect.MetaDataBank import DatabaseMetaData
@@ -22,6 +26,7 @@ from database_schema_collect.MetaDataBank import CheckMetaData
 from database_schema_collect.MetaDataBank import IndexMetaData
 from database_schema_collect.MetaDataBank import TableMetaData
 from database_schema_collect.MetaDataBank import ViewMetaData
+from database_schema_collect.MetaDataBank import intern_str
 
 reload(sys)
 sys.setdefaultencoding("utf-8")
@@ -75,13 +80,54 @@ class Collector(object):
         raise NotImplementedError()
 
 
-TableName = namedtuple('TableName', ['tablename', 'schemaname', 'owner', 'tablespace', 'comment'])
+EXTRACT_MODES = ("per_table", "bulk", "copy")
+
+
+def _to_int(value):
+    """Convert value to int, keep None as it is."""
+    return int(value) if value is not None else None
+
+
+def _strip_schema_name(text, schemaname):
+    """Remove qualifications by a schema name, like sql_schema_fingerprint does."""
+    if text is None:
+        return None
+    return re.sub(r'(^|[^A-Za-z0-9_$"])(?:{}|"{}")\.'.format(re.escape(schemaname),
+                                                           re.escape(schemaname.replace('"', '""'))),
+                  r'\1', text)
+
+
+RELKIND_TABLES = ('r', 'p')
+RELKIND_VIEWS = ('v', 'm')
+RELKIND_FOREIGN_TABLES = ('f',)
+
+
+RelationInfo = namedtuple('RelationInfo', ['oid', 'schemaname', 'relname', 'kind', 'owner', 'tablespace',
+                                           'comment', 'define', 'foreign_server', 'foreign_data_wrapper'])
+TableName = namedtuple('TableName', ['tablename', 'schemaname', 'owner', 'tablespace', 'comment', 'oid', 'kind'])
 class PGCollector(Collector):
     """Collect metadata in PostgreSQL."""
 
-    def __init__(self, db_uri, metadata_bank):
+    def __init__(self, db_uri, metadata_bank, extract_mode="per_table"):
+        """
+        :param db_uri: Connect string for PostgreSQL database.
+        :type db_uri: str.
+        :param metadata_bank: Object stores collected meta data.
+        :type metadata_bank: An instance of MetaDataBank.
+        :param extract_mode: How details of tables are fetched, one of
+                             per_table|bulk|copy. "bulk" runs one query per schema
+                             for columns, constraints and indexes, "copy" runs
+                             the same queries as COPY ... TO STDOUT.
+        :type extract_mode: str.
+        """
+        if extract_mode not in EXTRACT_MODES:
+            raise ValueError("Valid extract modes are: {}, got {}".format('|'.join(EXTRACT_MODES), extract_mode))
+
         self.pgagent = PGAgent(db_uri)
         self.metadata_bank = metadata_bank
+        self.extract_mode = extract_mode
+        # (schemaname, relname) -> RelationInfo, loaded once per run.
+        self._relations = None
 
         self.sql_dbinfo = """SELECT d.datname
                                   , p.description
@@ -113,19 +159,44 @@ class PGCollector(Collector):
                               WHERE nspname NOT LIKE 'pg%'
                                 AND nspname != 'information_schema' """
 
-        self.sql_tblist = """SELECT t.tablename
-                                  , t.schemaname
-                                  , t.tableowner
-                                  , (SELECT s.spcname
-                                       FROM pg_tablespace s
-                                      WHERE s.oid = (string_to_array(pg_catalog.pg_relation_filepath((t.schemaname||'.'||t.tablename)::regclass::oid), '/'))[2]::int)
-                                  , pg_catalog.obj_description(t.tablename::regclass::oid)
-                               FROM pg_tables t
-                              WHERE t.schemaname = :schemaname """
+        # One scan of pg_class for every relation the collector cares about,
+        # replaces per-row regclass casts and pg_relation_filepath lookups.
+        self.sql_relinventory = """SELECT c.oid
+                                        , n.nspname
+                                        , c.relname
+                                        , c.relkind
+                                        , pg_catalog.pg_get_userbyid(c.relowner)
+                                        , tbs.spcname
+                                        , d.description
+                                        , CASE WHEN c.relkind IN ('v', 'm')
+                                               THEN pg_catalog.pg_get_viewdef(c.oid)
+                                          END                 AS view_define
+                                        , fs.srvname
+                                        , fdw.fdwname
+                                     FROM pg_class c
+                                     JOIN pg_namespace n
+                                       ON n.oid = c.relnamespace
+                                LEFT JOIN pg_tablespace tbs
+                                       ON tbs.oid = c.reltablespace
+                                LEFT JOIN pg_description d
+                                       ON d.objoid = c.oid
+                                      AND d.classoid = 'pg_class'::regclass
+                                      AND d.objsubid = 0
+                                LEFT JOIN pg_foreign_table ft
+                                       ON ft.ftrelid = c.oid
+                                LEFT JOIN pg_foreign_server fs
+                                       ON fs.oid = ft.ftserver
+                                LEFT JOIN pg_foreign_data_wrapper fdw
+                                       ON fdw.oid = fs.srvfdw
+                                    WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+                                      AND n.nspname NOT LIKE 'pg%'
+                                      AND n.nspname != 'information_schema'
+                                 ORDER BY n.nspname
+                                        , c.relname """
 
         self.sql_colinfo = """SELECT c.column_name
                                    , c.ordinal_position
-                                   , pg_catalog.col_description((:fulltablename)::regclass::oid, c.ordinal_position)  AS col_comment
+                                   , pg_catalog.col_description(CAST(:tableoid AS oid), c.ordinal_position)  AS col_comment
                                    , CASE WHEN c.data_type = 'bigint'
                                            AND substr(c.column_default, 1, 7) = 'nextval'
                                           THEN 'bigserial'
@@ -271,12 +342,220 @@ class PGCollector(Collector):
                                        ) temp
                                  WHERE temp.attnum = temp.idx_col_last """
 
-        self.sql_vwinfo = """SELECT viewname
-                                  , viewowner
-                                  , definition
-                                  , pg_catalog.obj_description((schemaname||'.'||viewname)::regclass::oid)
-                               FROM pg_views
-                              WHERE schemaname = :schemaname """
+        # Bulk versions of the queries above, fetch all tables of a schema at
+        # once. The first column of each is the table name.
+        self.sql_bulk_colinfo = """SELECT c.table_name
+                                        , c.column_name
+                                        , c.ordinal_position
+                                        , pg_catalog.col_description(pc.oid, c.ordinal_position)  AS col_comment
+                                        , CASE WHEN c.data_type = 'bigint'
+                                                AND substr(c.column_default, 1, 7) = 'nextval'
+                                               THEN 'bigserial'
+                                               WHEN c.data_type = 'int'
+                                                AND substr(c.column_default, 1, 7) = 'nextval'
+                                               THEN 'serial'
+                                               WHEN c.data_type = 'ARRAY'
+                                               THEN regexp_replace(regexp_replace(c.udt_name, '[248]', ''), '^_', '')||'[]'
+                                               ELSE replace(c.data_type, '"', '')
+                                          END                         AS col_datatype
+                                        , c.character_maximum_length  AS col_length
+                                        , c.numeric_scale
+                                        , c.numeric_precision
+                                        , c.column_default
+                                        , substring(c.column_default, '\(''(.*)''::')  AS col_auto_inc
+                                        , CASE WHEN trim(c.is_nullable) = 'YES'
+                                               THEN 'Y'
+                                               ELSE 'N'
+                                          END                         AS col_is_nullable
+                                        , CASE WHEN tc.constraint_type = 'PRIMARY KEY'
+                                               THEN '-> ' || tc.constraint_name
+                                               ELSE ''
+                                          END                         AS col_in_pk
+                                        , CASE WHEN tc.constraint_type = 'FOREIGN KEY'
+                                               THEN '-> ' || tc.constraint_name
+                                               ELSE ''
+                                          END                         AS col_in_fk
+                                     FROM information_schema.columns c
+                                     JOIN pg_namespace pn
+                                       ON pn.nspname = c.table_schema
+                                     JOIN pg_class pc
+                                       ON pc.relnamespace = pn.oid
+                                      AND pc.relname = c.table_name
+                                      AND pc.relkind IN ('r', 'p')
+                                LEFT JOIN information_schema.key_column_usage kcu
+                                       ON kcu.table_schema = c.table_schema
+                                      AND kcu.table_name = c.table_name
+                                      AND kcu.column_name = c.column_name
+                                LEFT JOIN information_schema.table_constraints tc
+                                       ON tc.constraint_schema = kcu.constraint_schema
+                                      AND tc.constraint_name = kcu.constraint_name
+                                    WHERE c.table_schema = :schemaname
+                                 ORDER BY c.table_name
+                                        , c.ordinal_position """
+
+        self.sql_bulk_pkinfo = """SELECT tc.table_name
+                                       , tc.constraint_name
+                                       , kcu.column_name
+                                       , kcu.ordinal_position
+                                       , pis.tablespace
+                                    FROM information_schema.table_constraints tc
+                                    JOIN information_schema.key_column_usage kcu
+                                      ON kcu.constraint_schema = tc.constraint_schema
+                                     AND kcu.constraint_name = tc.constraint_name
+                               LEFT JOIN pg_indexes pis
+                                      ON pis.indexname = tc.constraint_name
+                                     AND pis.schemaname = tc.constraint_schema
+                                   WHERE tc.table_schema = :schemaname
+                                     AND tc.constraint_type = 'PRIMARY KEY' """
+
+        self.sql_bulk_ukinfo = """SELECT tc.table_name
+                                       , tc.constraint_name
+                                       , kcu.column_name
+                                       , kcu.ordinal_position
+                                       , pis.tablespace
+                                    FROM information_schema.table_constraints tc
+                                    JOIN information_schema.key_column_usage kcu
+                                      ON kcu.constraint_schema = tc.constraint_schema
+                                     AND kcu.constraint_name = tc.constraint_name
+                               LEFT JOIN pg_indexes pis
+                                      ON pis.indexname = tc.constraint_name
+                                     AND pis.schemaname = tc.constraint_schema
+                                   WHERE tc.table_schema = :schemaname
+                                     AND tc.constraint_type = 'UNIQUE' """
+
+        self.sql_bulk_ckinfo = """SELECT tc.table_name
+                                       , cc.constraint_name
+                                       , cc.check_clause
+                                    FROM information_schema.table_constraints tc
+                                    JOIN information_schema.check_constraints cc
+                                      ON cc.constraint_schema = tc.constraint_schema
+                                     AND cc.constraint_name = tc.constraint_name
+                                     AND tc.constraint_type = 'UNIQUE'
+                                   WHERE tc.table_schema = :schemaname
+                                     AND cc.constraint_name NOT LIKE '%_not_null' """
+
+        self.sql_bulk_fkinfo = """ SELECT temp.table_name
+                                        , temp.fk_name
+                                        , temp.column_name
+                                        , temp.reference_table_name
+                                        , temp.reference_column_name
+                                     FROM (  SELECT tc.table_name       AS table_name
+                                                  , tc.constraint_name  AS fk_name
+                                                  , string_agg(kcu.column_name, ',')
+                                                    OVER(PARTITION BY tc.table_name
+                                                                    , tc.constraint_name
+                                                                    , ccu.table_name
+                                                             ORDER BY kcu.ordinal_position ASC
+                                                        )               AS column_name
+                                                  , ccu.table_name      AS reference_table_name
+                                                  , string_agg(ccu.column_name, ',')
+                                                    OVER(PARTITION BY tc.table_name
+                                                                    , tc.constraint_name
+                                                                    , ccu.table_name
+                                                             ORDER BY kcu.ordinal_position ASC
+                                                        )               AS reference_column_name
+                                                  , ROW_NUMBER()
+                                                    OVER(PARTITION BY tc.table_name
+                                                                    , tc.constraint_name
+                                                                    , ccu.table_name
+                                                             ORDER BY kcu.ordinal_position ASC
+                                                        )               AS rn
+                                                  , COUNT(1)
+                                                    OVER(PARTITION BY tc.table_name
+                                                                    , tc.constraint_name
+                                                                    , ccu.table_name
+                                                        )               AS cnt
+                                               FROM information_schema.table_constraints tc
+                                               JOIN information_schema.key_column_usage kcu
+                                                 ON tc.constraint_name = kcu.constraint_name
+                                               JOIN information_schema.constraint_column_usage ccu
+                                                 ON ccu.constraint_name = tc.constraint_name
+                                                AND kcu.column_name = ccu.column_name
+                                              WHERE tc.constraint_type = 'FOREIGN KEY'
+                                                AND tc.table_schema = :schemaname
+                                          ) temp
+                                    WHERE temp.cnt = temp.rn """
+
+        self.sql_bulk_indexinfo = """SELECT temp.table_name
+                                          , temp.index_name
+                                          , temp.index_columns
+                                          , temp.index_type
+                                          , temp.index_tablespace
+                                          , temp.index_define
+                                       FROM ( SELECT i.tablename            AS table_name
+                                                   , i.indexname            AS index_name
+                                                   , string_agg(att.attname, ', ')over(partition by att.attrelid order by att.attnum)  AS index_columns
+                                                   , a.amname             AS index_type
+                                                   , i.tablespace         AS index_tablespace
+                                                   , i.indexdef           AS index_define
+                                                   , att.attnum
+                                                   , max(att.attnum)over(partition by att.attrelid)   AS idx_col_last
+                                                FROM pg_indexes i
+                                                JOIN pg_class c
+                                                  ON c.relname = i.indexname
+                                                JOIN pg_am a
+                                                  ON a.oid = c.relam
+                                                LEFT JOIN pg_attribute att
+                                                  ON att.attrelid = c.oid
+                                               WHERE i.schemaname = :schemaname
+                                                 AND (i.tablename, i.indexname) NOT IN (SELECT u.table_name
+                                                                                             , u.constraint_name
+                                                                                          FROM information_schema.constraint_table_usage u
+                                                                                         WHERE u.table_schema = :schemaname
+                                                                                       )
+                                            ) temp
+                                      WHERE temp.attnum = temp.idx_col_last """
+
+        # Fingerprint of the columns, constraints and indexes of each schema,
+        # md5 of their definitions with the schema name taken out of them,
+        # so schemas created from the same template get the same one.
+        self.sql_schema_fingerprint = r"""SELECT s.nspname
+                                               , md5(string_agg(s.item, E'\n' ORDER BY s.item))
+                                            FROM ( SELECT n.nspname
+                                                        , regexp_replace(d.item,
+                                                                         '(^|[^A-Za-z0-9_$"])'
+                                                                         || regexp_replace(quote_ident(n.nspname), '([^A-Za-z0-9_])', '\\\1', 'g')
+                                                                         || '\.',
+                                                                         '\1', 'g')  AS item
+                                                     FROM pg_namespace n
+                                                     JOIN ( SELECT c.relnamespace   AS nspoid
+                                                                 , concat_ws('|', 'column', c.relname, a.attnum, a.attname,
+                                                                             format_type(a.atttypid, a.atttypmod), a.attnotnull,
+                                                                             pg_get_expr(ad.adbin, ad.adrelid),
+                                                                             col_description(c.oid, a.attnum))  AS item
+                                                              FROM pg_class c
+                                                              JOIN pg_attribute a
+                                                                ON a.attrelid = c.oid
+                                                               AND a.attnum > 0
+                                                               AND NOT a.attisdropped
+                                                         LEFT JOIN pg_attrdef ad
+                                                                ON ad.adrelid = c.oid
+                                                               AND ad.adnum = a.attnum
+                                                             WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f')
+                                                         UNION ALL
+                                                            SELECT c.relnamespace
+                                                                 , concat_ws('|', 'constraint', c.relname, co.conname, co.contype,
+                                                                             pg_get_constraintdef(co.oid))
+                                                              FROM pg_constraint co
+                                                              JOIN pg_class c
+                                                                ON c.oid = co.conrelid
+                                                         UNION ALL
+                                                            SELECT c.relnamespace
+                                                                 , concat_ws('|', 'index', c.relname, i.relname,
+                                                                             pg_get_indexdef(x.indexrelid), tbs.spcname)
+                                                              FROM pg_index x
+                                                              JOIN pg_class c
+                                                                ON c.oid = x.indrelid
+                                                              JOIN pg_class i
+                                                                ON i.oid = x.indexrelid
+                                                         LEFT JOIN pg_tablespace tbs
+                                                                ON tbs.oid = i.reltablespace
+                                                          ) d
+                                                       ON d.nspoid = n.oid
+                                                    WHERE n.nspname NOT LIKE 'pg%'
+                                                      AND n.nspname != 'information_schema'
+                                                 ) s
+                                        GROUP BY s.nspname """
 
         self.sql_fsvcinfo = """SELECT fs.srvname       AS fsvc_name
                                     , pg_catalog.pg_get_userbyid(fs.srvowner)   AS fsvc_owner
@@ -286,14 +565,6 @@ class PGCollector(Collector):
                                  JOIN pg_foreign_data_wrapper w
                                    ON w.oid = fs.srvfdw """
 
-        self.sql_ftbinfo = """SELECT ft.foreign_table_name
-                                   , ft.foreign_table_schema
-                                   , ft.foreign_server_name
-                                   , fs.foreign_data_wrapper_name
-                                FROM information_schema.foreign_tables ft
-                                JOIN information_schema.foreign_servers fs
-                                  ON fs.foreign_server_catalog = ft.foreign_server_catalog
-                                 AND fs.foreign_server_name = ft.foreign_server_name """
 
 
     def get_metadata_tablespaces(self):
@@ -359,64 +630,211 @@ class PGCollector(Collector):
         return schemas
 
 
-    def list_tablenames_in_schema(self, schemaname):
-        if schemaname is None or schemaname == '':
-            raise ValueError("Schema name must not be empty!")
+    def load_relation_inventory(self):
+        """Load tables, views, foreign tables, partitioned tables and materialized
+        views of the database with one catalog query, and cache them for the run.
 
-        tb_lst = []
+        :returns: RelationInfo keyed by (schemaname, relname).
+        :rtype: dict.
+        """
+        if self._relations is not None:
+            return self._relations
 
-        for each_tb in self.pgagent.query_all(self.sql_tblist, {"schemaname": schemaname}):
-            if each_tb is None:
+        relations = OrderedDict()
+        for each_rel in self.pgagent.query_all(self.sql_relinventory):
+            if each_rel is None:
                 break
+            rel_info = RelationInfo(oid=int(each_rel[0]),
+                                    schemaname=each_rel[1],
+                                    relname=each_rel[2],
+                                    kind=each_rel[3],
+                                    owner=each_rel[4],
+                                    tablespace=each_rel[5],
+                                    comment=each_rel[6],
+                                    define=each_rel[7],
+                                    foreign_server=each_rel[8],
+                                    foreign_data_wrapper=each_rel[9])
+            relations[(rel_info.schemaname, rel_info.relname)] = rel_info
+        logger.debug("Got %d relations in relation inventory." % len(relations))
+
+        self._relations = relations
+        return self._relations
+
+
+    def list_relations(self, kinds, schemaname=None):
+        """List relations of given kinds from the relation inventory.
+
+        :param kinds: Accepted values of pg_class.relkind.
+        :type kinds: tuple.
+        :param schemaname: Only list relations in this schema if given.
+        :type schemaname: str.
+        :returns: list of RelationInfo.
+        """
+        return [r for r in self.load_relation_inventory().values()
+                if r.kind in kinds and (schemaname is None or r.schemaname == schemaname)]
 
-            tb_lst.append(TableName(tablename=each_tb[0],
-                                    schemaname=each_tb[1],
-                                    owner=each_tb[2],
-                                    tablespace=each_tb[3],
-                                    comment=each_tb[4]))
 
-        return tb_lst
+    def fingerprint_schemas(self):
+        """Return structural fingerprints of schemas holding tables, views or
+        foreign tables.
 
+        Schema names and OIDs are not part of a fingerprint, two schemas with
+        the same one have the same objects apart from their schema name.
 
-    def get_metadata_table(self, schemaname, tablename):
+        :returns: {schemaname: fingerprint}.
+        :rtype: dict.
+        """
+        catalog_hashes = {}
+        for each_row in self.pgagent.query_all(self.sql_schema_fingerprint):
+            if each_row is None:
+                break
+            catalog_hashes[each_row[0]] = each_row[1]
+
+        relations = {}
+        for rel_info in self.load_relation_inventory().values():
+            relations.setdefault(rel_info.schemaname, []).append(
+                (rel_info.relname, rel_info.kind, rel_info.owner, rel_info.tablespace, rel_info.comment,
+                 _strip_schema_name(rel_info.define, rel_info.schemaname),
+                 rel_info.foreign_server, rel_info.foreign_data_wrapper))
+
+        return dict((s, hashlib.sha1(marshal.dumps((catalog_hashes.get(s), sorted(r)), 2)).hexdigest())
+                    for s, r in relations.iteritems())
+
+
+    def find_schema_templates(self, schemanames):
+        """Find schemas with the same structure as an earlier one, and record
+        the earlier one as their template in the metadata bank.
+
+        Objects of these tenant schemas do not need to be collected, those of
+        their template stand for them.
+
+        :param schemanames: Names of schemas, in the order they are collected.
+        :type schemanames: list.
+        :returns: {tenant schema name: template schema name}.
+        :rtype: OrderedDict.
+        """
+        fingerprints = self.fingerprint_schemas()
+        first_schemas = {}
+        templates = OrderedDict()
+        for each_schema in schemanames:
+            fingerprint = fingerprints.get(each_schema)
+            if fingerprint is None:
+                continue
+            template = first_schemas.setdefault(fingerprint, each_schema)
+            if template != each_schema:
+                templates[each_schema] = template
+                self.metadata_bank.set_schema_template(each_schema, template)
+        logger.info("%d of %d schemas have the same structure as another one." % (len(templates),
+                                                                                   len(schemanames)))
+        return templates
+
+
+    def list_tablenames_in_schema(self, schemaname):
+        if schemaname is None or schemaname == '':
+            raise ValueError("Schema name must not be empty!")
+
+        return [TableName(tablename=r.relname,
+                          schemaname=r.schemaname,
+                          owner=r.owner,
+                          tablespace=r.tablespace,
+                          comment=r.comment,
+                          oid=r.oid,
+                          kind=r.kind)
+                for r in self.list_relations(RELKIND_TABLES, schemaname)]
+
+
+    def _column_from_row(self, row):
+        """Build column meta data from a row of sql_colinfo."""
+        return ColumnMetaData(name=row[0],
+                              column_name=row[0],
+                              column_index=int(row[1]),
+                              column_comment=row[2],
+                              column_data_type=row[3],
+                              column_length=_to_int(row[4]),
+                              column_scale=_to_int(row[5]),
+                              column_precision=_to_int(row[6]),
+                              column_default_value=str(row[7]) if row[7] is not None else '',
+                              column_auto_increment=row[8],
+                              column_is_nullable=True if row[9].strip() == 'Y' else False,
+                              column_in_pk=row[10],
+                              column_in_fk=row[11])
+
+
+    def _pk_from_row(self, row):
+        """Build primary key meta data from a row of sql_pkinfo."""
+        return PKMetaData(name=row[0],
+                          pk_name=row[0],
+                          pk_column=row[1],
+                          pk_column_index=_to_int(row[2]),
+                          pk_tablespace=row[3])
+
+
+    def _uk_from_row(self, row):
+        """Build unique key meta data from a row of sql_ukinfo."""
+        return UKMetaData(name=row[0],
+                          uk_name=row[0],
+                          uk_column=row[1],
+                          uk_column_index=_to_int(row[2]),
+                          uk_tablespace=row[3])
+
+
+    def _check_from_row(self, row):
+        """Build check constraint meta data from a row of sql_ckinfo."""
+        return CheckMetaData(name=row[0],
+                             check_name=row[0],
+                             check_define=row[1])
+
+
+    def _fk_from_row(self, row):
+        """Build foreign key meta data from a row of sql_fkinfo."""
+        return FKMetaData(name=row[0],
+                          fk_name=row[0],
+                          fk_column=row[1],
+                          fk_ref_tablename=row[2],
+                          fk_ref_column=row[3])
+
+
+    def _index_from_row(self, row):
+        """Build index meta data from a row of sql_indexinfo."""
+        return IndexMetaData(name=row[0],
+                             index_name=row[0],
+                             index_columns=row[1],
+                             index_type=row[2],
+                             index_tablespace=row[3],
+                             index_define=row[4])
+
+
+    def _add_column_to_table(self, tb_meta, col_meta):
+        """Append a column to a table and track the longest column name."""
+        if len(col_meta.column_name) > tb_meta.column_longest_length:
+            tb_meta.column_longest_length = len(col_meta.column_name)
+        tb_meta.columns.append(col_meta)
+
+
+    def _new_table_meta(self, schemaname, tablename):
+        """Create an empty table meta data object."""
         tb_meta = TableMetaData(table_name=tablename, table_schemaname=schemaname)
+        tb_meta.name = tb_meta.table_name
+        tb_meta.column_longest_length = 0
+        return tb_meta
+
+
+    def get_metadata_table(self, schemaname, tablename):
         fulltablename = "{}.{}".format(schemaname, tablename)
         logger.debug("Fetch metadata of table: %s" % fulltablename)
 
         # Basic table information
-        tb_meta.table_schemaname = schemaname
-        tb_meta.table_name = tablename
-
-        tb_meta.name = tb_meta.table_name
-        tb_meta.column_longest_length = 0
+        tb_meta = self._new_table_meta(schemaname, tablename)
 
+        rel_info = self.load_relation_inventory().get((schemaname, tablename))
         for each_column in self.pgagent.query_all(self.sql_colinfo,
-                                                  {"fulltablename": fulltablename,
+                                                  {"tableoid": rel_info.oid if rel_info is not None else None,
                                                    "schemaname": schemaname,
                                                    "tablename": tablename}):
             if each_column is None:
                 break
             logger.debug("Got column %s for table %s" % (each_column[0], tablename))
-
-            col_meta = ColumnMetaData()
-            col_meta.column_name = each_column[0]
-            col_meta.column_index = int(each_column[1])
-            col_meta.column_comment = each_column[2]
-            col_meta.column_data_type = each_column[3]
-            col_meta.column_length = each_column[4]
-            col_meta.column_scale = each_column[5]
-            col_meta.column_precision = each_column[6]
-            col_meta.column_default_value = str(each_column[7]) if each_column[7] is not None else ''
-            col_meta.column_auto_increment = each_column[8]
-            col_meta.column_is_nullable = True if each_column[9].strip() == 'Y' else False
-            col_meta.column_in_pk = each_column[10]
-            col_meta.column_in_fk = each_column[11]
-
-            col_meta.name = col_meta.column_name
-            if len(col_meta.column_name) > tb_meta.column_longest_length:
-                tb_meta.column_longest_length = len(col_meta.column_name)
-
-            tb_meta.columns.append(col_meta)
+            self._add_column_to_table(tb_meta, self._column_from_row(each_column))
 
         # Primary key
         for each_pk_col in self.pgagent.query_all(self.sql_pkinfo,
@@ -425,16 +843,7 @@ class PGCollector(Collector):
             if each_pk_col is None:
                 break
             logger.debug("Got column %s in primary key %s for table %s" % (each_pk_col[1], each_pk_col[0], tablename))
-
-            pk_meta = PKMetaData()
-            pk_meta.pk_name = each_pk_col[0]
-            pk_meta.pk_column = each_pk_col[1]
-            pk_meta.pk_column_index = each_pk_col[2]
-            pk_meta.pk_tablespace = each_pk_col[3]
-
-            pk_meta.name = pk_meta.pk_name
-
-            tb_meta.primary_key.append(pk_meta)
+            tb_meta.primary_key.append(self._pk_from_row(each_pk_col))
 
         # Unique key
         for each_uk_col in self.pgagent.query_all(self.sql_ukinfo,
@@ -443,16 +852,7 @@ class PGCollector(Collector):
             if each_uk_col is None:
                 break
             logger.debug("Got column %s in unique key %s for table %s" % (each_uk_col[1], each_uk_col[0], tablename))
-
-            uk_meta = UKMetaData()
-            uk_meta.uk_name = each_uk_col[0]
-            uk_meta.uk_column = each_uk_col[1]
-            uk_meta.uk_column_index = each_uk_col[2]
-            uk_meta.uk_tablespace = each_uk_col[3]
-
-            uk_meta.name = uk_meta.uk_name
-
-            tb_meta.unique_keys.append(uk_meta)
+            tb_meta.unique_keys.append(self._uk_from_row(each_uk_col))
 
         # Check constraint
         for each_check in self.pgagent.query_all(self.sql_ckinfo,
@@ -461,14 +861,7 @@ class PGCollector(Collector):
             if each_check is None:
                 break
             logger.debug("Got check [%s] for table %s: %s" % (each_check[0], tablename, each_check[1]))
-
-            ck_meta = CheckMetaData()
-            ck_meta.check_name = each_check[0]
-            ck_meta.check_define = each_check[1]
-
-            ck_meta.name = ck_meta.check_name
-
-            tb_meta.checks.append(ck_meta)
+            tb_meta.checks.append(self._check_from_row(each_check))
 
         # Foreign key
         for each_fk in self.pgagent.query_all(self.sql_fkinfo,
@@ -477,15 +870,7 @@ class PGCollector(Collector):
             if each_fk is None:
                 break
             logger.debug("Got column %s in foreign key %s for table %s" % (each_fk[1], each_fk[0], tablename))
-            fk_meta = FKMetaData()
-            fk_meta.fk_name = each_fk[0]
-            fk_meta.fk_column = each_fk[1]
-            fk_meta.fk_ref_tablename = each_fk[2]
-            fk_meta.fk_ref_column = each_fk[3]
-
-            fk_meta.name = fk_meta.fk_name
-
-            tb_meta.foreign_keys.append(fk_meta)
+            tb_meta.foreign_keys.append(self._fk_from_row(each_fk))
 
         # Index
         for each_idx in self.pgagent.query_all(self.sql_indexinfo,
@@ -494,19 +879,60 @@ class PGCollector(Collector):
             if each_idx is None:
                 break
             logger.debug("Got index %s for table %s" % (each_idx[0], tablename))
+            tb_meta.indexes.append(self._index_from_row(each_idx))
 
-            idx_meta = IndexMetaData()
-            idx_meta.index_name = each_idx[0]
-            idx_meta.index_columns = each_idx[1]
-            idx_meta.index_type = each_idx[2]
-            idx_meta.index_tablespace = each_idx[3]
-            idx_meta.index_define = each_idx[4]
+        return tb_meta
 
-            idx_meta.name = idx_meta.index_name
 
-            tb_meta.indexes.append(idx_meta)
+    def _run_bulk_query(self, sql_str, params, row_handler):
+        """Run a bulk query and feed every row to row_handler.
 
-        return tb_meta
+        With extract mode "copy" the query is streamed through COPY, otherwise
+        it goes through the regular query path.
+        """
+        if self.extract_mode == "copy":
+            return self.pgagent.copy_query(sql_str, params, row_handler)
+
+        row_count = 0
+        for each_row in self.pgagent.query_all(sql_str, params):
+            if each_row is None:
+                break
+            row_handler(each_row)
+            row_count += 1
+        return row_count
+
+
+    def get_metadata_tables_bulk(self, schemaname, tablenames):
+        """Get metadata of all given tables in a schema with one query per kind of object.
+
+        :param schemaname: schema name in the target database.
+        :type schemaname: str.
+        :param tablenames: Names of tables in the schema.
+        :type tablenames: list.
+        :returns: Table meta data objects keyed by table name.
+        :rtype: dict.
+        """
+        tables = dict((t, self._new_table_meta(schemaname, t)) for t in tablenames)
+        params = {"schemaname": schemaname}
+
+        def dispatch(row_builder, appender):
+            def handle(row):
+                tb_meta = tables.get(row[0])
+                if tb_meta is not None:
+                    appender(tb_meta, row_builder(row[1:]))
+            return handle
+
+        bulk_steps = (("columns", self.sql_bulk_colinfo, self._column_from_row, self._add_column_to_table),
+                      ("primary keys", self.sql_bulk_pkinfo, self._pk_from_row, lambda t, o: t.primary_key.append(o)),
+                      ("unique keys", self.sql_bulk_ukinfo, self._uk_from_row, lambda t, o: t.unique_keys.append(o)),
+                      ("checks", self.sql_bulk_ckinfo, self._check_from_row, lambda t, o: t.checks.append(o)),
+                      ("foreign keys", self.sql_bulk_fkinfo, self._fk_from_row, lambda t, o: t.foreign_keys.append(o)),
+                      ("indexes", self.sql_bulk_indexinfo, self._index_from_row, lambda t, o: t.indexes.append(o)))
+        for step_name, sql_str, row_builder, appender in bulk_steps:
+            row_count = self._run_bulk_query(sql_str, params, dispatch(row_builder, appender))
+            logger.debug("Got %d rows of %s in schema %s" % (row_count, step_name, schemaname))
+
+        return tables
 
 
     def link_tables_to_database(self, schemaname):
@@ -516,31 +942,34 @@ class PGCollector(Collector):
         :type schemaname: str.
         """
         table_list = self.list_tablenames_in_schema(schemaname)
+        if self.extract_mode != "per_table":
+            bulk_tables = self.get_metadata_tables_bulk(schemaname,
+                                                        [t.tablename for t in table_list])
+
         for each_table in table_list:
             if each_table is None:
                 break
-            table_meta = self.get_metadata_table(schemaname, each_table.tablename)
-            table_meta.table_owner = each_table.owner
-            table_meta.table_tablespace = each_table.tablespace
+            if self.extract_mode != "per_table":
+                table_meta = bulk_tables[each_table.tablename]
+            else:
+                table_meta = self.get_metadata_table(schemaname, each_table.tablename)
+            table_meta.table_owner = intern_str(each_table.owner)
+            table_meta.table_tablespace = intern_str(each_table.tablespace)
             table_meta.table_comment = each_table.comment
 
             self.metadata_bank.add_table(table_meta)
 
 
     def list_views_in_schema(self, schemaname):
-        for each_view in self.pgagent.query_all(self.sql_vwinfo, {"schemaname": schemaname}):
-            if each_view is None:
-                break
-            logger.debug("Got view %s in schema %s" % (each_view[0], schemaname))
+        for each_view in self.list_relations(RELKIND_VIEWS, schemaname):
+            logger.debug("Got view %s in schema %s" % (each_view.relname, schemaname))
 
-            vw_meta = ViewMetaData()
-            vw_meta.view_name = each_view[0]
-            vw_meta.view_schemaname = schemaname
-            vw_meta.view_owner = each_view[1]
-            vw_meta.view_define = each_view[2].replace('\n', ' ')
-            vw_meta.view_comment = each_view[3]
-
-            vw_meta.name = vw_meta.view_name
+            vw_meta = ViewMetaData(name=each_view.relname,
+                                   view_name=each_view.relname,
+                                   view_schemaname=schemaname,
+                                   view_owner=each_view.owner,
+                                   view_define=each_view.define.replace('\n', ' ') if each_view.define is not None else None,
+                                   view_comment=each_view.comment)
 
             self.metadata_bank.add_view(vw_meta)
 
@@ -568,20 +997,22 @@ class PGCollector(Collector):
             self.metadata_bank.add_foreign_server(fsvc_meta)
 
 
-    def get_metadata_foreign_table(self):
-        """Get meta data of a foreign_table in the database."""
-        for each_ftb in self.pgagent.query_all(self.sql_ftbinfo):
-            if each_ftb is None:
-                break
-            logger.debug("Got foreign table %s" % each_ftb[0])
-
-            ftb_meta = FTableMetaData()
-            ftb_meta.foreign_tablename = each_ftb[0]
-            ftb_meta.foreign_schemaname = each_ftb[1]
-            ftb_meta.foreign_server = each_ftb[2]
-            ftb_meta.foreign_data_wrapper = each_ftb[3]
+    def get_metadata_foreign_table(self, skip_schemas=()):
+        """Get meta data of a foreign_table in the database.
 
-            ftb_meta.name = ftb_meta.foreign_tablename
+        :param skip_schemas: Names of schemas whose foreign tables are not collected.
+        :type skip_schemas: Container of str.
+        """
+        for each_ftb in self.list_relations(RELKIND_FOREIGN_TABLES):
+            if each_ftb.schemaname in skip_schemas:
+                continue
+            logger.debug("Got foreign table %s" % each_ftb.relname)
+
+            ftb_meta = FTableMetaData(name=each_ftb.relname,
+                                      foreign_tablename=each_ftb.relname,
+                                      foreign_schemaname=each_ftb.schemaname,
+                                      foreign_server=each_ftb.foreign_server,
+                                      foreign_data_wrapper=each_ftb.foreign_data_wrapper)
 
             self.metadata_bank.add_foreign_table(ftb_meta)
 
@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import logging
+from array import array
+
+from database_schema_collect.MetaDataBank import MetaData
+from database_schema_collect.MetaDataBank import ColumnMetaData
+from database_schema_collect.MetaDataBank import intern_str
+from database_schema_collect.MetaDataBank import register_view
+from database_schema_collect.MetaDataBank import to_struct
+from database_schema_collect.util import format_pg_type
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+# Integer arrays use this for None.
+NULL_INT = -1
+
+
+def _encode_int(value):
+    return NULL_INT if value is None else int(value)
+
+
+def _decode_int(value):
+    return None if value == NULL_INT else value
+
+
+def _encode_bool(value):
+    return NULL_INT if value is None else (1 if value else 0)
+
+
+def _decode_bool(value):
+    return None if value == NULL_INT else value == 1
+
+
+class StringTable(object):
+    """Dictionary encoding of strings, each distinct string gets an integer id."""
+
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+
+
+    def encode(self, value):
+        """Return id of value, add it to the table if it is new."""
+        value_id = self._ids.get(value)
+        if value_id is None:
+            value_id = len(self.values)
+            self.values.append(intern_str(value))
+            self._ids[value] = value_id
+        return value_id
+
+
+    def lookup(self, value):
+        """Return id of value, or None if the table does not hold it."""
+        return self._ids.get(value)
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+class ColumnStore(object):
+    """Columnar copy of all columns of all tables in a bank.
+
+    Every column is one row across parallel arrays. Strings repeated over
+    many columns (names, data types, defaults) are dictionary encoded,
+    comments are kept in a plain list. Columns of one table are contiguous,
+    table_offsets[i]:table_offsets[i+1] are the rows of table i.
+    """
+
+    def __init__(self):
+        self.tables = []
+        self.table_offsets = array('l', [0])
+
+        self.table_ids = array('l')
+        self.ordinals = array('l')
+        self.type_ids = array('l')
+        self.lengths = array('l')
+        self.precisions = array('l')
+        self.scales = array('l')
+        self.nullables = array('b')
+        self.uniques = array('b')
+        self.name_ids = array('l')
+        self.default_ids = array('l')
+        self.auto_inc_ids = array('l')
+        self.in_pk_ids = array('l')
+        self.in_fk_ids = array('l')
+        self.comments = []
+
+        self.types = StringTable()
+        self.names = StringTable()
+        self.others = StringTable()
+
+
+    def __len__(self):
+        return len(self.table_ids)
+
+
+    def add_table(self, tb_metadata):
+        """Append all columns of a table.
+
+        :param tb_metadata: Table metadata object.
+        :type tb_metadata: An instance of TableMetaData.
+        :returns: Id of the table in this store.
+        :rtype: int.
+        """
+        table_id = len(self.tables)
+        self.tables.append(tb_metadata)
+
+        for each_column in tb_metadata.columns:
+            self.table_ids.append(table_id)
+            self.ordinals.append(_encode_int(each_column.column_index))
+            self.type_ids.append(self.types.encode(each_column.column_data_type))
+            self.lengths.append(_encode_int(each_column.column_length))
+            self.precisions.append(_encode_int(each_column.column_precision))
+            self.scales.append(_encode_int(each_column.column_scale))
+            self.nullables.append(_encode_bool(each_column.column_is_nullable))
+            self.uniques.append(_encode_bool(each_column.column_is_unique))
+            self.name_ids.append(self.names.encode(each_column.column_name))
+            self.default_ids.append(self.others.encode(each_column.column_default_value))
+            self.auto_inc_ids.append(self.others.encode(each_column.column_auto_increment))
+            self.in_pk_ids.append(self.others.encode(each_column.column_in_pk))
+            self.in_fk_ids.append(self.others.encode(each_column.column_in_fk))
+            self.comments.append(each_column.column_comment)
+
+        self.table_offsets.append(len(self.table_ids))
+        return table_id
+
+
+    @classmethod
+    def from_bank(cls, bank_obj, replace_columns=False):
+        """Build a column store from all tables of a bank, and attach it to the bank.
+
+        :param bank_obj: The meta data container.
+        :type bank_obj: An instance of DatabaseMetaDataBank.
+        :param replace_columns: Replace columns of tables by lists making
+                                views over the store on access, so the
+                                original objects can be freed.
+        :type replace_columns: bool.
+        :returns: An instance of ColumnStore.
+        """
+        store = cls()
+        for each_table in bank_obj.tables:
+            table_id = store.add_table(each_table)
+            if replace_columns:
+                each_table.columns = store.table_columns(table_id)
+        logger.debug("Column store holds %d columns of %d tables." % (len(store), len(store.tables)))
+
+        bank_obj.column_store = store
+        return store
+
+
+    def table_rows(self, table_id):
+        """Return row range of columns of a table."""
+        return xrange(self.table_offsets[table_id], self.table_offsets[table_id + 1])
+
+
+    def table_columns(self, table_id):
+        """Return columns of a table, as a list making views on access."""
+        return ColumnViewList(self, table_id)
+
+
+    def column(self, row):
+        """Return lazy column view of a row."""
+        return ColumnView(self, row)
+
+
+    def _as_ndarray(self, arr):
+        return np.frombuffer(arr, dtype=np.dtype(arr.typecode)) if len(arr) > 0 else np.zeros(0, dtype=arr.typecode)
+
+
+    def select(self, data_types=None, nullable=None, table_ids=None):
+        """Return rows of columns matching all given conditions.
+
+        Example, all nullable timestamp columns:
+            store.select(data_types=("timestamp without time zone",), nullable=True)
+
+        :param data_types: Accepted data types.
+        :type data_types: tuple.
+        :param nullable: Wanted nullable flag.
+        :type nullable: bool.
+        :param table_ids: Accepted table ids.
+        :type table_ids: tuple.
+        :returns: Row numbers.
+        :rtype: list.
+        """
+        type_ids = None
+        if data_types is not None:
+            type_ids = set(i for i in (self.types.lookup(t) for t in data_types) if i is not None)
+            if not type_ids:
+                return []
+
+        if np is not None:
+            mask = np.ones(len(self), dtype=bool)
+            if type_ids is not None:
+                mask &= np.in1d(self._as_ndarray(self.type_ids), list(type_ids))
+            if nullable is not None:
+                mask &= self._as_ndarray(self.nullables) == _encode_bool(nullable)
+            if table_ids is not None:
+                mask &= np.in1d(self._as_ndarray(self.table_ids), list(table_ids))
+            return np.nonzero(mask)[0].tolist()
+
+        rows = xrange(len(self))
+        if type_ids is not None:
+            type_col = self.type_ids
+            rows = [r for r in rows if type_col[r] in type_ids]
+        if nullable is not None:
+            wanted, null_col = _encode_bool(nullable), self.nullables
+            rows = [r for r in rows if null_col[r] == wanted]
+        if table_ids is not None:
+            table_ids, table_col = set(table_ids), self.table_ids
+            rows = [r for r in rows if table_col[r] in table_ids]
+        return list(rows)
+
+
+    def formatted_types(self, rows=None):
+        """Format column types like format_pg_col_str for many rows at once.
+
+        Each distinct (type, length, precision, scale) combination is
+        formatted only once.
+
+        :param rows: Row numbers, all rows if None.
+        :type rows: list.
+        :returns: Type strings in the order of rows.
+        :rtype: list.
+        """
+        if rows is None:
+            rows = xrange(len(self))
+
+        cache = {}
+        result = []
+        type_values = self.types.values
+        for r in rows:
+            key = (self.type_ids[r], self.lengths[r], self.precisions[r], self.scales[r])
+            col_type = cache.get(key)
+            if col_type is None:
+                col_type = format_pg_type(type_values[key[0]],
+                                          _decode_int(key[1]),
+                                          _decode_int(key[2]),
+                                          _decode_int(key[3]))
+                cache[key] = col_type
+            result.append(col_type)
+        return result
+
+
+def _int_field(arr_name):
+    def fget(self):
+        return _decode_int(getattr(self._store, arr_name)[self._row])
+
+    def fset(self, value):
+        getattr(self._store, arr_name)[self._row] = _encode_int(value)
+    return property(fget, fset)
+
+
+def _bool_field(arr_name):
+    def fget(self):
+        return _decode_bool(getattr(self._store, arr_name)[self._row])
+
+    def fset(self, value):
+        getattr(self._store, arr_name)[self._row] = _encode_bool(value)
+    return property(fget, fset)
+
+
+def _encoded_field(arr_name, table_name):
+    def fget(self):
+        return getattr(self._store, table_name).values[getattr(self._store, arr_name)[self._row]]
+
+    def fset(self, value):
+        getattr(self._store, arr_name)[self._row] = getattr(self._store, table_name).encode(value)
+    return property(fget, fset)
+
+
+def _list_field(list_name):
+    def fget(self):
+        return getattr(self._store, list_name)[self._row]
+
+    def fset(self, value):
+        getattr(self._store, list_name)[self._row] = value
+    return property(fget, fset)
+
+
+class ColumnView(MetaData):
+    """Column meta data read from a row of a ColumnStore on access.
+
+    It has none of the slots of ColumnMetaData, every field is read from
+    and written to the arrays of the store.
+    """
+
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row):
+        self._store = store
+        self._row = row
+
+
+    @classmethod
+    def field_names(cls):
+        return ColumnMetaData.field_names()
+
+
+    def __reduce__(self):
+        # Pickled as a plain column, the store is not carried along.
+        return (ColumnMetaData, (), self.__getstate__())
+
+
+    # name of a column is always its column_name, both map to name_ids.
+    name = _encoded_field("name_ids", "names")
+    column_name = _encoded_field("name_ids", "names")
+    column_index = _int_field("ordinals")
+    column_data_type = _encoded_field("type_ids", "types")
+    column_length = _int_field("lengths")
+    column_scale = _int_field("scales")
+    column_precision = _int_field("precisions")
+    column_comment = _list_field("comments")
+    column_default_value = _encoded_field("default_ids", "others")
+    column_auto_increment = _encoded_field("auto_inc_ids", "others")
+    column_is_nullable = _bool_field("nullables")
+    column_is_unique = _bool_field("uniques")
+    column_in_pk = _encoded_field("in_pk_ids", "others")
+    column_in_fk = _encoded_field("in_fk_ids", "others")
+
+
+register_view(ColumnView, ColumnMetaData)
+
+
+class ColumnViewList(object):
+    """Read only list of columns of a table in a ColumnStore.
+
+    Views are made on access and not kept, memory use follows what the
+    caller holds on to.
+    """
+
+    def __init__(self, store, table_id):
+        self._store = store
+        self._table_id = table_id
+
+
+    def _rows(self):
+        return self._store.table_rows(self._table_id)
+
+
+    def __len__(self):
+        return len(self._rows())
+
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+
+    __bool__ = __nonzero__
+
+
+    def __iter__(self):
+        for each_row in self._rows():
+            yield ColumnView(self._store, each_row)
+
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            first_row = self._store.table_offsets[self._table_id]
+            return [ColumnView(self._store, first_row + i) for i in xrange(*key.indices(len(self)))]
+        return ColumnView(self._store, self._rows()[key])
+
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, ColumnViewList)):
+            return len(self) == len(other) and [to_struct(c) for c in self] == [to_struct(c) for c in other]
+        return NotImplemented
+
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+
+    def __reduce__(self):
+        # Pickled as a plain list of columns, the store is not carried along.
+        return (list, (list(self),))
+
+
+    def __repr__(self):
+        return "<ColumnViewList of {} columns>".format(len(self))
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import zlib
+import logging
+from io import BytesIO
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+# Bytes read from a stream at once.
+STREAM_CHUNK_SIZE = 1 << 20
+# Bytes enough to hold the magic of every codec.
+MAGIC_SIZE = 4
+
+
+class CompressingWriter(object):
+    """File object compressing everything written to it into a file."""
+
+    def __init__(self, file_path, compressobj):
+        """
+        :param file_path: Path of the compressed file.
+        :type file_path: str.
+        :param compressobj: Object with compress(data) and flush().
+        """
+        self._wf = open(file_path, "wb")
+        self._compressobj = compressobj
+
+
+    def write(self, data):
+        chunk = self._compressobj.compress(data)
+        if chunk:
+            self._wf.write(chunk)
+
+
+    def close(self):
+        if self._wf.closed:
+            return
+        self._wf.write(self._compressobj.flush())
+        self._wf.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class _PrefixedReader(object):
+    """File object reading bytes already read from a stream, then the rest
+    of the stream."""
+
+    def __init__(self, head, rf):
+        self._head = head
+        self._rf = rf
+
+
+    def read(self, size=-1):
+        if not self._head:
+            return self._rf.read(size)
+        if size is None or size < 0:
+            data = self._head + self._rf.read()
+            self._head = b""
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        return data
+
+
+    def close(self):
+        self._rf.close()
+
+
+class _MembersReader(object):
+    """File object decompressing a stream of concatenated gzip members or
+    lz4 frames, STREAM_CHUNK_SIZE compressed bytes at a time."""
+
+    def __init__(self, rf, decompressobj):
+        """
+        :param rf: Compressed stream.
+        :param decompressobj: Returns a decompressor of one member, with
+                              decompress(data) and unused_data.
+        """
+        self._rf = rf
+        self._decompressobj = decompressobj
+        self._decompressor = None
+        self._chunks = []
+        self._buffered = 0
+        self._eof = False
+
+
+    def _fill(self):
+        raw = self._rf.read(STREAM_CHUNK_SIZE)
+        if not raw:
+            self._eof = True
+            return
+        while raw:
+            if self._decompressor is None:
+                self._decompressor = self._decompressobj()
+            chunk = self._decompressor.decompress(raw)
+            if chunk:
+                self._chunks.append(chunk)
+                self._buffered += len(chunk)
+            # What follows the end of a member starts the next one.
+            raw = self._decompressor.unused_data
+            if raw or getattr(self._decompressor, "eof", False):
+                self._decompressor = None
+
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while not self._eof:
+                self._fill()
+            size = self._buffered
+        else:
+            while not self._eof and self._buffered < size:
+                self._fill()
+        buffered = b"".join(self._chunks)
+        data, rest = buffered[:size], buffered[size:]
+        self._chunks = [rest] if rest else []
+        self._buffered = len(rest)
+        return data
+
+
+    def close(self):
+        self._rf.close()
+
+
+class GzipCodec(object):
+    """Gzip, always available."""
+
+    name = "gzip"
+    magic = b"\x1f\x8b"
+    default_level = 6
+
+    def __init__(self, level=None):
+        self.level = self.default_level if level is None else level
+
+
+    def compressobj(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+    def compress(self, data):
+        """Compress data into one complete gzip member."""
+        compressor = self.compressobj()
+        return compressor.compress(data) + compressor.flush()
+
+
+    @staticmethod
+    def decompress(data):
+        # Concatenated members are one valid gzip file.
+        chunks = []
+        while data:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunks.append(decompressor.decompress(data))
+            data = decompressor.unused_data
+        return b"".join(chunks)
+
+
+    @staticmethod
+    def stream_reader(rf):
+        return _MembersReader(rf, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+
+
+class ZstdCodec(object):
+    """Zstandard, needs the zstandard package."""
+
+    name = "zstd"
+    magic = b"\x28\xb5\x2f\xfd"
+    default_level = 3
+
+    def __init__(self, level=None):
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package.")
+        self.level = self.default_level if level is None else level
+
+
+    def compressobj(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+
+    @staticmethod
+    def decompress(data):
+        if zstandard is None:
+            raise ValueError("zstd compressed content needs the zstandard package.")
+        reader = zstandard.ZstdDecompressor().stream_reader(BytesIO(data), read_across_frames=True)
+        return reader.read()
+
+
+    @staticmethod
+    def stream_reader(rf):
+        if zstandard is None:
+            raise ValueError("zstd compressed content needs the zstandard package.")
+        return zstandard.ZstdDecompressor().stream_reader(rf, read_across_frames=True)
+
+
+class _Lz4CompressObj(object):
+    """compress/flush interface over an LZ4 frame compressor."""
+
+    def __init__(self, level):
+        self._compressor = lz4_frame.LZ4FrameCompressor(compression_level=level)
+        self._header = self._compressor.begin()
+
+
+    def compress(self, data):
+        chunk = self._header + self._compressor.compress(data)
+        self._header = b""
+        return chunk
+
+
+    def flush(self):
+        chunk = self._header + self._compressor.flush()
+        self._header = b""
+        return chunk
+
+
+class Lz4Codec(object):
+    """LZ4 frames, needs the lz4 package."""
+
+    name = "lz4"
+    magic = b"\x04\x22\x4d\x18"
+    default_level = 0
+
+    def __init__(self, level=None):
+        if lz4_frame is None:
+            raise ValueError("lz4 compression needs the lz4 package.")
+        self.level = self.default_level if level is None else level
+
+
+    def compressobj(self):
+        return _Lz4CompressObj(self.level)
+
+
+    def compress(self, data):
+        return lz4_frame.compress(data, compression_level=self.level)
+
+
+    @staticmethod
+    def decompress(data):
+        if lz4_frame is None:
+            raise ValueError("lz4 compressed content needs the lz4 package.")
+        chunks = []
+        while data:
+            decompressor = lz4_frame.LZ4FrameDecompressor()
+            chunks.append(decompressor.decompress(data))
+            data = decompressor.unused_data
+        return b"".join(chunks)
+
+
+    @staticmethod
+    def stream_reader(rf):
+        if lz4_frame is None:
+            raise ValueError("lz4 compressed content needs the lz4 package.")
+        return _MembersReader(rf, lz4_frame.LZ4FrameDecompressor)
+
+
+CODECS = (GzipCodec, ZstdCodec, Lz4Codec)
+
+
+def get_codec(name, level=None):
+    """Return the codec of a compression name.
+
+    :param name: none|gzip|zstd|lz4.
+    :type name: str.
+    :param level: Compression level, default level of the codec if None.
+    :type level: int.
+    :returns: A codec, None for none.
+    :raises: ValueError.
+    """
+    name = "none" if name is None else name.strip().lower()
+    if name == "none":
+        return None
+    for each_codec in CODECS:
+        if each_codec.name == name:
+            return each_codec(level)
+    raise ValueError("Valid compressions are: none|{}, got {}".format("|".join(c.name for c in CODECS), name))
+
+
+def available_codecs():
+    """Return names of codecs usable in this environment."""
+    names = []
+    for each_codec in CODECS:
+        try:
+            each_codec()
+        except ValueError:
+            continue
+        names.append(each_codec.name)
+    return names
+
+
+def open_writer(file_path, codec=None):
+    """Open a file for binary writing, compressed by codec if it is not None."""
+    if codec is None:
+        return open(file_path, "wb")
+    return CompressingWriter(file_path, codec.compressobj())
+
+
+def codec_of(data):
+    """Return codec class of compressed content, None if it is not compressed."""
+    if data is None:
+        return None
+    for each_codec in CODECS:
+        if data[:len(each_codec.magic)] == each_codec.magic:
+            return each_codec
+    return None
+
+
+def decompress(data):
+    """Decompress content if it starts with the magic of a known codec,
+    return it unchanged otherwise."""
+    codec = codec_of(data)
+    if codec is None:
+        return data
+    return codec.decompress(data[:])
+
+
+def open_reader(rf):
+    """Return a file object reading the decompressed content of a binary
+    stream if it starts with the magic of a known codec, a file object
+    reading the stream unchanged otherwise.
+
+    :param rf: Binary stream, only its read method is used.
+    """
+    head = rf.read(MAGIC_SIZE)
+    stream = _PrefixedReader(head, rf)
+    codec = codec_of(head)
+    if codec is None:
+        return stream
+    return codec.stream_reader(stream)
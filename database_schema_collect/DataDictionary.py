@@ -13,6 +13,8 @@ from openpyxl import Workbook
 from openpyxl.styles import Font, Color
 from openpyxl.styles import colors, PatternFill, Border, Side, Alignment
 
+from database_schema_collect.MetaDataBank import schema_templates
+
 reload(sys)
 sys.setdefaultencoding("utf-8")
 
@@ -53,6 +55,8 @@ class DataDictionary(object):
                                      bottom=Side(border_style="thin",
                                                  color='FF000000'))
         self.default_align = Alignment(shrink_to_fit=False)
+        # Tables and views of tenant schemas are those of their template schema.
+        self.tenants = schema_templates(bank_obj)
 
 
     def save_excel(self):
@@ -134,11 +138,19 @@ class DataDictionary(object):
         ws_toc["B4"].font = self.default_link_font
 
         ridx_start = 5
+        # Link to tenant schemas
+        if self.tenants:
+            ws_toc["A5"] = '-'
+            ws_toc["B5"] = '=HYPERLINK("{}", "{}")'.format("#Tenants!A2", "Tenants")
+            ws_toc["C5"] = "schema"
+            ws_toc["D5"] = "Schemas with the same tables and views as another schema."
+            self._change_cell_style(ws_toc, "A5:D5", None, None, None, None)
+            ws_toc["B5"].font = self.default_link_font
+            ridx_start = 6
         ridx = ridx_start - 1
         # Link to all tables
         if self.bank_obj.tables is not None and self.bank_obj.tables != []:
-            sorted_tables = sorted(self.bank_obj.tables, key=lambda x: x.table_schemaname)
-            for each_table in sorted_tables:
+            for each_table in self._iter_tables_by_schema():
                 ridx += 1
                 fulltablename = "{}.{}".format(each_table.table_schemaname, each_table.table_name)
                 ws_toc.cell(row=ridx, column=1).value = each_table.table_schemaname
@@ -202,6 +214,53 @@ class DataDictionary(object):
         self._change_cell_style(ws_tbs, cell_range, None, None, None, None)
 
 
+    def gen_tenants_sheet(self):
+        """Generate a list of tenant schemas and their template schema."""
+        if not self.tenants:
+            return
+        logger.info("Generate one sheet for list tenant schemas.")
+
+        ws_tnt = self.des_excel.create_sheet("Tenants", self.sheet_index)
+        self.sheet_index += 1
+        ws_tnt.sheet_properties.tabColor = "14CAD4"
+
+        ws_tnt["A1"] = "List of schemas with the same tables and views as their template schema"
+        ws_tnt["A1"].font = self.default_font
+
+        ws_tnt["A3"] = "Schema"
+        ws_tnt["B3"] = "Template"
+        self._change_cell_style(ws_tnt,
+                                "A3:B3",
+                                self.default_header_font,
+                                self.default_header_border,
+                                PatternFill("solid", fgColor="14CAD4"),
+                                self.default_header_align)
+
+        ridx_start = 3
+        ridx = ridx_start
+        for template_name, tenant_names in self.tenants.items():
+            for each_tenant in tenant_names:
+                ridx += 1
+                ws_tnt.cell(row=ridx, column=1).value = each_tenant
+                ws_tnt.cell(row=ridx, column=2).value = template_name
+        cell_range = "A{!s}:B{!s}".format(ridx_start+1, ridx)
+        logger.debug("[Tenants] Apply style to range: %s" % cell_range)
+        self._change_cell_style(ws_tnt, cell_range, None, None, None, None)
+
+
+    def _iter_tables_by_schema(self):
+        """Iter tables ordered by schema name, one at a time.
+
+        Only (schema name, position) keys are sorted, spilled tables are
+        read back when their turn comes instead of all at once.
+        """
+        tables = self.bank_obj.tables
+        keys = [(each_table.table_schemaname, position) for position, each_table in enumerate(tables)]
+        keys.sort()
+        for _, position in keys:
+            yield tables[position]
+
+
     def gen_table_sheet(self):
         """Generate a sheet contains information of a table."""
         logger.info("Generate one sheet for one table, including indexes, foreign keys and other constraints belong to this table.")
@@ -217,8 +276,7 @@ class DataDictionary(object):
         ptn_ck_header = PatternFill("solid", fgColor="D4C69B")
         ptn_idx_header = PatternFill("solid", fgColor="EE82EE")
 
-        sorted_tables = sorted(self.bank_obj.tables, key=lambda x: x.table_schemaname)
-        for each_table in sorted_tables:
+        for each_table in self._iter_tables_by_schema():
             fulltablename = "{}.{}".format(each_table.table_schemaname, each_table.table_name)
             logger.info("Create sheet for table %s" % fulltablename)
             ws_tb = self.des_excel.create_sheet(fulltablename, self.sheet_index)
@@ -493,6 +551,7 @@ class DataDictionary(object):
         """Generate the whole data dictionanry"""
         self.gen_toc_sheet()
         self.gen_tablspaces_sheet()
+        self.gen_tenants_sheet()
         self.gen_table_sheet()
         self.gen_view_sheet()
         self.save_excel()
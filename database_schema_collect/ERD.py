@@ -12,6 +12,7 @@ import traceback
 from graphviz import Digraph
 
 from database_schema_collect.util import format_pg_col_str
+from database_schema_collect.MetaDataBank import schema_templates
 
 reload(sys)
 sys.setdefaultencoding("utf-8")
@@ -67,7 +68,7 @@ class ERD(object):
         return tpl
 
 
-    def element_schema(self, schema_name, gv_path, r_path, other_defines):
+    def element_schema(self, schema_name, gv_path, r_path, other_defines, tenant_names=None):
         """Scope of a schema.
 
         :param schema_name: Schema name.
@@ -78,6 +79,8 @@ class ERD(object):
         :type r_path: str.
         :param other_defines: List of expressoins.
         :type other_defines: list.
+        :param tenant_names: Schemas with the same tables and views as this one.
+        :type tenant_names: list.
 
         :returns: Definition of tables and views in a schema in graphviz format.
         :rtype: An instance of Digraph.
@@ -89,7 +92,12 @@ class ERD(object):
         edge_param = {"arrowhead": "crow",
                       "arrowtail": "none",
                       "dir": "both"}
+        if tenant_names:
+            comment = "Also the diagram of schemas: {}".format(", ".join(tenant_names))
+        else:
+            comment = None
         g = Digraph(schema_name,
+                    comment=comment,
                     filename=gv_path,
                     directory=r_path,
                     node_attr=node_param,
@@ -126,30 +134,35 @@ class ERD(object):
         :param erd_path: Directory for storing erd definition text files and image files.
         :type erd_path: str.
         """
-        schema_reg_tables = {}
         dbname = bank_obj.database.database_name
 
         if os.path.exists(erd_path):
             logger.debug("Destination [%s] exists, remove!" % erd_path)
             shutil.rmtree(erd_path)
+        os.makedirs(erd_path)
 
-        for each_tb in bank_obj.tables:
-            schema_name = each_tb.table_schemaname
-            schema_reg_tables.setdefault(schema_name, [])
-            schema_reg_tables[schema_name].append(("table", each_tb))
+        # Tenant schemas have no objects of their own, they are drawn once
+        # with their template schema.
+        tenants = schema_templates(bank_obj)
 
-            for each_fk in each_tb.foreign_keys:
-                schema_reg_tables[schema_name].append(("fk",
-                                                       (each_tb.table_name,each_fk.fk_ref_tablename)))
+        # One schema at a time, only objects of that schema are held.
+        for smname in bank_obj.schema_names():
+            objs_in_sm = []
+            for each_tb in bank_obj.iter_tables(smname):
+                objs_in_sm.append(("table", each_tb))
 
-        for each_vw in bank_obj.views:
-            schema_name = each_vw.view_schemaname
-            schema_reg_tables.setdefault(schema_name, [])
-            schema_reg_tables[schema_name].append(("view", each_vw))
+                for each_fk in each_tb.foreign_keys:
+                    objs_in_sm.append(("fk",
+                                       (each_tb.table_name,each_fk.fk_ref_tablename)))
+
+            for each_vw in bank_obj.iter_views(smname):
+                objs_in_sm.append(("view", each_vw))
+
+            if not objs_in_sm:
+                continue
 
-        for smname, objs_in_sm in schema_reg_tables.items():
             gv_filepath = os.path.join(erd_path, "erd_{}_{}".format(dbname, smname))
-            g = self.element_schema(smname, gv_filepath, erd_path, objs_in_sm)
+            g = self.element_schema(smname, gv_filepath, erd_path, objs_in_sm, tenants.get(smname))
             logger.debug("Save dot file [{fn}] and render png file [{fn}.{fs}]".format(fn=gv_filepath,
                                                                                        fs=self.out_image_type))
             try:
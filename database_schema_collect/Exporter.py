@@ -5,13 +5,13 @@ from __future__ import absolute_import
 
 import sys
 import os
-import shutil
 import logging
 import traceback
 from abc import abstractmethod
 from itertools import groupby
 
 from database_schema_collect.util import format_pg_col_str
+from database_schema_collect.MetaDataBank import schema_templates
 from database_schema_collect.ERD import ERD
 from database_schema_collect.DataDictionary import DataDictionary
 
@@ -75,6 +75,9 @@ class PGExporter(Exporter):
 
         self.tpl_ddl_schema = """CREATE SCHEMA IF NOT EXISTS {smname};"""
         self.tpl_ddl_schema_owner = """ALTER SCHEMA {smname} OWNER TO {smowner};"""
+        self.tpl_ddl_schema_template = """-- Same tables as schema {smtpl}, with the schema name replaced."""
+        self.tpl_ddl_tenants = "-- Tables of schema {smname} are also those of schemas, " + \
+                               "with the schema name replaced: {tenants}"
 
         self.tpl_ddl_table_part1 = "DROP TABLE IF EXISTS {fulltbname} CASCADE;\n" + \
                                    "CREATE TABLE IF NOT EXISTS {fulltbname}\n" + \
@@ -108,10 +111,13 @@ class PGExporter(Exporter):
         """
         last_dir_name = "ddl"
         dbname = self.bank_obj.database.database_name
-        topdir = os.path.join(self.temp_dir, last_dir_name)
-        if not os.path.exists(topdir):
-            os.makedirs(topdir)
+        with des_loc.open_write_dir(os.path.join(des_dir, last_dir_name), self.temp_dir) as staged_dir:
+            logger.debug("Write ddl files at %s" % staged_dir.path)
+            self._write_ddl_files(staged_dir.path, dbname)
 
+
+    def _write_ddl_files(self, topdir, dbname):
+        """Write sql files of the database and its tables to topdir."""
         # DDL for database, not support foreign server, search_path, users, etc.
         with open(os.path.join(topdir, "ddl_database_{}.sql".format(dbname)), "w+") as dwf:
             # tablespaces
@@ -155,13 +161,25 @@ class PGExporter(Exporter):
                     dwf.write(self.tpl_ddl_schema_owner.format(smname=each_schema.schema_name,
                                                                smowner=each_schema.schema_owner))
                     dwf.write('\n')
+                if each_schema.schema_template is not None:
+                    dwf.write(self.tpl_ddl_schema_template.format(smtpl=each_schema.schema_template))
+                    dwf.write('\n')
 
         # DDL for tables and views, not support foreign table yet.
+        tenants = schema_templates(self.bank_obj)
         with open(os.path.join(topdir, "ddl_table_{}.sql".format(dbname)), "w+") as twf:
+            last_schemaname = None
             for each_tb in self.bank_obj.tables:
                 fulltbname = "{}.{}".format(each_tb.table_schemaname, each_tb.table_name)
                 logger.info("Generate DDL for table %s" % fulltbname)
 
+                # Tables of tenant schemas are written once, under their template.
+                if each_tb.table_schemaname != last_schemaname and each_tb.table_schemaname in tenants:
+                    twf.write(self.tpl_ddl_tenants.format(smname=each_tb.table_schemaname,
+                                                          tenants=', '.join(tenants[each_tb.table_schemaname])))
+                    twf.write('\n\n')
+                last_schemaname = each_tb.table_schemaname
+
                 if each_tb.table_comment is not None and each_tb.table_comment.strip() != '':
                     head_comment = "-- {} :: {}".format(fulltbname, each_tb.table_comment)
                 else:
@@ -313,15 +331,6 @@ class PGExporter(Exporter):
 
                 twf.write('\n\n')
 
-        if not os.path.exists(des_dir):
-            os.makedirs(des_dir)
-
-        if os.path.exists(os.path.join(des_dir, last_dir_name)):
-            shutil.rmtree(os.path.join(des_dir, last_dir_name))
-
-        logger.debug("Move all ddl files from %s to %s" % (topdir, des_dir))
-        des_loc.move_file_to(topdir, des_dir)
-
 
     def exp_data_dict_excel(self, des_loc, des_dir):
         """Export meta data to Excel file.
@@ -334,22 +343,10 @@ class PGExporter(Exporter):
         last_dir_name = "dict"
         dbname = self.bank_obj.database.database_name
 
-        topdir = os.path.join(self.temp_dir, last_dir_name)
-        if not os.path.exists(topdir):
-            os.makedirs(topdir)
-
-        writer = DataDictionary(dbname, self.bank_obj, topdir)
-        logger.info("Generate data dictionary of database %s" % dbname)
-        writer.gen_dictionanry()
-
-        if not os.path.exists(des_dir):
-            os.makedirs(des_dir)
-
-        if os.path.exists(os.path.join(des_dir, last_dir_name)):
-            shutil.rmtree(os.path.join(des_dir, last_dir_name))
-
-        logger.debug("Move data dictionary file from %s to %s" % (topdir, des_dir))
-        des_loc.move_file_to(topdir, des_dir)
+        with des_loc.open_write_dir(os.path.join(des_dir, last_dir_name), self.temp_dir) as staged_dir:
+            writer = DataDictionary(dbname, self.bank_obj, staged_dir.path)
+            logger.info("Generate data dictionary of database %s" % dbname)
+            writer.gen_dictionanry()
 
 
     def exp_db_erd(self, des_loc, des_dir):
@@ -364,18 +361,6 @@ class PGExporter(Exporter):
         dbname = self.bank_obj.database.database_name
         drawer = ERD()
 
-        topdir = os.path.join(self.temp_dir, last_dir_name)
-        if not os.path.exists(topdir):
-            os.makedirs(topdir)
-
-        logger.info("Generate define file of ERD of database %s" % dbname)
-        drawer.gen_erd(self.bank_obj, topdir)
-
-        if not os.path.exists(des_dir):
-            os.makedirs(des_dir)
-
-        if os.path.exists(os.path.join(des_dir, last_dir_name)):
-            shutil.rmtree(os.path.join(des_dir, last_dir_name))
-
-        logger.debug("Move all erd files from %s to %s" % (topdir, des_dir))
-        des_loc.move_file_to(topdir, des_dir)
+        with des_loc.open_write_dir(os.path.join(des_dir, last_dir_name), self.temp_dir) as staged_dir:
+            logger.info("Generate define file of ERD of database %s" % dbname)
+            drawer.gen_erd(self.bank_obj, staged_dir.path)
@@ -5,19 +5,50 @@ from __future__ import absolute_import
 
 import sys
 import os
+import mmap
 import shutil
+import tempfile
 import logging
+import traceback
+from functools import partial
 
 import cPickle as pickle
+import simplejson as json
 from marshmallow import pprint
 
 from database_schema_collect.Collector import PGCollector
 from database_schema_collect.Location import LocalLocation
 from database_schema_collect.Location import HDFSLocation
+from database_schema_collect.Location import ObjectStoreLocation
+from database_schema_collect.Location import S3_DEFAULT_REGION
+from database_schema_collect.Location import CachedLocation
+from database_schema_collect.Location import AsyncUploadLocation
+from database_schema_collect.ReadCache import ReadCache
+from database_schema_collect.ReadCache import DEFAULT_MAX_MB as DEFAULT_CACHE_MAX_MB
 from database_schema_collect.MetaDataBank import MetaDataBank
-from database_schema_collect.MetaDataBank import DatabaseMetaDataBankSchema
+from database_schema_collect.MetaDataBank import from_struct
+from database_schema_collect.MetaDataBank import select_objects
+from database_schema_collect.ColumnStore import ColumnStore
+from database_schema_collect import BankFormat
+from database_schema_collect import SQLiteBank
+from database_schema_collect.TextBlob import DEFAULT_MIN_SIZE
+from database_schema_collect.TextBlob import TextFileStore
+from database_schema_collect.MetaArchive import JsonLinesArchiveWriter
+from database_schema_collect import Compression
 from database_schema_collect.Exporter import PGExporter
+from database_schema_collect.SnapshotStore import SnapshotStore
+from database_schema_collect.SnapshotStore import DEFAULT_CHECKPOINT_INTERVAL
+from database_schema_collect.SnapshotStore import parse_as_of
+from database_schema_collect.SchemaDiff import BankDigest
+from database_schema_collect.SchemaDiff import diff_banks
+from database_schema_collect.SchemaDiff import format_report
+from database_schema_collect.SearchIndex import SearchIndex
+from database_schema_collect.SearchIndex import dump_index
 from database_schema_collect.util import BANK_NAME_PATTERN
+from database_schema_collect.util import HISTORY_DIR_PATTERN
+from database_schema_collect.util import DIGEST_NAME_PATTERN
+from database_schema_collect.util import SEARCH_INDEX_NAME_PATTERN
+from database_schema_collect.util import conf_get
 
 reload(sys)
 sys.setdefaultencoding("utf-8")
@@ -26,6 +57,10 @@ sys.setdefaultencoding("utf-8")
 logger = logging.getLogger("database_schema_collect")
 
 
+# Name of binary banks cached for pickle banks and snapshot versions.
+DECODED_BANK = "decoded_bank"
+
+
 class PGMetadataHandler(object):
     """Meta data handler for PostgreSQL."""
 
@@ -33,6 +68,12 @@ class PGMetadataHandler(object):
         self.conf = conf_obj
 
 
+    def _max_bank_memory_bytes(self):
+        """Return memory budget of tables of a bank, None if there is none."""
+        max_mb = conf_get(self.conf, "local", "max_bank_memory_mb", "").strip()
+        return int(float(max_mb) * 1024 * 1024) if max_mb else None
+
+
     def collect_metadata(self, db_uri, metabank):
         """Collect meta data of all supported database objects
 
@@ -42,7 +83,8 @@ class PGMetadataHandler(object):
         :param metabank: An instance of MetaDataBank.
         :returns: An instance of MetaDataBank which store collected meta data.
         """
-        collector = PGCollector(db_uri, metabank)
+        collector = PGCollector(db_uri, metabank,
+                                extract_mode=conf_get(self.conf, "datasource", "extract_mode", "per_table"))
         target_database_name = self.conf.get("datasource", "dbname")
 
         logger.info("Gather meta data for database: %s" % target_database_name)
@@ -54,12 +96,23 @@ class PGMetadataHandler(object):
         logger.info("Gather meta data of foreign servers.")
         collector.get_metadata_foreign_server()
 
+        schemanames = collector.list_schemas_in_database(target_database_name)
+        if conf_get(self.conf, "datasource", "dedup_tenant_schemas", "false").lower() == "true":
+            logger.info("Find schemas with the same structure.")
+            templates = collector.find_schema_templates(schemanames)
+        else:
+            templates = {}
+
         logger.info("Gather meta data of foreign tables.")
-        collector.get_metadata_foreign_table()
+        collector.get_metadata_foreign_table(skip_schemas=templates)
 
-        for each_schema in collector.list_schemas_in_database(target_database_name):
+        for each_schema in schemanames:
             if each_schema is None:
                 break
+            if each_schema in templates:
+                logger.debug("Schema %s has the same structure as %s, skip it." % (each_schema,
+                                                                                  templates[each_schema]))
+                continue
             logger.info("Gather meta data of tables in schema %s" % each_schema)
             collector.link_tables_to_database(each_schema)
 
@@ -77,30 +130,369 @@ class PGMetadataHandler(object):
         :param store_loc: Object represents store location.
         :type store_loc: An instance of Location.
         """
+        text_min_size = int(conf_get(self.conf, "storage", "text_blob_min_size", DEFAULT_MIN_SIZE))
+        compress_text = conf_get(self.conf, "storage", "text_blob_compress", "true").lower() == "true"
+
+        bank_format = conf_get(self.conf, "storage", "bank_format", "binary").lower()
+        if bank_format == "binary":
+            bank_dumper = partial(BankFormat.dump_bank,
+                                  text_min_size=text_min_size,
+                                  compress_text=compress_text)
+        elif bank_format == "pickle":
+            bank_dumper = None
+        elif bank_format == "sqlite":
+            bank_dumper = partial(SQLiteBank.dump_bank,
+                                  temp_dir=self.conf.get("local", "temp_work_dir"))
+        else:
+            raise ValueError("Valid bank formats are: binary|pickle|sqlite, got {}".format(bank_format))
+
+        if conf_get(self.conf, "storage", "text_blob_in_json", "false").lower() == "true":
+            text_store = TextFileStore(text_min_size, compress_text)
+        else:
+            text_store = None
+
+        if self._max_bank_memory_bytes() is not None and bank_format == "pickle":
+            logger.warning("Pickle banks are built in memory at once, beyond max_bank_memory_mb.")
+
+        metadata_layout = conf_get(self.conf, "storage", "metadata_layout", "files").lower()
+        if metadata_layout == "files":
+            archive_writer = None
+        elif metadata_layout == "jsonl":
+            archive_writer = JsonLinesArchiveWriter
+        else:
+            raise ValueError("Valid metadata layouts are: files|jsonl, got {}".format(metadata_layout))
+
+        compression_level = conf_get(self.conf, "storage", "compression_level", "").strip()
+        compression = Compression.get_codec(conf_get(self.conf, "storage", "compression", "none"),
+                                            int(compression_level) if compression_level else None)
+
         metabank.iter_and_save_metadata(store_loc,
-                                        self.conf.get("storage", "directory"))
+                                        self.conf.get("storage", "directory"),
+                                        bank_dumper=bank_dumper,
+                                        text_store=text_store,
+                                        archive_writer=archive_writer,
+                                        compression=compression,
+                                        serialize_workers=int(conf_get(self.conf, "local", "serialize_workers", 1)),
+                                        io_workers=int(conf_get(self.conf, "local", "io_workers", 4)),
+                                        skip_unchanged=conf_get(self.conf, "storage", "skip_unchanged", "true").lower() == "true")
+
+        dbname = self.conf.get("datasource", "dbname")
+        digest_path = os.path.join(self.conf.get("storage", "directory"), dbname,
+                                   DIGEST_NAME_PATTERN.format(dbname))
+        if conf_get(self.conf, "storage", "bank_digest", "true").lower() == "true":
+            logger.info("Save hashes of all objects to %s" % digest_path)
+            bank_status = store_loc.file_status(self._metabank_file_path())
+            with store_loc.open_write(digest_path, self.conf.get("local", "temp_work_dir")) as wf:
+                wf.write(BankDigest.compute(metabank.get_database_bank(), bank_status).dumps())
+        else:
+            # Hashes of an earlier bank would be taken for the ones of this bank.
+            store_loc.remove_file(digest_path)
+
+        index_path = self._search_index_path()
+        if conf_get(self.conf, "storage", "search_index", "true").lower() == "true":
+            logger.info("Save search index to %s" % index_path)
+            bank_status = store_loc.file_status(self._metabank_file_path())
+            with store_loc.open_write(index_path, self.conf.get("local", "temp_work_dir")) as wf:
+                dump_index(metabank.get_database_bank(), wf, bank_status)
+        else:
+            # An index of an earlier bank would find objects which are gone.
+            store_loc.remove_file(index_path)
+
+        if conf_get(self.conf, "storage", "snapshots", "false").lower() == "true":
+            if self._max_bank_memory_bytes() is not None:
+                logger.warning("Snapshots are built from the whole bank in memory, beyond max_bank_memory_mb.")
+            version = self._snapshot_store(store_loc).record(metabank.get_database_bank())
+            logger.info("Recorded metadata as version %d" % version)
+
+
+    def _snapshot_store(self, store_loc):
+        """Return the snapshot store of the database.
+
+        :param store_loc: Object represents store location.
+        :type store_loc: An instance of Location.
+        :returns: An instance of SnapshotStore.
+        """
+        dbname = self.conf.get("datasource", "dbname")
+        history_dir = conf_get(self.conf, "storage", "history_directory", "").strip()
+        if not history_dir:
+            history_dir = os.path.join(self.conf.get("storage", "directory"), HISTORY_DIR_PATTERN.format(dbname))
+        return SnapshotStore(store_loc, history_dir,
+                             int(conf_get(self.conf, "storage", "snapshot_checkpoint_interval",
+                                          DEFAULT_CHECKPOINT_INTERVAL)),
+                             temp_dir=self.conf.get("local", "temp_work_dir"))
+
+
+    def _get_metabank_from_snapshot(self, store_loc, version=None, as_of=None, schemas=None, tables=None):
+        """Load the bank of a recorded version.
+
+        :param store_loc: Object represents store location.
+        :type store_loc: An instance of Location.
+        :param version: Version number.
+        :type version: int.
+        :param as_of: Load the latest version collected at or before this time,
+                      YYYY-MM-DD[ HH:MM[:SS]], if version is None.
+        :type as_of: str.
+        :param schemas: Only keep objects of these schemas, see select_objects.
+        :type schemas: list.
+        :param tables: Only keep these objects, as schemaname.objectname.
+        :type tables: list.
+        :returns: An instance of DatabaseMetaDataBank.
+        :raises: ValueError.
+        """
+        store = self._snapshot_store(store_loc)
+        if version is None:
+            version = store.version_as_of(parse_as_of(as_of))
+        logger.info("Use metadata of version %d" % version)
 
+        if not isinstance(store_loc, CachedLocation):
+            return select_objects(store.load(version), schemas, tables)
 
-    def _get_metabank_from_file(self, store_loc):
+        # Versions are rebuilt from deltas once, then opened as binary banks.
+        version_path = store.version_path(version)
+        cached = store_loc.map_derived(version_path, DECODED_BANK)
+        if cached is None:
+            cached = store_loc.map_derived(version_path, DECODED_BANK,
+                                           partial(BankFormat.dump_bank, store.load(version)))
+        return select_objects(BankFormat.open_bank(cached, lazy=True), schemas, tables)
+
+
+    def _metabank_file_path(self):
+        """Return path of the metabank file of the configured database."""
+        return os.path.join(self.conf.get("storage", "directory"),
+                            self.conf.get("datasource", "dbname"),
+                            BANK_NAME_PATTERN.format(self.conf.get("datasource", "dbname")))
+
+
+    def _search_index_path(self):
+        """Return path of the search index of the configured database."""
+        return os.path.join(self.conf.get("storage", "directory"),
+                            self.conf.get("datasource", "dbname"),
+                            SEARCH_INDEX_NAME_PATTERN.format(self.conf.get("datasource", "dbname")))
+
+
+    def _local_bank_file(self, store_loc, metabank_file_path, metabank_file_obj):
+        """Return path of a local file with the content of a metabank file.
+
+        :param store_loc: Object represents store location.
+        :type store_loc: An instance of Location.
+        :param metabank_file_path: Path of the metabank file in the store location.
+        :type metabank_file_path: str.
+        :param metabank_file_obj: Content of the metabank file, from map_file.
+        :returns: metabank_file_path itself if it is a local file mapped as
+                  stored, otherwise a copy under the temp directory, removed
+                  by the caller.
+        """
+        if isinstance(store_loc, LocalLocation) and \
+           Compression.codec_of(store_loc.read_range(metabank_file_path, 0, Compression.MAGIC_SIZE)) is None:
+            return metabank_file_path
+
+        tmp_wrk_dir = self.conf.get("local", "temp_work_dir")
+        if not os.path.exists(tmp_wrk_dir):
+            os.makedirs(tmp_wrk_dir)
+        fd, local_path = tempfile.mkstemp(suffix=".bank", dir=tmp_wrk_dir)
+        with os.fdopen(fd, "wb") as wf:
+            wf.write(metabank_file_obj)
+        return local_path
+
+
+    def _column_store_enabled(self):
+        """Whether columns of loaded banks are held in a column store."""
+        return conf_get(self.conf, "local", "column_store", "false").lower() == "true"
+
+
+    def _get_metabank_from_file(self, store_loc, metabank_file_path=None, schemas=None, tables=None):
         """Deserialize a MetaDataBank object from specific file.
 
         :param store_loc: Object represents store location.
         :type store_loc: An instance of Location.
-        :returns: dict.
+        :param metabank_file_path: Path of the metabank file, the one of the
+                                   configured database if None.
+        :type metabank_file_path: str.
+        :param schemas: Only load objects of these schemas, see select_objects.
+        :type schemas: list.
+        :param tables: Only load these objects, as schemaname.objectname.
+        :type tables: list.
+        :returns: An instance of DatabaseMetaDataBank.
         """
-        expect_metabank_file_path = os.path.join(self.conf.get("storage", "directory"),
-                                                 self.conf.get("datasource", "dbname"),
-                                                 BANK_NAME_PATTERN.format(self.conf.get("datasource", "dbname")))
+        expect_metabank_file_path = metabank_file_path or self._metabank_file_path()
+        if isinstance(store_loc, CachedLocation):
+            # Pickle banks decoded by an earlier run, saved as binary banks.
+            decoded_bank = store_loc.map_derived(expect_metabank_file_path, DECODED_BANK)
+            if decoded_bank is not None:
+                logger.debug("Use decoded bank of %s from the cache." % expect_metabank_file_path)
+                return select_objects(BankFormat.open_bank(decoded_bank, lazy=True), schemas, tables)
+
         logger.debug("Try to find metabank file: %s" % expect_metabank_file_path)
-        metabank_file_obj = store_loc.open_file(expect_metabank_file_path)
+        # Remote and compressed banks are streamed into a temporary file,
+        # never held whole in memory.
+        metabank_file_obj = store_loc.map_file(expect_metabank_file_path,
+                                               self.conf.get("local", "temp_work_dir"))
         if metabank_file_obj is None:
             deser_obj = None
+        elif SQLiteBank.is_sqlite_bank(metabank_file_obj):
+            # Only the selected objects are read from the database.
+            local_path = self._local_bank_file(store_loc, expect_metabank_file_path, metabank_file_obj)
+            if isinstance(metabank_file_obj, mmap.mmap):
+                # The copy is all sqlite reads, the mapping would hold its
+                # temporary file until collected.
+                metabank_file_obj.close()
+            sqlite_bank = SQLiteBank.SQLiteBank(local_path)
+            try:
+                return sqlite_bank.load(schemas, tables, self._max_bank_memory_bytes(),
+                                        self.conf.get("local", "temp_work_dir"))
+            finally:
+                sqlite_bank.close()
+                if local_path != expect_metabank_file_path:
+                    os.remove(local_path)
+        elif BankFormat.is_binary_bank(metabank_file_obj):
+            # Lazy banks only hold the objects in use, whatever the bank size.
+            lazy = conf_get(self.conf, "local", "lazy_bank", "true").lower() == "true" or \
+                self._max_bank_memory_bytes() is not None
+            deser_obj = BankFormat.open_bank(metabank_file_obj, lazy=lazy)
+            if self._column_store_enabled():
+                if lazy:
+                    # Tables of lazy banks are decoded again at each access,
+                    # there are no column objects to replace.
+                    logger.warning("column_store is ignored for lazy binary banks, set lazy_bank=false to use it.")
+                else:
+                    logger.debug("Hold columns of loaded metabank in a column store.")
+                    ColumnStore.from_bank(deser_obj, replace_columns=True)
         else:
-            raw_metabank = pickle.loads(metabank_file_obj)
-            deser_obj = DatabaseMetaDataBankSchema().load(raw_metabank).data
+            # Banks saved before the binary format are pickled marshmallow dumps.
+            if self._max_bank_memory_bytes() is not None:
+                logger.warning("Pickle banks are loaded whole, beyond max_bank_memory_mb.")
+            if isinstance(metabank_file_obj, mmap.mmap):
+                # Unpickled from the mapping, without a copy of the file.
+                raw_metabank = pickle.load(metabank_file_obj)
+            else:
+                raw_metabank = pickle.loads(metabank_file_obj)
+            deser_obj = from_struct(raw_metabank)
+            if isinstance(store_loc, CachedLocation):
+                store_loc.map_derived(expect_metabank_file_path, DECODED_BANK,
+                                      partial(BankFormat.dump_bank, deser_obj))
+
+            if self._column_store_enabled():
+                logger.debug("Hold columns of loaded metabank in a column store.")
+                ColumnStore.from_bank(deser_obj, replace_columns=True)
+
+        if deser_obj is not None:
+            deser_obj = select_objects(deser_obj, schemas, tables)
         return deser_obj
 
 
+    def _get_digest_of_file(self, store_loc, metabank_file_path):
+        """Read hashes saved next to a metabank file.
+
+        :param store_loc: Object represents store location.
+        :type store_loc: An instance of Location.
+        :param metabank_file_path: Path of the metabank file.
+        :type metabank_file_path: str.
+        :returns: An instance of BankDigest, None if there is none or it is
+                  not computed from the metabank file as it is now.
+        """
+        file_dir, file_name = os.path.split(metabank_file_path)
+        suffix = BANK_NAME_PATTERN.format("")
+        if not file_name.endswith(suffix):
+            return None
+        digest_path = os.path.join(file_dir, DIGEST_NAME_PATTERN.format(file_name[:-len(suffix)]))
+        try:
+            content = store_loc.open_file(digest_path)
+            if content is None:
+                return None
+            digest = BankDigest.loads(content)
+        except:
+            logger.warning("Can not read hashes in %s, compute them." % digest_path)
+            logger.debug(traceback.format_exc())
+            return None
+        if not digest.matches(store_loc.file_status(metabank_file_path)):
+            logger.warning("Hashes in %s are not of %s as it is now, compute them." %
+                           (digest_path, metabank_file_path))
+            return None
+        return digest
+
+
+    def gen_diff_report(self, base_metabank, metabank, base_digest, digest, base_label, label,
+                        temp_dir, store_loc):
+        """Compare two metabanks, and store the report as json and text
+           files under diff directory.
+
+        :param base_metabank: The metabank compared against.
+        :type base_metabank: An instance of DatabaseMetaDataBank.
+        :param metabank: The metabank compared.
+        :type metabank: An instance of DatabaseMetaDataBank.
+        :param base_digest: Hashes of base_metabank, computed if None.
+        :type base_digest: An instance of BankDigest.
+        :param digest: Hashes of metabank, computed if None.
+        :type digest: An instance of BankDigest.
+        :param base_label: Name of base_metabank in the report.
+        :type base_label: str.
+        :param label: Name of metabank in the report.
+        :type label: str.
+        :param temp_dir: Temporary working directory.
+        :type temp_dir: str.
+        :param store_loc: Object represents store location.
+        :type store_loc: An instance of Location.
+        """
+        report = diff_banks(base_metabank, metabank, base_digest, digest)
+        report["base"] = base_label
+        report["target"] = label
+        text_report = format_report(report, base_label, label)
+        logger.info(text_report.splitlines()[1])
+
+        dbname = self.conf.get("datasource", "dbname")
+        diff_dir = conf_get(self.conf, "storage", "diff_directory", "").strip() or \
+            self.conf.get("storage", "directory")
+        with store_loc.open_write_dir(os.path.join(diff_dir, "diff"), temp_dir) as staged_dir:
+            with open(os.path.join(staged_dir.path, "diff_{}.json".format(dbname)), "wb") as wf:
+                json.dump(report, wf, indent=1, sort_keys=True)
+            with open(os.path.join(staged_dir.path, "diff_{}.txt".format(dbname)), "wb") as wf:
+                wf.write(text_report.encode("utf-8"))
+
+
+    def search_metadata(self, query, store_loc, load_metabank=None, limit=None):
+        """Search names, types and comments of tables, views, columns,
+           indexes and constraints, print matching objects.
+
+        :param query: The query, see SearchIndex.parse_query.
+        :type query: str.
+        :param store_loc: Object represents store location.
+        :type store_loc: An instance of Location.
+        :param load_metabank: Load the metabank to build an index from, instead
+                              of reading the saved index.
+        :type load_metabank: function.
+        :param limit: Print at most this many objects, all if None.
+        :type limit: int.
+        :returns: List of SearchIndex.SearchHit.
+        :raises: ValueError.
+        """
+        index = None
+        if load_metabank is None:
+            index_data = store_loc.map_file(self._search_index_path(), self.conf.get("local", "temp_work_dir"))
+            if index_data is not None:
+                index = SearchIndex(index_data)
+                if not index.matches(store_loc.file_status(self._metabank_file_path())):
+                    logger.warning("Search index in %s is not of the metabank as it is now, build it again." %
+                                   self._search_index_path())
+                    index = None
+                    load_metabank = self._get_metabank_from_file
+            else:
+                logger.warning("No search index in %s, build it from the metabank." % self._search_index_path())
+                load_metabank = self._get_metabank_from_file
+        if index is None:
+            metabank = load_metabank(store_loc)
+            if metabank is None:
+                raise ValueError("No meta data avaibled, must collect them first!")
+            index = SearchIndex.from_bank(metabank)
+
+        hits = index.search(query, limit)
+        logger.info("Found %d objects for: %s" % (len(hits), query))
+        for each_hit in hits:
+            full_name = ".".join(n for n in (each_hit.schema, each_hit.table, each_hit.name) if n is not None)
+            sys.stdout.write(u"{}\t{}\t{}\t{}\n".format(each_hit.kind, full_name, each_hit.type or u"",
+                                                         (each_hit.comment or u"").replace(u"\n", u" ")).encode("utf-8"))
+        return hits
+
+
     def gen_erd(self, metabank, temp_dir, store_loc):
         """Generate ERD for all database objects(those are supported), and
            store them to image files under store directory.
@@ -160,17 +552,64 @@ class PGMetadataHandler(object):
         if store_type == "local":
             return LocalLocation()
         elif store_type == "hdfs":
-            return HDFSLocation(host=self.conf.get("storage", "webhdfs_host"),
-                                port=self.conf.get("storage", "webhdfs_port"))
+            location = HDFSLocation(host=self.conf.get("storage", "webhdfs_host"),
+                                    port=self.conf.get("storage", "webhdfs_port"),
+                                    upload_workers=int(conf_get(self.conf, "storage", "webhdfs_upload_workers", "4")),
+                                    max_retries=int(conf_get(self.conf, "storage", "webhdfs_max_retries", "3")),
+                                    retry_backoff=float(conf_get(self.conf, "storage", "webhdfs_retry_backoff", "0.5")))
+        elif store_type == "s3":
+            location = ObjectStoreLocation(
+                endpoint=self.conf.get("storage", "s3_endpoint"),
+                bucket=self.conf.get("storage", "s3_bucket"),
+                access_key=self.conf.get("storage", "s3_access_key"),
+                secret_key=self.conf.get("storage", "s3_secret_key"),
+                region=conf_get(self.conf, "storage", "s3_region", S3_DEFAULT_REGION),
+                upload_workers=int(conf_get(self.conf, "storage", "s3_upload_workers", "4")),
+                part_size=int(float(conf_get(self.conf, "storage", "s3_part_size_mb", "8")) * 1024 * 1024),
+                multipart_threshold=int(float(conf_get(self.conf, "storage", "s3_multipart_threshold_mb", "16"))
+                                        * 1024 * 1024),
+                max_retries=int(conf_get(self.conf, "storage", "s3_max_retries", "3")),
+                retry_backoff=float(conf_get(self.conf, "storage", "s3_retry_backoff", "0.5")))
         else:
-            raise ValueError("Valid storage type are: local|hdfs, got {}".format(store_type))
+            raise ValueError("Valid storage type are: local|hdfs|s3, got {}".format(store_type))
+
+        upload_workers = int(conf_get(self.conf, "storage", "async_upload_workers", "2"))
+        if upload_workers > 0:
+            location = AsyncUploadLocation(location, upload_workers,
+                                           int(conf_get(self.conf, "storage", "async_max_pending", "8")))
 
+        cache_dir = conf_get(self.conf, "local", "cache_directory")
+        if cache_dir is None:
+            return location
+        cache_max_mb = float(conf_get(self.conf, "local", "cache_max_mb", DEFAULT_CACHE_MAX_MB))
+        logger.debug("Read %s files through the cache in %s" % (store_type, cache_dir))
+        return CachedLocation(location, ReadCache(cache_dir, int(cache_max_mb * 1024 * 1024)))
 
-    def process(self, action):
+
+    def process(self, action, version=None, as_of=None, base=None, base_version=None, query=None, limit=None,
+                schemas=None, tables=None):
         """Main process of the handler.
 
-        :param action: Action for handler, only support: collect|erd|ddl|datadict.
+        :param action: Action for handler, only support: collect|erd|ddl|datadict|diff|search.
         :type action: str.
+        :param version: Export the recorded version instead of the latest bank.
+        :type version: int.
+        :param as_of: Export the latest version collected at or before this
+                      time instead of the latest bank.
+        :type as_of: str.
+        :param base: For diff, path of the metabank file compared against.
+        :type base: str.
+        :param base_version: For diff, the recorded version compared against.
+        :type base_version: int.
+        :param query: For search, the query.
+        :type query: str.
+        :param limit: For search, print at most this many objects.
+        :type limit: int.
+        :param schemas: For ddl, erd and dict, only export objects of these schemas.
+        :type schemas: list.
+        :param tables: For ddl, erd and dict, only export these objects, as
+                       schemaname.objectname.
+        :type tables: list.
         :raises: ValueError.
         """
         if action is None or action.strip() == '':
@@ -187,32 +626,79 @@ class PGMetadataHandler(object):
         action = action.strip().lower()
         loc_obj = self._choose_location()
 
-        if action == "collect":
-            pg_uri = self.conf.get("datasource", "uri")
-            logger.debug("Use DB URI: %s" % pg_uri)
-            metabank = self.collect_metadata(pg_uri, MetaDataBank(tmp_wrk_dir))
-
-            self.store_metadata_to_file(metabank, loc_obj)
-        elif action == "ddl":
-            metabank = self._get_metabank_from_file(loc_obj)
-            if metabank is None:
-                raise ValueError("No meta data avaibled, must collect them first!")
-
-            self.gen_ddl_file(metabank, tmp_wrk_dir, loc_obj)
-        elif action == "erd":
-            metabank = self._get_metabank_from_file(loc_obj)
-            if metabank is None:
-                raise ValueError("No meta data avaibled, must collect them first!")
-
-            self.gen_erd(metabank, tmp_wrk_dir, loc_obj)
-        elif action == "dict":
-            metabank = self._get_metabank_from_file(loc_obj)
-            if metabank is None:
-                raise ValueError("No meta data avaibled, must collect them first!")
-
-            self.gen_data_dictionary_file(metabank, tmp_wrk_dir, loc_obj)
+        if action != "collect" and (version is not None or as_of is not None):
+            load_metabank = partial(self._get_metabank_from_snapshot, version=version, as_of=as_of)
         else:
-            raise ValueError("Unsupport action: {!s}".format(action))
+            load_metabank = self._get_metabank_from_file
+
+        try:
+            if action == "collect":
+                pg_uri = self.conf.get("datasource", "uri")
+                logger.debug("Use DB URI: %s" % pg_uri)
+                metabank = self.collect_metadata(pg_uri, MetaDataBank(tmp_wrk_dir, self._max_bank_memory_bytes()))
+
+                self.store_metadata_to_file(metabank, loc_obj)
+            elif action == "ddl":
+                metabank = load_metabank(loc_obj, schemas=schemas, tables=tables)
+                if metabank is None:
+                    raise ValueError("No meta data avaibled, must collect them first!")
+
+                self.gen_ddl_file(metabank, tmp_wrk_dir, loc_obj)
+            elif action == "erd":
+                metabank = load_metabank(loc_obj, schemas=schemas, tables=tables)
+                if metabank is None:
+                    raise ValueError("No meta data avaibled, must collect them first!")
+
+                self.gen_erd(metabank, tmp_wrk_dir, loc_obj)
+            elif action == "dict":
+                metabank = load_metabank(loc_obj, schemas=schemas, tables=tables)
+                if metabank is None:
+                    raise ValueError("No meta data avaibled, must collect them first!")
+
+                self.gen_data_dictionary_file(metabank, tmp_wrk_dir, loc_obj)
+            elif action == "diff":
+                if base is None and base_version is None:
+                    raise ValueError("Must specify the metabank or version to compare against!")
+
+                metabank = load_metabank(loc_obj)
+                if metabank is None:
+                    raise ValueError("No meta data avaibled, must collect them first!")
+                if version is None and as_of is None:
+                    digest = self._get_digest_of_file(loc_obj, self._metabank_file_path())
+                    label = self._metabank_file_path()
+                else:
+                    digest = None
+                    label = "version {}".format(version) if version is not None else "as of {}".format(as_of)
+
+                if base_version is not None:
+                    base_metabank = self._get_metabank_from_snapshot(loc_obj, version=base_version)
+                    base_digest = None
+                    base_label = "version {}".format(base_version)
+                else:
+                    base_metabank = self._get_metabank_from_file(loc_obj, base)
+                    if base_metabank is None:
+                        raise ValueError("No meta data in {}".format(base))
+                    base_digest = self._get_digest_of_file(loc_obj, base)
+                    base_label = base
+
+                self.gen_diff_report(base_metabank, metabank, base_digest, digest, base_label, label,
+                                     tmp_wrk_dir, loc_obj)
+            elif action == "search":
+                if query is None or query.strip() == '':
+                    raise ValueError("Must specify the search query!")
+
+                self.search_metadata(query, loc_obj,
+                                     load_metabank if version is not None or as_of is not None else None,
+                                     limit)
+            else:
+                raise ValueError("Unsupport action: {!s}".format(action))
+        except:
+            # Failures of the action come first, those of uploads are logged.
+            loc_obj.flush(raise_errors=False)
+            raise
+        # Uploads still running in the background are waited for, their
+        # staged files are under the temp directory.
+        loc_obj.flush()
 
         if os.path.isdir(tmp_wrk_dir):
             shutil.rmtree(tmp_wrk_dir)
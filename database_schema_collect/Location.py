@@ -5,13 +5,29 @@ from __future__ import absolute_import
 
 import sys
 import os
+import time
+import hmac
+import mmap
+import urllib
+import hashlib
+import urlparse
+import threading
+import Queue
 import shutil
+import tempfile
 import logging
 import traceback
+from io import BytesIO
 from abc import abstractmethod
+from contextlib import closing
+from functools import partial
+from xml.etree import ElementTree
+from multiprocessing.pool import ThreadPool
 
 import requests
 
+from database_schema_collect import Compression
+
 reload(sys)
 sys.setdefaultencoding("utf-8")
 
@@ -19,6 +35,193 @@ sys.setdefaultencoding("utf-8")
 logger = logging.getLogger("database_schema_collect")
 
 
+# Seconds to wait for an HTTP server to connect or answer.
+HTTP_TIMEOUT = 60
+# Characters of an error response kept in the exception raised.
+HTTP_ERROR_TEXT_SIZE = 512
+# Hosts, NameNode and DataNodes, keeping pooled connections at once.
+WEBHDFS_POOLED_HOSTS = 16
+
+S3_DEFAULT_REGION = "us-east-1"
+# Object stores refuse parts below 5 MB, but the last one.
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_DEFAULT_PART_SIZE = 8 * 1024 * 1024
+S3_DEFAULT_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+
+
+class StagedWrite(object):
+    """A file or directory written at a local path and published to its
+    destination in a location by commit.
+
+    Files are written through the object itself or at path, directories
+    are built under path. Used as a context manager, it commits if the
+    block succeeds and aborts otherwise.
+    """
+
+    def __init__(self, location, des_path, is_dir, temp_dir=None):
+        """
+        :param location: Location of des_path.
+        :type location: An instance of Location.
+        :param des_path: Destination path.
+        :type des_path: str.
+        :param is_dir: Write a directory instead of a file.
+        :type is_dir: bool.
+        :param temp_dir: Local directory staging content of remote locations.
+        :type temp_dir: str.
+        """
+        self.location = location
+        self.des_path = des_path
+        self.path = location.stage_path(des_path, temp_dir)
+        self.closed = False
+        self._wf = None
+        if is_dir:
+            os.makedirs(self.path)
+
+
+    def write(self, data):
+        if self._wf is None:
+            self._wf = open(self.path, "wb")
+        self._wf.write(data)
+
+
+    def _close_file(self):
+        if self._wf is not None and not self._wf.closed:
+            self._wf.close()
+
+
+    def commit(self):
+        """Publish content to the destination."""
+        if self.closed:
+            return
+        self._close_file()
+        try:
+            self.location.commit_staged(self.path, self.des_path)
+        finally:
+            self.closed = True
+            self.location.discard_staged(self.path)
+
+
+    def abort(self):
+        """Drop content, the destination is left as it was."""
+        if self.closed:
+            return
+        self._close_file()
+        self.closed = True
+        self.location.discard_staged(self.path)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+class StagedUpdate(object):
+    """Files written under path and published into a directory of a
+    location by commit, files of the directory not written are kept.
+    """
+
+    def __init__(self, location, des_dir, temp_dir=None):
+        """
+        :param location: Location of des_dir.
+        :type location: An instance of Location.
+        :param des_dir: Destination directory.
+        :type des_dir: str.
+        :param temp_dir: Local directory staging files of remote locations.
+        :type temp_dir: str.
+        """
+        self.location = location
+        self.des_dir = des_dir
+        self.path = location.update_path(des_dir, temp_dir)
+        self.closed = False
+
+
+    def commit(self):
+        """Publish files written under path to the destination directory."""
+        if self.closed:
+            return
+        try:
+            self.location.commit_update(self.path, self.des_dir)
+        finally:
+            self.closed = True
+            self.location.discard_update(self.path)
+
+
+    def abort(self):
+        """Drop files not published yet."""
+        if self.closed:
+            return
+        self.closed = True
+        self.location.discard_update(self.path)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+
+def _map_stream(rf, temp_dir=None):
+    """Copy a stream into an anonymous temporary file, chunk by chunk, and
+    return it memory mapped.
+
+    :param rf: Binary stream.
+    :param temp_dir: Directory of the temporary file, system default if None.
+    :type temp_dir: str.
+    """
+    if temp_dir is not None and not os.path.isdir(temp_dir):
+        os.makedirs(temp_dir)
+    # Removed from the directory once closed, the mapping keeps it alive.
+    with tempfile.TemporaryFile(dir=temp_dir) as tf:
+        shutil.copyfileobj(rf, tf, Compression.STREAM_CHUNK_SIZE)
+        tf.flush()
+        if tf.tell() == 0:
+            return b""
+        return mmap.mmap(tf.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _ResponseReader(object):
+    """File object reading the body of a streamed HTTP response."""
+
+    def __init__(self, resp):
+        self._resp = resp
+
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._resp.raw.read(decode_content=True)
+        return self._resp.raw.read(size, decode_content=True)
+
+
+    def close(self):
+        self._resp.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def _remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
 class Location(object):
     """Location for storing meta data files."""
 
@@ -33,16 +236,190 @@ class Location(object):
         """
         raise NotImplementedError()
 
+
+    def remove_file(self, des_file_path):
+        """Remove a file, nothing happens if it does not exist.
+
+        :param des_file_path: path of the file.
+        :type des_file_path: str.
+        """
+        raise NotImplementedError()
+
+
+    def file_status(self, src_file_path):
+        """Return (modification time, length) of a file, which change
+           whenever the file is written again.
+
+        :param src_file_path: path of the file.
+        :type src_file_path: str.
+        :returns: tuple, None if the file does not exist.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
-    def open_file(self, src_file_path):
-        """Return content of a file.
+    def open_file(self, src_file_path, raw=False):
+        """Return content of a file, decompressed if it is compressed.
 
         :param src_file_path: path of source file
         :type src_file_path: str
+        :param raw: Return content as stored, without decompressing it.
+        :type raw: bool.
         """
         raise NotImplementedError()
 
 
+    def open_read(self, src_file_path):
+        """Open a file for binary reading of its content as stored, read in
+           chunks instead of held in memory if the location supports it.
+           Wraps open_file by default.
+
+        :param src_file_path: path of source file
+        :type src_file_path: str
+        :returns: A file object to close after use, None if the file does
+                  not exist. Decompress with Compression.open_reader.
+        """
+        content = self.open_file(src_file_path, raw=True)
+        return None if content is None else BytesIO(content)
+
+
+    def map_file(self, src_file_path, temp_dir=None):
+        """Return content of a file for random access, decompressed if it
+           is compressed. Streamed from open_read into a temporary file and
+           memory mapped by default.
+
+        :param src_file_path: path of source file
+        :type src_file_path: str
+        :param temp_dir: Directory of the temporary file, system default if None.
+        :type temp_dir: str.
+        """
+        rf = self.open_read(src_file_path)
+        if rf is None:
+            return None
+        try:
+            return _map_stream(Compression.open_reader(rf), temp_dir)
+        finally:
+            rf.close()
+
+
+    def open_write(self, des_file_path, temp_dir=None):
+        """Open a file for binary writing, its content appears at
+           des_file_path only when it is committed.
+
+        :param des_file_path: Destination path of the file.
+        :type des_file_path: str.
+        :param temp_dir: Local directory staging the file if the location
+                         can not be written directly, system default if None.
+        :type temp_dir: str.
+        :returns: An instance of StagedWrite.
+        """
+        return StagedWrite(self, des_file_path, False, temp_dir)
+
+
+    def open_write_dir(self, des_dir, temp_dir=None):
+        """Open a directory to be built under the path of the returned
+           object, it replaces des_dir only when it is committed.
+
+        :param des_dir: Destination path of the directory.
+        :type des_dir: str.
+        :param temp_dir: Local directory staging the directory if the
+                         location can not be written directly, system
+                         default if None.
+        :type temp_dir: str.
+        :returns: An instance of StagedWrite.
+        """
+        return StagedWrite(self, des_dir, True, temp_dir)
+
+
+    def open_update_dir(self, des_dir, temp_dir=None):
+        """Open a directory to write changed files of des_dir under the path
+           of the returned object, they replace files of des_dir only when
+           it is committed. Other files of des_dir are kept.
+
+        :param des_dir: Destination path of the directory.
+        :type des_dir: str.
+        :param temp_dir: Local directory staging the files if the location
+                         can not be written directly, system default if None.
+        :type temp_dir: str.
+        :returns: An instance of StagedUpdate.
+        """
+        return StagedUpdate(self, des_dir, temp_dir)
+
+
+    def stage_path(self, des_path, temp_dir=None):
+        """Return local path content of des_path is written at before commit.
+           A new directory under temp_dir by default.
+        """
+        if temp_dir is not None and not os.path.isdir(temp_dir):
+            os.makedirs(temp_dir)
+        return os.path.join(tempfile.mkdtemp(dir=temp_dir), os.path.basename(des_path.rstrip("/")))
+
+
+    def commit_staged(self, staged_path, des_path):
+        """Publish content written at staged_path to des_path.
+           Moved with move_file_to by default.
+        """
+        self.move_file_to(staged_path, des_path)
+
+
+    def discard_staged(self, staged_path):
+        """Remove what is left of staged_path after a commit or abort."""
+        stage_dir = os.path.dirname(staged_path)
+        if os.path.isdir(stage_dir):
+            shutil.rmtree(stage_dir)
+
+
+    def update_path(self, des_dir, temp_dir=None):
+        """Return local directory changed files of des_dir are written under
+           before commit. A new directory under temp_dir by default.
+        """
+        if temp_dir is not None and not os.path.isdir(temp_dir):
+            os.makedirs(temp_dir)
+        return tempfile.mkdtemp(dir=temp_dir)
+
+
+    def commit_update(self, update_dir, des_dir):
+        """Publish each file under update_dir to the same relative path
+           under des_dir. Moved with move_file_to by default.
+        """
+        for dir_path, _, file_names in os.walk(update_dir):
+            for each_name in file_names:
+                src_file_path = os.path.join(dir_path, each_name)
+                rel_path = os.path.relpath(src_file_path, update_dir)
+                self.move_file_to(src_file_path, "{}/{}".format(des_dir.rstrip("/"), rel_path))
+
+
+    def discard_update(self, update_dir):
+        """Remove what is left of update_dir after a commit or abort."""
+        if os.path.isdir(update_dir):
+            shutil.rmtree(update_dir)
+
+
+    def flush(self, raise_errors=True):
+        """Wait until writes committed so far are published. Writes are
+           published at commit by default, nothing to wait for.
+
+        :param raise_errors: Raise an error if some writes failed.
+        :type raise_errors: bool.
+        :raises: IOError.
+        """
+        pass
+
+
+    def read_range(self, src_file_path, offset, length):
+        """Return length bytes of a file starting at offset.
+        Reads the whole file by default.
+
+        :param src_file_path: path of source file
+        :type src_file_path: str
+        :param offset: Start of the range.
+        :type offset: int.
+        :param length: Length of the range.
+        :type length: int.
+        """
+        content = self.open_file(src_file_path, raw=True)
+        return None if content is None else content[offset:offset + length]
+
+
 class LocalLocation(Location):
     """Location in local file system."""
 
@@ -50,31 +427,1031 @@ class LocalLocation(Location):
         shutil.move(src_file_path, des_file_path)
 
 
-    def open_file(self, src_file_path):
+    def remove_file(self, des_file_path):
+        if os.path.exists(des_file_path):
+            os.remove(des_file_path)
+
+
+    def file_status(self, src_file_path):
+        if not os.path.isfile(src_file_path):
+            return None
+        stat = os.stat(src_file_path)
+        return stat.st_mtime, stat.st_size
+
+
+    def stage_path(self, des_path, temp_dir=None):
+        # Next to the destination, so commit is a rename on the same file system.
+        des_path = os.path.abspath(des_path)
+        parent = os.path.dirname(des_path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        staged_path = os.path.join(parent, ".{}.{}.tmp".format(os.path.basename(des_path), os.getpid()))
+        _remove_path(staged_path)
+        return staged_path
+
+
+    def commit_staged(self, staged_path, des_path):
+        des_path = os.path.abspath(des_path)
+        if os.path.isdir(des_path):
+            # A directory can not be renamed onto another one, the old one is
+            # put aside first.
+            old_path = "{}.old".format(staged_path)
+            _remove_path(old_path)
+            os.rename(des_path, old_path)
+            os.rename(staged_path, des_path)
+            shutil.rmtree(old_path)
+        else:
+            os.rename(staged_path, des_path)
+
+
+    def discard_staged(self, staged_path):
+        _remove_path(staged_path)
+
+
+    def update_path(self, des_dir, temp_dir=None):
+        # Next to the destination, so commit renames files on the same file system.
+        des_dir = os.path.abspath(des_dir)
+        if not os.path.isdir(des_dir):
+            os.makedirs(des_dir)
+        update_dir = os.path.join(os.path.dirname(des_dir),
+                                  ".{}.{}.update".format(os.path.basename(des_dir), os.getpid()))
+        _remove_path(update_dir)
+        os.makedirs(update_dir)
+        return update_dir
+
+
+    def commit_update(self, update_dir, des_dir):
+        des_dir = os.path.abspath(des_dir)
+        for dir_path, _, file_names in os.walk(update_dir):
+            each_des_dir = os.path.normpath(os.path.join(des_dir, os.path.relpath(dir_path, update_dir)))
+            if file_names and not os.path.isdir(each_des_dir):
+                os.makedirs(each_des_dir)
+            for each_name in file_names:
+                # Each file replaces the old one at once, readers never see
+                # it partly written.
+                os.rename(os.path.join(dir_path, each_name), os.path.join(each_des_dir, each_name))
+
+
+    def discard_update(self, update_dir):
+        _remove_path(update_dir)
+
+
+    def open_file(self, src_file_path, raw=False):
         if not os.path.exists(src_file_path):
             return None
 
         with open(src_file_path, "rb") as rf:
-            return rf.read()
+            content = rf.read()
+        return content if raw else Compression.decompress(content)
+
 
+    def open_read(self, src_file_path):
+        if not os.path.exists(src_file_path):
+            return None
+        return open(src_file_path, "rb")
 
-class HDFSLocation(Location):
-    """Location in HDFS."""
 
-    def __init__(self, host, port=None):
-        self.uri_prefix = "http://{}:{}/webhdfs/v1/".format(host, port if port is not None else 50070)
+    def map_file(self, src_file_path, temp_dir=None):
+        if not os.path.exists(src_file_path):
+            return None
+
+        with open(src_file_path, "rb") as rf:
+            # Empty files can not be mapped.
+            if os.fstat(rf.fileno()).st_size == 0:
+                return b""
+            if Compression.codec_of(rf.read(Compression.MAGIC_SIZE)) is None:
+                return mmap.mmap(rf.fileno(), 0, access=mmap.ACCESS_READ)
+
+            # Compressed files are decompressed into a temporary file instead.
+            rf.seek(0)
+            return _map_stream(Compression.open_reader(rf), temp_dir)
+
+
+    def read_range(self, src_file_path, offset, length):
+        if not os.path.exists(src_file_path):
+            return None
+
+        with open(src_file_path, "rb") as rf:
+            rf.seek(offset)
+            return rf.read(length)
+
+
+class _HTTPLocation(Location):
+    """Location behind an HTTP API, through one pooled session.
+
+    Connections are kept alive and shared by the threads uploading files in
+    parallel. Requests failed by the network or a server error are retried.
+    """
+
+    def __init__(self, upload_workers=4, max_retries=3, retry_backoff=0.5, pooled_hosts=1):
+        """
+        :param upload_workers: Number of uploads at once.
+        :type upload_workers: int.
+        :param max_retries: Times a failed request is tried again.
+        :type max_retries: int.
+        :param retry_backoff: Seconds waited before the first retry, doubled
+                              for each next one.
+        :type retry_backoff: float.
+        :param pooled_hosts: Hosts keeping pooled connections at once.
+        :type pooled_hosts: int.
+        """
+        self.upload_workers = max(1, int(upload_workers))
+        self.max_retries = max(0, int(max_retries))
+        self.retry_backoff = float(retry_backoff)
+
         self._global_api_session = requests.session()
+        # A kept alive connection per host for every upload thread.
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pooled_hosts,
+                                                pool_maxsize=self.upload_workers)
+        self._global_api_session.mount("http://", adapter)
+        self._global_api_session.mount("https://", adapter)
+
+
+    def _request_headers(self, method, url, headers, data):
+        """Return headers sent with a request, given headers unchanged by
+           default. Called again for each retry.
+        """
+        return headers
+
+
+    def _request(self, method, url, expected, **kwargs):
+        """Send a request, retry it on connection errors and server errors.
+
+        :param method: HTTP method.
+        :type method: str.
+        :param url: URL of the request.
+        :type url: str.
+        :param expected: Status codes of a successful response.
+        :type expected: tuple.
+        :param retries: Times the request is tried again, max_retries if
+                        not given.
+        :type retries: int.
+        :returns: An instance of requests.Response.
+        :raises: requests.RequestException if the request still fails after
+                 all retries, or gets an unexpected status code.
+        """
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        body_file = kwargs.pop("body_file", None)
+        headers = kwargs.pop("headers", None) or {}
+        retries = kwargs.pop("retries", self.max_retries)
+        attempt = 0
+        while True:
+            try:
+                if body_file is None:
+                    resp = self._global_api_session.request(
+                        method, url, headers=self._request_headers(method, url, headers, kwargs.get("data")),
+                        **kwargs)
+                else:
+                    # Opened again for each attempt, a failed one may have
+                    # read part of it.
+                    with open(body_file, "rb") as rf:
+                        resp = self._global_api_session.request(
+                            method, url, data=rf, headers=self._request_headers(method, url, headers, rf),
+                            **kwargs)
+                if resp.status_code < 500 or attempt >= retries:
+                    break
+                resp.close()
+                logger.warning("%s %s got status %d, retry it." % (method, url, resp.status_code))
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries:
+                    raise
+                logger.warning("%s %s failed, retry it: %s" % (method, url, traceback.format_exc().splitlines()[-1]))
+            time.sleep(self.retry_backoff * (2 ** attempt))
+            attempt += 1
+
+        if resp.status_code not in expected:
+            raise requests.HTTPError("{} {} got status {}: {}".format(method, url, resp.status_code,
+                                                                       resp.text[:HTTP_ERROR_TEXT_SIZE]),
+                                     response=resp)
+        return resp
+
+
+    def _parallel(self, func, items):
+        """Call func on each item, upload_workers at once.
+
+        :returns: Results in the order of items.
+        """
+        if self.upload_workers == 1 or len(items) <= 1:
+            return [func(each_item) for each_item in items]
+
+        pool = ThreadPool(min(self.upload_workers, len(items)))
+        try:
+            # Raises the first failure, after the other calls are done.
+            return pool.map(func, items, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+
+class HDFSLocation(_HTTPLocation):
+    """Location in HDFS, through WebHDFS.
+
+    Files are created in two steps, the NameNode redirects the request to a
+    DataNode which receives the content. Files of a directory are uploaded
+    in parallel.
+    """
+
+    def __init__(self, host, port=None, upload_workers=4, max_retries=3, retry_backoff=0.5):
+        """
+        :param host: Host of the NameNode.
+        :type host: str.
+        :param port: Port of WebHDFS on the NameNode, 50070 if None.
+        :type port: int.
+        :param upload_workers: Number of files of a directory uploaded at once.
+        :type upload_workers: int.
+        :param max_retries: Times a failed request is tried again.
+        :type max_retries: int.
+        :param retry_backoff: Seconds waited before the first retry, doubled
+                              for each next one.
+        :type retry_backoff: float.
+        """
+        # One pool for the NameNode and each DataNode.
+        super(HDFSLocation, self).__init__(upload_workers, max_retries, retry_backoff, WEBHDFS_POOLED_HOSTS)
+        self.uri_prefix = "http://{}:{}/webhdfs/v1/".format(host, port if port is not None else 50070)
+
+
+    def _url(self, hdfs_path):
+        return "{}{}".format(self.uri_prefix, hdfs_path.lstrip("/"))
+
+
+    def _create(self, src_file_path, des_file_path):
+        """Upload a local file, replacing the file at des_file_path."""
+        attempt = 0
+        while True:
+            resp = self._request("PUT", self._url(des_file_path), (307,),
+                                 params={"op": "CREATE", "overwrite": "true"},
+                                 allow_redirects=False)
+            try:
+                # Not retried at the same DataNode, the retry asks the
+                # NameNode again, which may choose another one.
+                self._request("PUT", resp.headers["Location"], (201,),
+                              body_file=src_file_path,
+                              headers={"Content-Type": "application/octet-stream"},
+                              retries=0)
+                return
+            except requests.HTTPError as e:
+                # Refused requests fail the same way again.
+                if e.response is None or e.response.status_code < 500 or attempt >= self.max_retries:
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+            logger.warning("Upload of %s to %s failed, ask the NameNode again: %s" %
+                           (src_file_path, des_file_path, traceback.format_exc().splitlines()[-1]))
+            time.sleep(self.retry_backoff * (2 ** attempt))
+            attempt += 1
+
+
+    def _mkdirs(self, des_dir):
+        self._request("PUT", self._url(des_dir), (200,), params={"op": "MKDIRS"})
+
+
+    def _delete(self, des_path, recursive=False):
+        self._request("DELETE", self._url(des_path), (200,),
+                      params={"op": "DELETE", "recursive": "true" if recursive else "false"})
+
+
+    def _rename(self, src_path, des_path):
+        resp = self._request("PUT", self._url(src_path), (200,),
+                             params={"op": "RENAME", "destination": "/" + des_path.lstrip("/")})
+        if not resp.json().get("boolean"):
+            raise requests.HTTPError("Failed to rename {} to {}".format(src_path, des_path), response=resp)
+
+
+    def _upload_tree(self, src_dir, des_dir):
+        """Upload all files under a local directory to the same relative
+           paths under des_dir, upload_workers files at once.
+        """
+        uploads = []
+        self._mkdirs(des_dir)
+        for dir_path, dir_names, file_names in os.walk(src_dir):
+            rel_dir = os.path.relpath(dir_path, src_dir)
+            each_des_dir = des_dir.rstrip("/") if rel_dir == "." else "{}/{}".format(des_dir.rstrip("/"), rel_dir)
+            for each_name in dir_names:
+                self._mkdirs("{}/{}".format(each_des_dir, each_name))
+            for each_name in file_names:
+                uploads.append((os.path.join(dir_path, each_name), "{}/{}".format(each_des_dir, each_name)))
+
+        logger.info("Upload %d files to %s with %d workers." % (len(uploads), des_dir, self.upload_workers))
+        self._parallel(lambda u: self._create(*u), uploads)
 
 
     def move_file_to(self, src_file_path, des_file_path):
-        with open(src_file_path, "rb") as rf:
-            resp = self._global_api_session.put("{}{}?op=CREATE".format(self.uri_prefix,
-                                                                        des_file_path),
-                                                data=rf.read())
-            logger.debug(resp.text)
+        if os.path.isdir(src_file_path):
+            self._upload_tree(src_file_path, des_file_path)
+        else:
+            self._create(src_file_path, des_file_path)
+
+
+    def commit_staged(self, staged_path, des_path):
+        if not os.path.isdir(staged_path):
+            self._create(staged_path, des_path)
+            return
+        # Uploaded next to the destination and renamed over it, the
+        # destination never holds a part of the directory.
+        upload_path = "{}.{}.tmp".format(des_path.rstrip("/"), os.getpid())
+        self._delete(upload_path, recursive=True)
+        self._upload_tree(staged_path, upload_path)
+        self._delete(des_path, recursive=True)
+        self._rename(upload_path, des_path)
+
+
+    def commit_update(self, update_dir, des_dir):
+        self._upload_tree(update_dir, des_dir)
+
+
+    def remove_file(self, des_file_path):
+        self._delete(des_file_path)
+
+
+    def file_status(self, src_file_path):
+        resp = self._request("GET", self._url(src_file_path), (200, 404), params={"op": "GETFILESTATUS"})
+        if resp.status_code == 404:
+            return None
+        status = resp.json()["FileStatus"]
+        if status["type"] != "FILE":
+            return None
+        return status["modificationTime"], status["length"]
+
+
+    def open_file(self, src_file_path, raw=False):
+        resp = self._request("GET", self._url(src_file_path), (200, 404), params={"op": "OPEN"})
+        if resp.status_code == 404:
+            return None
+        # Bank files are binary, never decode them as text.
+        return resp.content if raw else Compression.decompress(resp.content)
+
+
+    def open_read(self, src_file_path):
+        # Chunks of the body are read from the socket as they are consumed.
+        resp = self._request("GET", self._url(src_file_path), (200, 404), params={"op": "OPEN"}, stream=True)
+        if resp.status_code == 404:
+            resp.close()
+            return None
+        return _ResponseReader(resp)
+
+
+    def read_range(self, src_file_path, offset, length):
+        resp = self._request("GET", self._url(src_file_path), (200, 404),
+                             params={"op": "OPEN", "offset": offset, "length": length})
+        return None if resp.status_code == 404 else resp.content
+
+
+class ObjectStoreLocation(_HTTPLocation):
+    """Location in a bucket of an S3 compatible object store.
+
+    Paths are object keys, directories are key prefixes. Requests are
+    signed with AWS signature version 4 and addressed path style, as
+    <endpoint>/<bucket>/<key>. Files from multipart_threshold bytes are
+    uploaded in parts of part_size bytes, upload_workers parts at once.
+    Reads of ranges get only those bytes.
+
+    A staged directory is uploaded over its destination, then objects of
+    the destination not uploaded are removed. The object store can not
+    rename, readers may see a mix of the old and new directory meanwhile.
+    """
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region=S3_DEFAULT_REGION,
+                 upload_workers=4, part_size=S3_DEFAULT_PART_SIZE,
+                 multipart_threshold=S3_DEFAULT_MULTIPART_THRESHOLD, max_retries=3, retry_backoff=0.5):
+        """
+        :param endpoint: URL of the object store, like http://host:9000.
+        :type endpoint: str.
+        :param bucket: Bucket name.
+        :type bucket: str.
+        :param access_key: Access key id.
+        :type access_key: str.
+        :param secret_key: Secret access key.
+        :type secret_key: str.
+        :param region: Region signed requests are scoped to.
+        :type region: str.
+        :param upload_workers: Number of files or parts uploaded at once,
+                               each part is held in memory while uploaded.
+        :type upload_workers: int.
+        :param part_size: Size of parts of a multipart upload, at least 5 MB.
+        :type part_size: int.
+        :param multipart_threshold: Size from which files are uploaded in parts.
+        :type multipart_threshold: int.
+        :param max_retries: Times a failed request is tried again.
+        :type max_retries: int.
+        :param retry_backoff: Seconds waited before the first retry, doubled
+                              for each next one.
+        :type retry_backoff: float.
+        :raises: ValueError.
+        """
+        if part_size < S3_MIN_PART_SIZE:
+            raise ValueError("Parts of multipart uploads are at least {} bytes, got {}".format(S3_MIN_PART_SIZE,
+                                                                                                part_size))
+        super(ObjectStoreLocation, self).__init__(upload_workers, max_retries, retry_backoff)
+        self.endpoint = endpoint.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.part_size = int(part_size)
+        self.multipart_threshold = max(int(multipart_threshold), self.part_size)
+
+
+    def _key(self, path):
+        return path.lstrip("/")
+
+
+    def _url(self, key=None, params=None):
+        """Return URL of an object, of the bucket if key is None, with
+           params as its query in canonical order.
+        """
+        url = "{}/{}".format(self.endpoint, self.bucket)
+        if key is not None:
+            url += "/" + urllib.quote(_utf8(key), safe="/~")
+        if params:
+            url += "?" + "&".join("{}={}".format(urllib.quote(_utf8(k), safe="~"), urllib.quote(_utf8(v), safe="~"))
+                                  for k, v in sorted(params.items()))
+        return url
+
+
+    def _request_headers(self, method, url, headers, data):
+        if data is None:
+            payload_hash = hashlib.sha256(b"").hexdigest()
+        elif isinstance(data, bytes):
+            payload_hash = hashlib.sha256(data).hexdigest()
+        else:
+            # Files are streamed, not read twice to hash them.
+            payload_hash = "UNSIGNED-PAYLOAD"
+        return sign_v4(method, url, headers, payload_hash, self.access_key, self.secret_key,
+                       self.region, time.gmtime())
+
+
+    def _put_object(self, src_file_path, key):
+        self._request("PUT", self._url(key), (200,), body_file=src_file_path,
+                      headers={"Content-Type": "application/octet-stream"})
+
+
+    def _put_multipart(self, src_file_path, key, parallel=True):
+        """Upload a file in parts, the parts in parallel unless parallel is False."""
+        size = os.path.getsize(src_file_path)
+        resp = self._request("POST", self._url(key, {"uploads": ""}), (200,))
+        upload_id = _xml_text(resp.content, "UploadId")
+        parts = [(number, offset, min(self.part_size, size - offset))
+                 for number, offset in enumerate(xrange(0, size, self.part_size), 1)]
+
+        def upload_part(part):
+            number, offset, length = part
+            with open(src_file_path, "rb") as rf:
+                rf.seek(offset)
+                data = rf.read(length)
+            resp = self._request("PUT", self._url(key, {"partNumber": str(number), "uploadId": upload_id}),
+                                 (200,), data=data)
+            return number, resp.headers["ETag"]
+
+        logger.debug("Upload %s to %s in %d parts." % (src_file_path, key, len(parts)))
+        try:
+            if parallel:
+                etags = self._parallel(upload_part, parts)
+            else:
+                etags = [upload_part(each_part) for each_part in parts]
+            body = "<CompleteMultipartUpload>{}</CompleteMultipartUpload>".format(
+                "".join("<Part><PartNumber>{}</PartNumber><ETag>{}</ETag></Part>".format(number, etag)
+                        for number, etag in etags))
+            resp = self._request("POST", self._url(key, {"uploadId": upload_id}), (200,), data=body.encode("utf-8"))
+            # Completion may fail after the status line was sent as 200.
+            if _xml_text(resp.content, "Code") is not None:
+                raise requests.HTTPError("Failed to complete upload of {}: {}".format(key, resp.text), response=resp)
+        except:
+            try:
+                self._request("DELETE", self._url(key, {"uploadId": upload_id}), (200, 204, 404))
+            except requests.RequestException:
+                logger.error("Failed to abort upload %s of %s" % (upload_id, key))
+            raise
+
+
+    def _put_file(self, src_file_path, key, parallel=True):
+        if os.path.getsize(src_file_path) >= self.multipart_threshold:
+            self._put_multipart(src_file_path, key, parallel)
+        else:
+            self._put_object(src_file_path, key)
+
+
+    def _upload_tree(self, src_dir, des_prefix):
+        """Upload all files under a local directory to the same relative
+           keys under des_prefix.
+
+        :returns: Keys uploaded.
+        """
+        uploads = []
+        for dir_path, _, file_names in os.walk(src_dir):
+            for each_name in file_names:
+                src_file_path = os.path.join(dir_path, each_name)
+                rel_path = os.path.relpath(src_file_path, src_dir).replace(os.sep, "/")
+                uploads.append((src_file_path, "{}/{}".format(des_prefix.rstrip("/"), rel_path)))
+
+        # Small files are uploaded in parallel, large ones one at a time
+        # with their parts in parallel.
+        small = [u for u in uploads if os.path.getsize(u[0]) < self.multipart_threshold]
+        large = [u for u in uploads if os.path.getsize(u[0]) >= self.multipart_threshold]
+        logger.info("Upload %d files to %s with %d workers." % (len(uploads), des_prefix, self.upload_workers))
+        self._parallel(lambda u: self._put_object(*u), small)
+        for src_file_path, key in large:
+            self._put_multipart(src_file_path, key)
+        return [key for _, key in uploads]
+
+
+    def _list_keys(self, prefix):
+        """Return keys of all objects whose key starts with prefix, utf-8
+           encoded.
+        """
+        keys = []
+        params = {"list-type": "2", "prefix": prefix}
+        while True:
+            resp = self._request("GET", self._url(params=params), (200,))
+            root = ElementTree.fromstring(resp.content)
+            keys.extend(_utf8(e.text) for e in root.iter() if _local_tag(e) == "Key")
+            if _xml_text(resp.content, "IsTruncated") != "true":
+                return keys
+            params["continuation-token"] = _xml_text(resp.content, "NextContinuationToken")
+
+
+    def move_file_to(self, src_file_path, des_file_path):
+        if os.path.isdir(src_file_path):
+            self._upload_tree(src_file_path, self._key(des_file_path))
+        else:
+            self._put_file(src_file_path, self._key(des_file_path))
+
+
+    def commit_staged(self, staged_path, des_path):
+        if not os.path.isdir(staged_path):
+            self._put_file(staged_path, self._key(des_path))
+            return
+        des_prefix = self._key(des_path).rstrip("/") + "/"
+        # Compared as utf-8, an unicode key has another hash than its bytes.
+        uploaded = set(_utf8(k) for k in self._upload_tree(staged_path, des_prefix))
+        stale_keys = [k for k in self._list_keys(des_prefix) if k not in uploaded]
+        if stale_keys:
+            logger.debug("Remove %d objects left in %s" % (len(stale_keys), des_prefix))
+            self._parallel(self._delete, stale_keys)
+
+
+    def commit_update(self, update_dir, des_dir):
+        self._upload_tree(update_dir, self._key(des_dir))
+
+
+    def _delete(self, key):
+        self._request("DELETE", self._url(key), (200, 204, 404))
+
+
+    def remove_file(self, des_file_path):
+        self._delete(self._key(des_file_path))
+
+
+    def file_status(self, src_file_path):
+        resp = self._request("HEAD", self._url(self._key(src_file_path)), (200, 404))
+        if resp.status_code == 404:
+            return None
+        return (resp.headers.get("Last-Modified"), int(resp.headers.get("Content-Length", 0)),
+                resp.headers.get("ETag"))
+
+
+    def open_file(self, src_file_path, raw=False):
+        resp = self._request("GET", self._url(self._key(src_file_path)), (200, 404))
+        if resp.status_code == 404:
+            return None
+        return resp.content if raw else Compression.decompress(resp.content)
+
+
+    def open_read(self, src_file_path):
+        resp = self._request("GET", self._url(self._key(src_file_path)), (200, 404), stream=True)
+        if resp.status_code == 404:
+            resp.close()
+            return None
+        return _ResponseReader(resp)
+
+
+    def read_range(self, src_file_path, offset, length):
+        if length <= 0:
+            return b""
+        resp = self._request("GET", self._url(self._key(src_file_path)), (200, 206, 404, 416),
+                             headers={"Range": "bytes={}-{}".format(offset, offset + length - 1)})
+        if resp.status_code == 404:
+            return None
+        if resp.status_code == 416:
+            return b""
+        if resp.status_code == 200:
+            # Ranges are not supported, the whole object came back.
+            return resp.content[offset:offset + length]
+        return resp.content
+
+
+def _utf8(value):
+    """Return unicode value encoded as utf-8, other values unchanged.
+       urllib.quote only quotes bytes.
+    """
+    return value.encode("utf-8") if isinstance(value, unicode) else value
+
+
+def _local_tag(element):
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def _xml_text(content, name):
+    """Return text of the first element named name of an XML document,
+       whatever its namespace, None if there is none.
+    """
+    for each_element in ElementTree.fromstring(content).iter():
+        if _local_tag(each_element) == name:
+            return each_element.text
+    return None
+
+
+def sign_v4(method, url, headers, payload_hash, access_key, secret_key, region, now, service="s3"):
+    """Return headers of a request signed with AWS signature version 4.
+
+    :param method: HTTP method.
+    :type method: str.
+    :param url: URL of the request, its path and query already encoded,
+                the query in canonical order.
+    :type url: str.
+    :param headers: Headers of the request, all of them are signed.
+    :type headers: dict.
+    :param payload_hash: Hex sha256 of the body, or UNSIGNED-PAYLOAD.
+    :type payload_hash: str.
+    :param now: Time of the request.
+    :type now: time.struct_time.
+    :returns: dict, headers with x-amz-date, x-amz-content-sha256 and
+              Authorization added.
+    """
+    parts = urlparse.urlsplit(url)
+    amz_date = time.strftime("%Y%m%dT%H%M%SZ", now)
+    date_stamp = amz_date[:8]
+
+    signed = dict((k.lower(), " ".join(str(v).split())) for k, v in headers.items())
+    signed["host"] = parts.netloc
+    signed["x-amz-date"] = amz_date
+    signed["x-amz-content-sha256"] = payload_hash
+    signed_names = ";".join(sorted(signed))
+
+    query = []
+    for each_param in parts.query.split("&") if parts.query else []:
+        name, _, value = each_param.partition("=")
+        query.append((name, value))
+    canonical_request = "\n".join([method,
+                                    parts.path or "/",
+                                    "&".join("{}={}".format(k, v) for k, v in sorted(query)),
+                                    "".join("{}:{}\n".format(k, signed[k]) for k in sorted(signed)),
+                                    signed_names,
+                                    payload_hash])
+    scope = "{}/{}/{}/aws4_request".format(date_stamp, region, service)
+    string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope,
+                                 hashlib.sha256(canonical_request).hexdigest()])
+
+    key = ("AWS4" + secret_key).encode("utf-8")
+    for each_part in (date_stamp, region, service, "aws4_request"):
+        key = hmac.new(key, each_part, hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign, hashlib.sha256).hexdigest()
+
+    result = dict(headers)
+    result["x-amz-date"] = amz_date
+    result["x-amz-content-sha256"] = payload_hash
+    result["Authorization"] = "AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, Signature={}".format(
+        access_key, scope, signed_names, signature)
+    return result
+
+
+class CachedLocation(Location):
+    """Location reading files of another one through a local ReadCache.
+
+    A file is downloaded once and read from the cache while its status in
+    the other location is unchanged, at the cost of one status request per
+    read. Files are cached as stored for open_read and open_file, and
+    decompressed for map_file. Content derived from a file, like a decoded
+    bank, can be cached along with it. Writes go to the other location.
+    """
+
+    def __init__(self, location, cache):
+        """
+        :param location: Location holding the files.
+        :type location: An instance of Location.
+        :param cache: Cache of the files.
+        :type cache: An instance of ReadCache.
+        """
+        self.location = location
+        self.cache = cache
+
+
+    def _cached(self, src_file_path, kind, status, write):
+        """Return path of the cached content of a file, made by write if it
+           is not cached. None if it can not be cached.
+        """
+        key = "{}:{}".format(kind, src_file_path)
+        cached_path = self.cache.get(key, status)
+        if cached_path is None:
+            logger.debug("Cache %s of %s" % (kind, src_file_path))
+            cached_path = self.cache.put(key, status, write)
+        return cached_path
+
+
+    def _copy_from(self, src_file_path, decompress):
+        def write(wf):
+            rf = self.location.open_read(src_file_path)
+            if rf is None:
+                raise ValueError("{} is gone".format(src_file_path))
+            try:
+                shutil.copyfileobj(Compression.open_reader(rf) if decompress else rf,
+                                   wf, Compression.STREAM_CHUNK_SIZE)
+            finally:
+                rf.close()
+        return write
+
+
+    def open_read(self, src_file_path):
+        status = self.location.file_status(src_file_path)
+        if status is None:
+            return None
+        cached_path = self._cached(src_file_path, "raw", status, self._copy_from(src_file_path, False))
+        if cached_path is None:
+            return self.location.open_read(src_file_path)
+        return open(cached_path, "rb")
+
+
+    def open_file(self, src_file_path, raw=False):
+        rf = self.open_read(src_file_path)
+        if rf is None:
+            return None
+        with closing(rf):
+            content = rf.read()
+        return content if raw else Compression.decompress(content)
+
+
+    def map_file(self, src_file_path, temp_dir=None):
+        status = self.location.file_status(src_file_path)
+        if status is None:
+            return None
+        cached_path = self._cached(src_file_path, "decompressed", status, self._copy_from(src_file_path, True))
+        if cached_path is None:
+            return self.location.map_file(src_file_path, temp_dir)
+        return LocalLocation().map_file(cached_path)
+
+
+    def map_derived(self, src_file_path, name, dump=None):
+        """Return content derived from a file, memory mapped, as long as the
+           file is unchanged.
+
+        :param src_file_path: path of the file.
+        :type src_file_path: str.
+        :param name: Name of the derived content.
+        :type name: str.
+        :param dump: Called with a binary file object to write the content to
+                     if it is not cached, nothing is cached if None.
+        :type dump: function.
+        :returns: None if the content is not cached.
+        """
+        status = self.location.file_status(src_file_path)
+        if status is None:
+            return None
+        key = "{}:{}".format(name, src_file_path)
+        if dump is None:
+            cached_path = self.cache.get(key, status)
+        else:
+            cached_path = self._cached(src_file_path, name, status, dump)
+        return None if cached_path is None else LocalLocation().map_file(cached_path)
+
+
+    def move_file_to(self, src_file_path, des_file_path):
+        self.location.move_file_to(src_file_path, des_file_path)
+
+
+    def remove_file(self, des_file_path):
+        self.location.remove_file(des_file_path)
+
+
+    def file_status(self, src_file_path):
+        return self.location.file_status(src_file_path)
+
+
+    def read_range(self, src_file_path, offset, length):
+        # Ranges are small reads of archives, not worth a status request.
+        return self.location.read_range(src_file_path, offset, length)
+
+
+    def stage_path(self, des_path, temp_dir=None):
+        return self.location.stage_path(des_path, temp_dir)
+
+
+    def commit_staged(self, staged_path, des_path):
+        self.location.commit_staged(staged_path, des_path)
+
+
+    def discard_staged(self, staged_path):
+        self.location.discard_staged(staged_path)
+
+
+    def update_path(self, des_dir, temp_dir=None):
+        return self.location.update_path(des_dir, temp_dir)
+
+
+    def commit_update(self, update_dir, des_dir):
+        self.location.commit_update(update_dir, des_dir)
+
+
+    def discard_update(self, update_dir):
+        self.location.discard_update(update_dir)
+
+
+    def flush(self, raise_errors=True):
+        self.location.flush(raise_errors)
+
+
+def _paths_overlap(path_a, path_b):
+    """Whether two paths are the same, one is under the other, or they are
+       in the same directory."""
+    path_a = path_a.rstrip("/")
+    path_b = path_b.rstrip("/")
+    if path_a == path_b or path_a.startswith(path_b + "/") or path_b.startswith(path_a + "/"):
+        return True
+    return os.path.dirname(path_a) == os.path.dirname(path_b)
+
+
+class _UploadJob(object):
+    """A commit, move or removal published in the background."""
+
+    def __init__(self, des_path, src_path, run, cleanup, blockers):
+        self.des_path = des_path
+        self.src_path = src_path
+        self.run = run
+        self.cleanup = cleanup
+        self.blockers = blockers
+        self.error = None
+        self.done = threading.Event()
+
+
+    def describe(self):
+        if self.src_path is None:
+            return "remove {}".format(self.des_path)
+        return "{} -> {}".format(self.src_path, self.des_path)
+
+
+class AsyncUploadLocation(Location):
+    """Location publishing commits of another one in the background.
+
+    Commits of staged files and directories, moves and removals return at
+    once and are run by workers threads, so collecting and exporting go on
+    while earlier results are uploaded. Up to max_pending of them wait or
+    run at a time, a commit beyond that blocks until one is done.
+
+    A commit starts only once earlier ones to the same path, a path under
+    or above it, or a path in the same directory are done. Files published
+    after others, like a manifest after the files it lists, stay in that
+    order, and a commit is skipped if one it waits for failed. Reads of a
+    path wait the same way for commits writing it.
+
+    Failures are raised by flush, with the files involved.
+    """
+
+    def __init__(self, location, workers=2, max_pending=8):
+        """
+        :param location: Location the commits are published to.
+        :type location: An instance of Location.
+        :param workers: Number of commits run at once.
+        :type workers: int.
+        :param max_pending: Number of commits waiting or running at once.
+        :type max_pending: int.
+        """
+        self.location = location
+        self._jobs = []
+        self._held_paths = set()
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max(1, int(max_pending)))
+        self._queue = Queue.Queue()
+        for _ in xrange(max(1, int(workers))):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+
+    def _work(self):
+        while True:
+            self._run_job(self._queue.get())
+
+
+    def _run_job(self, job):
+        try:
+            for each_blocker in job.blockers:
+                each_blocker.done.wait()
+            failed = [b for b in job.blockers if b.error is not None]
+            if failed:
+                job.error = IOError("Not published, {} failed first".format(failed[0].describe()))
+            else:
+                try:
+                    job.run()
+                except Exception as e:
+                    logger.error("Failed to publish %s: %s" % (job.describe(), traceback.format_exc()))
+                    job.error = e
+        finally:
+            try:
+                if job.cleanup is not None:
+                    job.cleanup()
+            finally:
+                with self._lock:
+                    self._held_paths.discard(job.src_path)
+                job.done.set()
+                self._slots.release()
+
+
+    def _submit(self, des_path, src_path, run, cleanup=None):
+        # Blocks while max_pending commits are not done.
+        self._slots.acquire()
+        with self._lock:
+            # Failed commits are kept until flush, those after them are skipped.
+            self._jobs = [j for j in self._jobs if not j.done.is_set() or j.error is not None]
+            blockers = [j for j in self._jobs if _paths_overlap(j.des_path, des_path)]
+            job = _UploadJob(des_path, src_path, run, cleanup, blockers)
+            self._jobs.append(job)
+            if src_path is not None:
+                self._held_paths.add(src_path)
+        logger.debug("Publish %s in the background." % job.describe())
+        self._queue.put(job)
+
+
+    def _wait_for(self, path):
+        with self._lock:
+            jobs = [j for j in self._jobs if _paths_overlap(j.des_path, path)]
+        for each_job in jobs:
+            each_job.done.wait()
+
+
+    def flush(self, raise_errors=True):
+        with self._lock:
+            jobs = list(self._jobs)
+        for each_job in jobs:
+            each_job.done.wait()
+
+        with self._lock:
+            failed = [j for j in self._jobs if j.error is not None]
+            self._jobs = [j for j in self._jobs if not j.done.is_set()]
+        if failed and raise_errors:
+            raise IOError("Failed to publish {} commits: {}".format(
+                len(failed), "; ".join("{} ({})".format(j.describe(), j.error) for j in failed)))
+
+
+    def move_file_to(self, src_file_path, des_file_path):
+        self._submit(des_file_path, src_file_path, partial(self.location.move_file_to, src_file_path, des_file_path))
+
+
+    def remove_file(self, des_file_path):
+        self._submit(des_file_path, None, partial(self.location.remove_file, des_file_path))
+
+
+    def stage_path(self, des_path, temp_dir=None):
+        return self.location.stage_path(des_path, temp_dir)
+
+
+    def commit_staged(self, staged_path, des_path):
+        self._submit(des_path, staged_path, partial(self.location.commit_staged, staged_path, des_path),
+                     partial(self.location.discard_staged, staged_path))
+
+
+    def discard_staged(self, staged_path):
+        # Staged content being published is discarded after it.
+        with self._lock:
+            if staged_path in self._held_paths:
+                return
+        self.location.discard_staged(staged_path)
+
+
+    def update_path(self, des_dir, temp_dir=None):
+        return self.location.update_path(des_dir, temp_dir)
+
+
+    def commit_update(self, update_dir, des_dir):
+        self._submit(des_dir, update_dir, partial(self.location.commit_update, update_dir, des_dir),
+                     partial(self.location.discard_update, update_dir))
+
+
+    def discard_update(self, update_dir):
+        with self._lock:
+            if update_dir in self._held_paths:
+                return
+        self.location.discard_update(update_dir)
+
+
+    def file_status(self, src_file_path):
+        self._wait_for(src_file_path)
+        return self.location.file_status(src_file_path)
+
+
+    def open_file(self, src_file_path, raw=False):
+        self._wait_for(src_file_path)
+        return self.location.open_file(src_file_path, raw)
+
+
+    def open_read(self, src_file_path):
+        self._wait_for(src_file_path)
+        return self.location.open_read(src_file_path)
+
+
+    def map_file(self, src_file_path, temp_dir=None):
+        self._wait_for(src_file_path)
+        return self.location.map_file(src_file_path, temp_dir)
 
 
-    def open_file(self, src_file_path):
-        resp = self._global_api_session.get("{}{}?op=OPEN".format(self.uri_prefix,
-                                                                  src_file_path))
-        return resp.text
+    def read_range(self, src_file_path, offset, length):
+        self._wait_for(src_file_path)
+        return self.location.read_range(src_file_path, offset, length)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import re
+import hashlib
+import logging
+import traceback
+
+import simplejson as json
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+MANIFEST_VERSION = 1
+
+# References of a json document to text files, see TextBlob.TextFileStore.
+_TEXT_REF = re.compile(r'"text_blob": "([^"]+)"')
+
+
+class Manifest(object):
+    """Content hashes of files in a database directory, keyed by path
+    relative to the directory.
+
+    Files are recorded as they are saved. A file whose hash is the same as
+    in the manifest of the previous save need not be written again, files
+    of the previous save not recorded this time are stale.
+    """
+
+    def __init__(self, previous=None):
+        """
+        :param previous: Manifest of the previous save, or None.
+        :type previous: An instance of Manifest.
+        """
+        self.files = {}
+        self._previous = {} if previous is None else previous.files
+
+
+    @classmethod
+    def load(cls, location, file_path):
+        """Read a manifest from a location.
+
+        :param location: Location of the manifest file.
+        :type location: An instance of Location.
+        :param file_path: Path of the manifest file.
+        :type file_path: str.
+        :returns: An instance of Manifest, None if the file does not exist or
+                  is not a manifest.
+        """
+        try:
+            content = location.open_file(file_path)
+            if content is None:
+                return None
+            doc = json.loads(content)
+        except:
+            logger.debug(traceback.format_exc())
+            return None
+
+        if not isinstance(doc, dict) or doc.get("version") != MANIFEST_VERSION or \
+           not isinstance(doc.get("files"), dict):
+            logger.warning("Ignore invalid manifest %s" % file_path)
+            return None
+
+        manifest = cls()
+        manifest.files = doc["files"]
+        return manifest
+
+
+    def record(self, rel_path, content):
+        """Record a json document and the text files it refers to.
+
+        :param rel_path: Path of the document relative to the database directory.
+        :type rel_path: str.
+        :param content: Content of the document.
+        :type content: str.
+        :returns: True if the document has to be written, False if the
+                  previous save wrote the same content.
+        """
+        digest = hashlib.sha1(content).hexdigest()
+        self.files[rel_path] = digest
+        for each_ref in _TEXT_REF.findall(content):
+            # Text files are named by the hash of their content.
+            self.files[each_ref] = each_ref.rsplit("/", 1)[-1].split(".", 1)[0]
+
+        return self._previous.get(rel_path) != digest
+
+
+    def revert(self, rel_path):
+        """Undo record of a document that could not be written, the file
+           still has the content of the previous save, if any.
+
+        :param rel_path: Path of the document relative to the database directory.
+        :type rel_path: str.
+        """
+        if rel_path in self._previous:
+            self.files[rel_path] = self._previous[rel_path]
+        else:
+            self.files.pop(rel_path, None)
+
+
+    def previous_paths(self):
+        """Return paths of files of the previous save."""
+        return self._previous.keys()
+
+
+    def unchanged_count(self):
+        """Return number of files recorded with the same hash as before."""
+        return sum(1 for k, v in self.files.iteritems() if self._previous.get(k) == v)
+
+
+    def stale_paths(self):
+        """Return sorted paths of files of the previous save not recorded."""
+        return sorted(set(self._previous) - set(self.files))
+
+
+    def dumps(self):
+        return json.dumps({"version": MANIFEST_VERSION, "files": self.files}, sort_keys=True)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import logging
+from bisect import bisect_right
+
+import simplejson as json
+
+from database_schema_collect.util import ARCHIVE_INDEX_SUFFIX
+from database_schema_collect import Compression
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+ARCHIVE_FORMAT = "jsonl"
+# Version 2 adds compressed blocks.
+ARCHIVE_VERSION = 2
+
+# Uncompressed size of a compressed block of an archive.
+DEFAULT_BLOCK_SIZE = 256 * 1024
+
+
+def _read_exactly(reader, size):
+    """Read size bytes from a stream whose reads may return less."""
+    chunks = []
+    while size > 0:
+        chunk = reader.read(size)
+        if not chunk:
+            raise ValueError("Archive ends {} bytes early".format(size))
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class JsonLinesArchiveWriter(object):
+    """Write metadata documents into one JSON Lines file.
+
+    Each line is the json document a per-object file would hold. The index
+    file next to it, <archive>.index, maps the relative path the document
+    would have in the files layout to its offset and length in the
+    uncompressed archive.
+
+    With a codec, lines are compressed in blocks of whole lines, each block
+    a complete gzip member, zstd frame or lz4 frame. The blocks concatenated
+    are a valid compressed file, and the index also lists
+    (uncompressed offset, offset, length) of every block so a document is
+    read by decompressing only its block.
+    """
+
+    def __init__(self, file_path, compression=None, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        :param file_path: Path of the archive file.
+        :type file_path: str.
+        :param compression: Codec of the archive, not compressed if None.
+        :type compression: A codec from Compression.get_codec.
+        :param block_size: Uncompressed size of blocks.
+        :type block_size: int.
+        """
+        self.file_path = file_path
+        self.compression = compression
+        self.block_size = block_size
+        self._wf = open(file_path, "wb")
+        self._offset = 0
+        self._entries = []
+        self._blocks = []
+        self._block_lines = []
+        self._block_start = 0
+        self._block_len = 0
+        self._written = 0
+
+
+    def add(self, key, struct_obj):
+        """Append a document.
+
+        :param key: Relative path of the document, like schema/table.json.
+        :type key: str.
+        :param struct_obj: Output of to_struct.
+        :type struct_obj: dict.
+        """
+        self.add_json(key, json.dumps(struct_obj))
+
+
+    def add_json(self, key, line):
+        """Append a document already serialized to json.
+
+        :param key: Relative path of the document.
+        :type key: str.
+        :param line: json text of the document, without line breaks.
+        :type line: str.
+        """
+        self._entries.append((key, self._offset, len(line)))
+        self._offset += len(line) + 1
+
+        if self.compression is None:
+            self._wf.write(line)
+            self._wf.write("\n")
+        else:
+            self._block_lines.append(line)
+            self._block_len += len(line) + 1
+            if self._block_len >= self.block_size:
+                self._flush_block()
+
+
+    def _flush_block(self):
+        if not self._block_lines:
+            return
+        self._block_lines.append("")
+        packed = self.compression.compress("\n".join(self._block_lines))
+        self._wf.write(packed)
+        self._blocks.append((self._block_start, self._written, len(packed)))
+        self._written += len(packed)
+        self._block_start = self._offset
+        self._block_lines = []
+        self._block_len = 0
+
+
+    def close(self):
+        """Close the archive and write its index."""
+        index = {"format": ARCHIVE_FORMAT,
+                 "version": ARCHIVE_VERSION,
+                 "objects": self._entries}
+        if self.compression is not None:
+            self._flush_block()
+            index["compression"] = self.compression.name
+            index["blocks"] = self._blocks
+        self._wf.close()
+
+        with open(self.file_path + ARCHIVE_INDEX_SUFFIX, "wb") as wf:
+            json.dump(index, wf)
+        logger.debug("Archive %s holds %d objects in %d blocks." % (self.file_path, len(self._entries),
+                                                                    len(self._blocks)))
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class JsonLinesArchive(object):
+    """Read documents of an archive one by one, through its index."""
+
+    def __init__(self, location, file_path):
+        """
+        :param location: Location holding the archive.
+        :type location: An instance of Location.
+        :param file_path: Path of the archive file.
+        :type file_path: str.
+        :raises: ValueError.
+        """
+        self.location = location
+        self.file_path = file_path
+
+        raw_index = location.open_file(file_path + ARCHIVE_INDEX_SUFFIX)
+        if raw_index is None:
+            raise ValueError("No index for archive {}".format(file_path))
+        index = json.loads(raw_index)
+        if index.get("format") != ARCHIVE_FORMAT or index.get("version", 0) > ARCHIVE_VERSION:
+            raise ValueError("Unsupported archive {} version {}".format(index.get("format"), index.get("version")))
+        self._entries = dict((key, (offset, length)) for key, offset, length in index["objects"])
+        self._keys = [e[0] for e in index["objects"]]
+        self._blocks = index.get("blocks")
+        self._block_starts = [b[0] for b in self._blocks] if self._blocks else None
+
+
+    def keys(self):
+        """Return relative paths of all documents, in archive order."""
+        return list(self._keys)
+
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
+    def read(self, key):
+        """Return a document.
+
+        :param key: Relative path of the document.
+        :type key: str.
+        :returns: dict, None if the archive does not hold it.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        if self._blocks is None:
+            return json.loads(self.location.read_range(self.file_path, offset, length))
+
+        block_start, block_offset, block_length = self._blocks[bisect_right(self._block_starts, offset) - 1]
+        block = Compression.decompress(self.location.read_range(self.file_path, block_offset, block_length))
+        return json.loads(block[offset - block_start:offset - block_start + length])
+
+
+    def iter_documents(self, prefix=None):
+        """Yield (key, document) of documents whose key starts with prefix.
+
+        The archive is streamed once instead of read once per document, only
+        the document being parsed is held in memory.
+        """
+        rf = self.location.open_read(self.file_path)
+        if rf is None:
+            return
+        try:
+            reader = Compression.open_reader(rf)
+            position = 0
+            for each_key in self._keys:
+                if prefix is not None and not each_key.startswith(prefix):
+                    continue
+                offset, length = self._entries[each_key]
+                # Documents are in archive order, skip those in between.
+                while position < offset:
+                    skipped = reader.read(min(offset - position, Compression.STREAM_CHUNK_SIZE))
+                    if not skipped:
+                        raise ValueError("Archive {} ends before {}".format(self.file_path, each_key))
+                    position += len(skipped)
+                yield each_key, json.loads(_read_exactly(reader, length))
+                position = offset + length
+        finally:
+            rf.close()
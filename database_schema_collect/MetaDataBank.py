@@ -5,15 +5,25 @@ from __future__ import absolute_import
 
 import sys
 import os
-import shutil
 import logging
+import threading
 import traceback
+import multiprocessing
+from itertools import izip
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import simplejson as json
 import cPickle as pickle
 from marshmallow import Schema, fields, post_load
 
 from database_schema_collect.util import BANK_NAME_PATTERN
+from database_schema_collect.util import ARCHIVE_NAME_PATTERN
+from database_schema_collect.util import MANIFEST_NAME_PATTERN
+from database_schema_collect.util import TENANTS_NAME_PATTERN
+from database_schema_collect import Compression
+from database_schema_collect.Manifest import Manifest
+from database_schema_collect.SpillStore import SpillingList
 
 reload(sys)
 sys.setdefaultencoding("utf-8")
@@ -22,6 +32,78 @@ sys.setdefaultencoding("utf-8")
 logger = logging.getLogger("database_schema_collect")
 
 
+# Loaded objects without constraints or indexes share this instead of
+# carrying their own empty list. Lists of a bank itself, and of banks
+# being collected, are real lists.
+EMPTY_LIST = ()
+
+# Repeated values such as data types, owners and tablespace names are
+# stored once per process instead of once per object.
+_STRING_POOL = {}
+
+
+def intern_str(value):
+    """Return the pooled copy of a string.
+
+    :param value: A string or None.
+    :returns: An equal string shared with all other callers.
+    """
+    if value is None:
+        return None
+    return _STRING_POOL.setdefault(value, value)
+
+
+def _slot_names(cls):
+    """Return names of all slots defined along the class hierarchy."""
+    names = []
+    for klass in reversed(cls.__mro__):
+        for each_slot in klass.__dict__.get("__slots__", ()):
+            if each_slot not in names:
+                names.append(each_slot)
+    return tuple(names)
+
+
+class DeferredText(object):
+    """Text kept out of line, read when the attribute holding it is first accessed."""
+
+    __slots__ = ("_loader", "_key")
+
+    def __init__(self, loader, key):
+        """
+        :param loader: Function returns the text of a key.
+        :type loader: function.
+        :param key: Key of the text.
+        """
+        self._loader = loader
+        self._key = key
+
+
+    def load(self):
+        return self._loader(self._key)
+
+
+class _TextSlot(object):
+    """Descriptor over a slot, replaces a DeferredText in the slot by its
+    text on first access."""
+
+    def __init__(self, slot):
+        self.slot = slot
+
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        value = self.slot.__get__(obj, cls)
+        if type(value) is DeferredText:
+            value = value.load()
+            self.slot.__set__(obj, value)
+        return value
+
+
+    def __set__(self, obj, value):
+        self.slot.__set__(obj, value)
+
+
 def convert_field_type(obj_field, init_class):
     """Convert deserialized field from dict to init_class object.
 
@@ -45,10 +127,31 @@ def convert_field_type(obj_field, init_class):
 
 class MetaData(object):
 
+    __slots__ = ("name",)
+
     def __init__(self):
         self.name = None
 
 
+    @classmethod
+    def field_names(cls):
+        """Return names of all attributes of this kind of metadata object."""
+        names = cls.__dict__.get("_field_names")
+        if names is None:
+            names = _slot_names(cls)
+            cls._field_names = names
+        return names
+
+
+    def __getstate__(self):
+        return dict((k, getattr(self, k, None)) for k in self.field_names())
+
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
+
     def get_name(self, jsonfile=False):
         """Return name of the object.
 
@@ -66,20 +169,25 @@ class MetaData(object):
 class ColumnMetaData(MetaData):
     """Container of meta data of a column in a table."""
 
+    __slots__ = ("column_name", "column_index", "column_data_type", "column_length",
+                 "column_scale", "column_precision", "column_comment", "column_default_value",
+                 "column_auto_increment", "column_is_nullable", "column_is_unique", "column_in_pk",
+                 "column_in_fk")
+
     def __init__(self, name=None, column_name=None, column_index=None, column_data_type=None,
                  column_length=None, column_scale=None, column_precision=None,
                  column_comment=None, column_default_value=None,
                  column_auto_increment=None, column_is_nullable=None,
                  column_is_unique=None, column_in_pk=None, column_in_fk=None):
-        self.column_name = column_name
-        self.name = name
+        self.column_name = intern_str(column_name)
+        self.name = intern_str(name)
         self.column_index = column_index
-        self.column_data_type = column_data_type
+        self.column_data_type = intern_str(column_data_type)
         self.column_length = column_length
         self.column_scale = column_scale
         self.column_precision = column_precision
         self.column_comment = column_comment
-        self.column_default_value = column_default_value
+        self.column_default_value = intern_str(column_default_value)
         # For PostgreSQL, this should be the name of sequence.
         self.column_auto_increment = column_auto_increment
         self.column_is_nullable = column_is_nullable
@@ -115,12 +223,14 @@ class ColumnMetaDataSchema(Schema):
 class PKMetaData(MetaData):
     """Container of meta data of a primary key of a table."""
 
+    __slots__ = ("pk_name", "pk_column", "pk_column_index", "pk_tablespace")
+
     def __init__(self, name=None, pk_name=None, pk_column=None, pk_column_index=None, pk_tablespace=None):
         self.pk_name = pk_name
         self.name = name
-        self.pk_column = pk_column
+        self.pk_column = intern_str(pk_column)
         self.pk_column_index = pk_column_index
-        self.pk_tablespace = pk_tablespace
+        self.pk_tablespace = intern_str(pk_tablespace)
 
 
 class PKMetaDataSchema(Schema):
@@ -136,12 +246,14 @@ class PKMetaDataSchema(Schema):
 class FKMetaData(MetaData):
     """Container of meta data of a foreign key of a table."""
 
+    __slots__ = ("fk_name", "fk_column", "fk_ref_tablename", "fk_ref_column")
+
     def __init__(self, name=None, fk_name=None, fk_column=None, fk_ref_tablename=None, fk_ref_column=None):
         self.fk_name = fk_name
         self.name = name
-        self.fk_column = fk_column
-        self.fk_ref_tablename = fk_ref_tablename
-        self.fk_ref_column = fk_ref_column
+        self.fk_column = intern_str(fk_column)
+        self.fk_ref_tablename = intern_str(fk_ref_tablename)
+        self.fk_ref_column = intern_str(fk_ref_column)
 
 
 class FKMetaDataSchema(Schema):
@@ -157,12 +269,14 @@ class FKMetaDataSchema(Schema):
 class UKMetaData(MetaData):
     """Container of meta data of a unique key of a table."""
 
+    __slots__ = ("uk_name", "uk_column", "uk_column_index", "uk_tablespace")
+
     def __init__(self, name=None, uk_name=None, uk_column=None, uk_column_index=None, uk_tablespace=None):
         self.uk_name = uk_name
         self.name = name
-        self.uk_column = uk_column
+        self.uk_column = intern_str(uk_column)
         self.uk_column_index = uk_column_index
-        self.uk_tablespace = uk_tablespace
+        self.uk_tablespace = intern_str(uk_tablespace)
 
 
 class UKMetaDataSchema(Schema):
@@ -178,6 +292,8 @@ class UKMetaDataSchema(Schema):
 class CheckMetaData(MetaData):
     """Container of meta data of a check constraint of a table."""
 
+    __slots__ = ("check_name", "check_define")
+
     def __init__(self, name=None, check_name=None, check_define=None):
         self.check_name = check_name
         self.name = name
@@ -195,14 +311,16 @@ class CheckMetaDataSchema(Schema):
 class IndexMetaData(MetaData):
     """Container of meta data of an index of a table."""
 
+    __slots__ = ("index_name", "index_columns", "index_type", "index_tablespace", "index_define")
+
     def __init__(self, name=None, index_name=None, index_columns=None, index_type=None,
                  index_tablespace=None, index_define=None):
         self.index_name = index_name
         self.name = name
         # Column names should be seperated by comma.
         self.index_columns = index_columns
-        self.index_type = index_type
-        self.index_tablespace = index_tablespace
+        self.index_type = intern_str(index_type)
+        self.index_tablespace = intern_str(index_tablespace)
         self.index_define = index_define
 
 
@@ -221,18 +339,22 @@ class IndexMetaDataSchema(Schema):
 class TableMetaData(MetaData):
     """Container of meta data of a table."""
 
+    __slots__ = ("table_name", "table_schemaname", "columns", "column_longest_length",
+                 "table_comment", "table_tablespace", "table_owner", "primary_key", "foreign_keys",
+                 "unique_keys", "indexes", "checks")
+
     def __init__(self, name=None, table_name=None, table_schemaname=None, columns=None,
                  column_longest_length=None,table_comment=None, table_tablespace=None, table_owner=None,
                  primary_key=None, foreign_keys=None, unique_keys=None,
                  indexes=None, checks=None):
         self.table_name = table_name
         self.name = name
-        self.table_schemaname = table_schemaname
+        self.table_schemaname = intern_str(table_schemaname)
         self.columns = [] if columns is None else columns
         self.column_longest_length = column_longest_length
         self.table_comment = table_comment
-        self.table_tablespace = table_tablespace
-        self.table_owner = table_owner
+        self.table_tablespace = intern_str(table_tablespace)
+        self.table_owner = intern_str(table_owner)
         self.primary_key = [] if primary_key is None else primary_key
         self.foreign_keys = [] if foreign_keys is None else foreign_keys
         self.unique_keys = [] if unique_keys is None else unique_keys
@@ -259,15 +381,9 @@ class TableMetaDataSchema(Schema):
 
     def make_table(self, data):
         """For deserialize table metadata object."""
+        table_obj = None
         try:
-            table_obj = TableMetaData(**data)
-
-            table_obj.columns = convert_field_type(table_obj.columns, ColumnMetaData)
-            table_obj.primary_key = convert_field_type(table_obj.primary_key, PKMetaData)
-            table_obj.foreign_keys = convert_field_type(table_obj.foreign_keys, FKMetaData)
-            table_obj.unique_keys = convert_field_type(table_obj.unique_keys, UKMetaData)
-            table_obj.indexes = convert_field_type(table_obj.indexes, IndexMetaData)
-            table_obj.checks = convert_field_type(table_obj.checks, CheckMetaData)
+            table_obj = _LOADERS[TableMetaData](data)
         except:
             logger.debug(traceback.format_exc())
 
@@ -277,11 +393,13 @@ class TableMetaDataSchema(Schema):
 class ViewMetaData(MetaData):
     """Container of meta data of a view."""
 
+    __slots__ = ("view_name", "view_schemaname", "view_owner", "view_define", "view_comment")
+
     def __init__(self, name=None, view_name=None, view_schemaname=None, view_owner=None, view_define=None, view_comment=None):
         self.view_name = view_name
         self.name = name
-        self.view_schemaname = view_schemaname
-        self.view_owner = view_owner
+        self.view_schemaname = intern_str(view_schemaname)
+        self.view_owner = intern_str(view_owner)
         self.view_define = view_define
         self.view_comment = view_comment
 
@@ -300,10 +418,16 @@ class ViewMetaDataSchema(Schema):
 class SchemaMetaData(MetaData):
     """Container of meta data of a schema."""
 
-    def __init__(self, name=None, schema_name=None, schema_owner=None):
+    __slots__ = ("schema_name", "schema_owner", "schema_template")
+
+    def __init__(self, name=None, schema_name=None, schema_owner=None, schema_template=None):
         self.schema_name = schema_name
         self.name = name
-        self.schema_owner = schema_owner
+        self.schema_owner = intern_str(schema_owner)
+        # Name of the schema holding the tables, views and foreign tables of
+        # this one, which has the same objects but its own schema name. None
+        # if this schema holds its own objects.
+        self.schema_template = schema_template
 
 
 class SchemaMetaDataSchema(Schema):
@@ -312,17 +436,20 @@ class SchemaMetaDataSchema(Schema):
     schema_name = fields.Str(required=True)
     name = fields.Str(allow_none=True)
     schema_owner = fields.Str(allow_none=True)
+    schema_template = fields.Str(allow_none=True)
 
 
 class TablespaceMetaData(MetaData):
     """Container of meta data of a tablespace of a table."""
 
+    __slots__ = ("tablespace_name", "tablespace_location", "tablespace_owner", "tablespace_comment")
+
     def __init__(self, name=None, tablespace_name=None, tablespace_location=None,
                  tablespace_owner=None, tablespace_comment=None):
         self.tablespace_name = tablespace_name
         self.name = name
         self.tablespace_location = tablespace_location
-        self.tablespace_owner = tablespace_owner
+        self.tablespace_owner = intern_str(tablespace_owner)
         self.tablespace_comment = tablespace_comment
 
 
@@ -339,12 +466,15 @@ class TablespaceMetaDataSchema(Schema):
 class FServerMetaData(MetaData):
     """Container of meta data of a foreign server."""
 
+    __slots__ = ("foreign_servername", "foreign_server_owner", "foreign_server_wrapper",
+                 "foreign_server_option")
+
     def __init__(self, name=None, foreign_servername=None, foreign_server_owner=None,
                  foreign_server_wrapper=None, foreign_server_option=None):
         self.foreign_servername = foreign_servername
         self.name = name
-        self.foreign_server_owner = foreign_server_owner
-        self.foreign_server_wrapper = foreign_server_wrapper
+        self.foreign_server_owner = intern_str(foreign_server_owner)
+        self.foreign_server_wrapper = intern_str(foreign_server_wrapper)
         self.foreign_server_option = foreign_server_option
 
 
@@ -361,13 +491,16 @@ class FServerMetaDataSchema(Schema):
 class FTableMetaData(MetaData):
     """Container of meta data of a foreign table."""
 
+    __slots__ = ("foreign_tablename", "foreign_schemaname", "foreign_server",
+                 "foreign_data_wrapper")
+
     def __init__(self, name=None, foreign_tablename=None, foreign_schemaname=None,
                  foreign_server=None, foreign_data_wrapper=None):
         self.foreign_tablename = foreign_tablename
         self.name = name
-        self.foreign_schemaname = foreign_schemaname
-        self.foreign_server = foreign_server
-        self.foreign_data_wrapper = foreign_data_wrapper
+        self.foreign_schemaname = intern_str(foreign_schemaname)
+        self.foreign_server = intern_str(foreign_server)
+        self.foreign_data_wrapper = intern_str(foreign_data_wrapper)
 
 
 class FTableMetaDataSchema(Schema):
@@ -383,6 +516,10 @@ class FTableMetaDataSchema(Schema):
 class DatabaseMetaData(MetaData):
     """Container of meta data of a database."""
 
+    __slots__ = ("database_name", "database_encoding", "database_comment", "database_owner",
+                 "database_lc_collate", "database_lc_ctype", "database_default_data_tablespace",
+                 "database_default_temp_tablespace", "database_connection_limit")
+
     def __init__(self, name=None, database_name=None, database_encoding=None, database_comment=None,
                  database_owner=None, database_lc_collate=None,
                  database_lc_ctype=None, database_default_data_tablespace=None,
@@ -415,6 +552,11 @@ class DatabaseMetaDataSchema(Schema):
     database_connection_limit = fields.Int(allow_none=True)
 
 
+def full_object_name(schemaname, objectname):
+    """Return fully qualified name of a database object."""
+    return "{}.{}".format(schemaname, objectname)
+
+
 class DatabaseMetaDataBank(object):
     """Container of meta data of a meta data bank."""
 
@@ -429,6 +571,298 @@ class DatabaseMetaDataBank(object):
         self.foreign_servers = [] if foreign_servers is None else foreign_servers
         self.foreign_tables = [] if foreign_tables is None else foreign_tables
 
+        # schemaname -> {"tables": [], "views": [], "foreign_tables": []}
+        self._schema_index = {}
+        # "schemaname.objectname" -> table, view or foreign table
+        self._name_index = {}
+        # "schemaname.tablename" -> [(referencing table, foreign key), ...]
+        self._fk_ref_index = {}
+        # Optional columnar copy of all columns, see ColumnStore.from_bank.
+        self.column_store = None
+
+
+    def rebuild_indexes(self):
+        """Rebuild all lookup indexes from the object lists."""
+        self._schema_index = {}
+        self._name_index = {}
+        self._fk_ref_index = {}
+
+        for each_table in self.tables:
+            self.index_table(each_table)
+        for each_view in self.views:
+            self.index_view(each_view)
+        for each_ftable in self.foreign_tables:
+            self.index_foreign_table(each_ftable)
+
+
+    def _schema_entry(self, schemaname):
+        """Return index entry of a schema, create it if not exists."""
+        entry = self._schema_index.get(schemaname)
+        if entry is None:
+            entry = {"tables": [], "views": [], "foreign_tables": []}
+            self._schema_index[schemaname] = entry
+        return entry
+
+
+    def index_table(self, tb_metadata):
+        """Register a table in the lookup indexes.
+
+        :param tb_metadata: Table metadata object.
+        :type tb_metadata: An instance of TableMetaData.
+        """
+        schemaname = tb_metadata.table_schemaname
+        self._schema_entry(schemaname)["tables"].append(tb_metadata)
+        self._name_index[full_object_name(schemaname, tb_metadata.table_name)] = tb_metadata
+
+        for each_fk in tb_metadata.foreign_keys:
+            ref_name = each_fk.fk_ref_tablename
+            if ref_name is None:
+                continue
+            if '.' not in ref_name:
+                ref_name = full_object_name(schemaname, ref_name)
+            self._fk_ref_index.setdefault(ref_name, []).append((tb_metadata, each_fk))
+
+
+    def index_view(self, vw_metadata):
+        """Register a view in the lookup indexes.
+
+        :param vw_metadata: View metadata object.
+        :type vw_metadata: An instance of ViewMetaData.
+        """
+        schemaname = vw_metadata.view_schemaname
+        self._schema_entry(schemaname)["views"].append(vw_metadata)
+        self._name_index[full_object_name(schemaname, vw_metadata.view_name)] = vw_metadata
+
+
+    def index_foreign_table(self, ftb_metadata):
+        """Register a foreign table in the lookup indexes.
+
+        :param ftb_metadata: Foreign table metadata object.
+        :type ftb_metadata: An instance of FTableMetaData.
+        """
+        schemaname = ftb_metadata.foreign_schemaname
+        self._schema_entry(schemaname)["foreign_tables"].append(ftb_metadata)
+        self._name_index[full_object_name(schemaname, ftb_metadata.foreign_tablename)] = ftb_metadata
+
+
+    def tables_in_schema(self, schemaname):
+        """Return tables belong to a schema."""
+        return self._schema_index.get(schemaname, {}).get("tables", [])
+
+
+    def views_in_schema(self, schemaname):
+        """Return views belong to a schema."""
+        return self._schema_index.get(schemaname, {}).get("views", [])
+
+
+    def foreign_tables_in_schema(self, schemaname):
+        """Return foreign tables belong to a schema."""
+        return self._schema_index.get(schemaname, {}).get("foreign_tables", [])
+
+
+    def schema_names(self):
+        """Return names of schemas which hold tables, views or foreign tables."""
+        return sorted(self._schema_index.keys())
+
+
+    def iter_tables(self, schemaname=None):
+        """Iterate tables, of one schema if schemaname is given."""
+        return iter(self.tables if schemaname is None else self.tables_in_schema(schemaname))
+
+
+    def iter_views(self, schemaname=None):
+        """Iterate views, of one schema if schemaname is given."""
+        return iter(self.views if schemaname is None else self.views_in_schema(schemaname))
+
+
+    def get_object(self, schemaname, objectname):
+        """Look up a table, view or foreign table by its name.
+
+        :param schemaname: Schema name, or None if objectname is fully qualified.
+        :type schemaname: str.
+        :param objectname: Object name.
+        :type objectname: str.
+        :returns: Metadata object, or None if not found.
+        """
+        if schemaname is None:
+            return self._name_index.get(objectname)
+        return self._name_index.get(full_object_name(schemaname, objectname))
+
+
+    def get_referencing_fks(self, schemaname, tablename):
+        """Return foreign keys reference to the given table.
+
+        :param schemaname: Schema name of the referenced table.
+        :type schemaname: str.
+        :param tablename: Name of the referenced table.
+        :type tablename: str.
+        :returns: list of (referencing TableMetaData, FKMetaData) pairs.
+        """
+        return self._fk_ref_index.get(full_object_name(schemaname, tablename), [])
+
+
+class SpillingDatabaseMetaDataBank(DatabaseMetaDataBank):
+    """Bank holding at most max_bytes of tables in memory, the least recently
+    added ones are spilled to disk and read again when accessed.
+
+    Indexes hold positions of tables instead of tables, so that spilled
+    tables are not kept in memory by them.
+    """
+
+    def __init__(self, max_bytes, spill_dir=None, **kwargs):
+        """
+        :param max_bytes: Memory budget of tables.
+        :type max_bytes: int.
+        :param spill_dir: Directory of the spill file, system default if None.
+        :type spill_dir: str.
+        """
+        tables = kwargs.pop("tables", None)
+        super(SpillingDatabaseMetaDataBank, self).__init__(**kwargs)
+        self.tables = SpillingList(max_bytes, spill_dir)
+        self.tables.extend(tables or [])
+
+
+    def rebuild_indexes(self):
+        """Rebuild all lookup indexes from the object lists."""
+        self._schema_index = {}
+        self._name_index = {}
+        self._fk_ref_index = {}
+
+        for position, each_table in enumerate(self.tables):
+            self.index_table(each_table, position)
+        for each_view in self.views:
+            self.index_view(each_view)
+        for each_ftable in self.foreign_tables:
+            self.index_foreign_table(each_ftable)
+
+
+    def index_table(self, tb_metadata, position=None):
+        """Register a table in the lookup indexes.
+
+        :param tb_metadata: Table metadata object.
+        :type tb_metadata: An instance of TableMetaData.
+        :param position: Position of the table in tables, the last one if None.
+        :type position: int.
+        """
+        if position is None:
+            position = len(self.tables) - 1
+        schemaname = tb_metadata.table_schemaname
+        self._schema_entry(schemaname)["tables"].append(position)
+        self._name_index[full_object_name(schemaname, tb_metadata.table_name)] = position
+
+        for fk_position, each_fk in enumerate(tb_metadata.foreign_keys):
+            ref_name = each_fk.fk_ref_tablename
+            if ref_name is None:
+                continue
+            if '.' not in ref_name:
+                ref_name = full_object_name(schemaname, ref_name)
+            self._fk_ref_index.setdefault(ref_name, []).append((position, fk_position))
+
+
+    def tables_in_schema(self, schemaname):
+        """Return tables belong to a schema."""
+        return self.tables.select(self._schema_index.get(schemaname, {}).get("tables", []))
+
+
+    def get_object(self, schemaname, objectname):
+        """Look up a table, view or foreign table by its name, see DatabaseMetaDataBank.get_object."""
+        obj = super(SpillingDatabaseMetaDataBank, self).get_object(schemaname, objectname)
+        return self.tables[obj] if isinstance(obj, int) else obj
+
+
+    def get_referencing_fks(self, schemaname, tablename):
+        """Return foreign keys reference to the given table, see DatabaseMetaDataBank.get_referencing_fks."""
+        referencing = []
+        for position, fk_position in self._fk_ref_index.get(full_object_name(schemaname, tablename), []):
+            each_table = self.tables[position]
+            referencing.append((each_table, each_table.foreign_keys[fk_position]))
+        return referencing
+
+
+    def tables_spilled(self):
+        """Return whether some tables are not in memory."""
+        return self.tables.spilled_count > 0
+
+
+def schema_templates(bank_obj):
+    """Return tenant schemas of a bank, by the schema holding their objects.
+
+    :param bank_obj: The meta data container.
+    :type bank_obj: An instance of DatabaseMetaDataBank or BankFormat.LazyBank.
+    :returns: OrderedDict of {template schema name: [tenant schema names]},
+              in the order of schemas.
+    """
+    templates = OrderedDict()
+    for each_schema in bank_obj.schemas:
+        if each_schema.schema_template is not None:
+            templates.setdefault(each_schema.schema_template, []).append(each_schema.schema_name)
+    return templates
+
+
+def select_objects(bank_obj, schemas=None, tables=None):
+    """Return a bank with only some tables, views and foreign tables of a bank.
+
+    Objects of a tenant schema are those of its template schema, the
+    template schema is kept along with the tenant schema.
+
+    :param bank_obj: The meta data container.
+    :type bank_obj: An instance of DatabaseMetaDataBank or BankFormat.LazyBank.
+    :param schemas: Keep all objects of these schemas.
+    :type schemas: list.
+    :param tables: Keep these objects, as schemaname.objectname.
+    :type tables: list.
+    :returns: An instance of DatabaseMetaDataBank, bank_obj itself if
+              neither schemas nor tables are given.
+    :raises: ValueError.
+    """
+    if not schemas and not tables:
+        return bank_obj
+
+    selected = DatabaseMetaDataBank(database=bank_obj.database,
+                                    tablespaces=list(bank_obj.tablespaces),
+                                    foreign_servers=list(bank_obj.foreign_servers))
+    templates = dict((s.schema_name, s.schema_template) for s in bank_obj.schemas
+                     if s.schema_template is not None)
+    kept_schemas = set(schemas or ())
+    # Schemas whose objects are all selected.
+    loaded_schemas = set()
+    for each_schema in schemas or ():
+        source_schema = templates.get(each_schema, each_schema)
+        kept_schemas.add(source_schema)
+        if source_schema in loaded_schemas:
+            continue
+        loaded_schemas.add(source_schema)
+        selected.tables.extend(bank_obj.tables_in_schema(source_schema))
+        selected.views.extend(bank_obj.views_in_schema(source_schema))
+        selected.foreign_tables.extend(bank_obj.foreign_tables_in_schema(source_schema))
+    picked = set()
+    for each_name in tables or ():
+        schemaname, sep, objectname = each_name.partition(".")
+        if not sep:
+            raise ValueError("Table names must be schemaname.tablename, got {}".format(each_name))
+        if schemaname in (schemas or ()):
+            continue
+        source_schema = templates.get(schemaname, schemaname)
+        if source_schema in loaded_schemas or (source_schema, objectname) in picked:
+            kept_schemas.update((schemaname, source_schema))
+            continue
+        obj = bank_obj.get_object(source_schema, objectname)
+        if isinstance(obj, TableMetaData):
+            selected.tables.append(obj)
+        elif isinstance(obj, ViewMetaData):
+            selected.views.append(obj)
+        elif isinstance(obj, FTableMetaData):
+            selected.foreign_tables.append(obj)
+        else:
+            logger.warning("No table, view or foreign table named %s" % each_name)
+            continue
+        picked.add((source_schema, objectname))
+        kept_schemas.update((schemaname, source_schema))
+    selected.schemas = [s for s in bank_obj.schemas if s.schema_name in kept_schemas]
+
+    selected.rebuild_indexes()
+    return selected
+
 
 class DatabaseMetaDataBankSchema(Schema):
     """Model of meta data of a meta data bank."""
@@ -449,26 +883,34 @@ class DatabaseMetaDataBankSchema(Schema):
         :param data: Deserialized data.
         :type data: dict.
         """
+        bank_obj = None
         try:
-            bank_obj = DatabaseMetaDataBank(**data)
-
-            bank_obj.database = convert_field_type(bank_obj.database, DatabaseMetaData)
-            bank_obj.tablespaces = convert_field_type(bank_obj.tablespaces, TablespaceMetaData)
-            bank_obj.schemas = convert_field_type(bank_obj.schemas, SchemaMetaData)
-            bank_obj.views = convert_field_type(bank_obj.views, ViewMetaData)
-            bank_obj.foreign_servers = convert_field_type(bank_obj.foreign_servers, FServerMetaData)
-            bank_obj.foreign_tables = convert_field_type(bank_obj.foreign_tables, FTableMetaData)
-
-            tmp = []
-            for t in bank_obj.tables:
-                tmp.append(TableMetaDataSchema().make_table(t))
-            bank_obj.tables = tmp
+            bank_obj = _LOADERS[DatabaseMetaDataBank](data)
+            bank_obj.rebuild_indexes()
         except:
             logger.error(traceback.format_exc())
 
         return bank_obj
 
 
+# Fields which may hold large texts, these can be stored out of line and
+# hold a DeferredText until first read.
+LARGE_TEXT_FIELDS = {ColumnMetaData: ("column_comment",),
+                     CheckMetaData: ("check_define",),
+                     IndexMetaData: ("index_define",),
+                     TableMetaData: ("table_comment",),
+                     ViewMetaData: ("view_define", "view_comment")}
+
+
+def _install_text_slots():
+    for each_cls, field_names in LARGE_TEXT_FIELDS.items():
+        for each_name in field_names:
+            setattr(each_cls, each_name, _TextSlot(each_cls.__dict__[each_name]))
+
+
+_install_text_slots()
+
+
 SCHEMA_MAP = {ColumnMetaData: ColumnMetaDataSchema,
               PKMetaData: PKMetaDataSchema,
               FKMetaData: FKMetaDataSchema,
@@ -485,21 +927,293 @@ SCHEMA_MAP = {ColumnMetaData: ColumnMetaDataSchema,
               DatabaseMetaDataBank: DatabaseMetaDataBankSchema}
 
 
-def to_struct(metadata_obj):
-    for k, v in SCHEMA_MAP.items():
-        if isinstance(metadata_obj, k):
-            return v().dump(metadata_obj).data
+def _dump_text(value):
+    """Same conversion as marshmallow fields.Str when dumping."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.decode("utf-8")
+    return unicode(value)
+
+
+def _dump_int(value):
+    return None if value is None else int(value)
+
+
+def _dump_bool(value):
+    return None if value is None else bool(value)
+
+
+def _dump_many(dumper, values):
+    return None if values is None else [dumper(v) for v in values]
+
+
+def _dump_one(dumper, value):
+    return None if value is None else dumper(value)
+
+
+def _load_nested(loader, value, empty=EMPTY_LIST):
+    """Same as convert_field_type, for generated load functions. Empty
+       lists are replaced by empty.
+    """
+    if isinstance(value, list):
+        if not value:
+            return empty
+        return [loader(v) for v in value]
+    elif isinstance(value, dict):
+        return loader(value)
     return None
 
 
+def _class_field_names(cls):
+    # Same names and order as the fields of a schema instance. Dumped dicts
+    # are built the way marshmallow builds them, so their key order, and
+    # the json files written from them, stay the same.
+    return [unicode(n) for n in SCHEMA_MAP[cls]().fields.keys()]
+
+
+def _func_suffix(cls):
+    return cls.__name__
+
+
+def _gen_serializer_source(cls):
+    """Generate source of the dump, load and canonical functions of a
+    metadata class.
+
+    Field conversions follow the declared fields of its marshmallow schema.
+    """
+    schema_fields = SCHEMA_MAP[cls]._declared_fields
+    dump_items = []
+    load_items = []
+    canon_items = {}
+    for each_name in _class_field_names(cls):
+        each_field = schema_fields[each_name]
+        attr = "obj.{}".format(each_name)
+        if isinstance(each_field, fields.Nested):
+            nested_cls = SCHEMA_CLASS_MAP[each_field.nested]
+            if each_field.many:
+                dump_expr = "_dump_many(dump_{}, {})".format(_func_suffix(nested_cls), attr)
+                canon_expr = "_dump_many(canon_{}, {})".format(_func_suffix(nested_cls), attr)
+            else:
+                dump_expr = "_dump_one(dump_{}, {})".format(_func_suffix(nested_cls), attr)
+                canon_expr = "_dump_one(canon_{}, {})".format(_func_suffix(nested_cls), attr)
+            if cls is DatabaseMetaDataBank:
+                # Lists of a bank are appended to, each gets its own.
+                load_expr = "_load_nested(load_{}, data.get({!r}), [])".format(_func_suffix(nested_cls),
+                                                                               each_name)
+            else:
+                load_expr = "_load_nested(load_{}, data.get({!r}))".format(_func_suffix(nested_cls), each_name)
+        elif isinstance(each_field, fields.Str):
+            dump_expr = "_dump_text({})".format(attr)
+            load_expr = "data.get({!r})".format(each_name)
+        elif isinstance(each_field, fields.Int):
+            dump_expr = "_dump_int({})".format(attr)
+            load_expr = "data.get({!r})".format(each_name)
+        elif isinstance(each_field, fields.Bool):
+            dump_expr = "_dump_bool({})".format(attr)
+            load_expr = "data.get({!r})".format(each_name)
+        else:
+            dump_expr = attr
+            load_expr = "data.get({!r})".format(each_name)
+        if not isinstance(each_field, fields.Nested):
+            canon_expr = dump_expr
+        dump_items.append("({!r}, {})".format(each_name, dump_expr))
+        load_items.append("{}={}".format(each_name, load_expr))
+        canon_items[each_name] = canon_expr
+
+    suffix = _func_suffix(cls)
+    return "\n".join(["def dump_{}(obj):".format(suffix),
+                      "    return dict([{}])".format(", ".join(dump_items)),
+                      "",
+                      "def load_{}(data):".format(suffix),
+                      "    return {}({})".format(suffix, ", ".join(load_items)),
+                      "",
+                      "def canon_{}(obj):".format(suffix),
+                      # Sorted by name, the order of schema fields may vary between processes.
+                      "    return ({},)".format(", ".join(canon_items[k] for k in sorted(canon_items))),
+                      ""])
+
+
+def _build_serializers():
+    """Generate dump, load and canonical functions of all metadata classes once.
+
+    :returns: ({class: dump function}, {class: load function}, {class: canonical function}).
+    """
+    namespace = {"_dump_text": _dump_text,
+                 "_dump_int": _dump_int,
+                 "_dump_bool": _dump_bool,
+                 "_dump_many": _dump_many,
+                 "_dump_one": _dump_one,
+                 "_load_nested": _load_nested}
+    for each_cls in SCHEMA_MAP:
+        namespace[each_cls.__name__] = each_cls
+    source = "\n".join(_gen_serializer_source(c) for c in SCHEMA_MAP)
+    exec(compile(source, "<metadata serializers>", "exec"), namespace)
+
+    dumpers = dict((c, namespace["dump_" + _func_suffix(c)]) for c in SCHEMA_MAP)
+    loaders = dict((c, namespace["load_" + _func_suffix(c)]) for c in SCHEMA_MAP)
+    canonicalizers = dict((c, namespace["canon_" + _func_suffix(c)]) for c in SCHEMA_MAP)
+    return dumpers, loaders, canonicalizers
+
+
+SCHEMA_CLASS_MAP = dict((v.__name__, k) for k, v in SCHEMA_MAP.items())
+_DUMPERS, _LOADERS, _CANONICALIZERS = _build_serializers()
+# View class -> metadata class it is serialized as, see register_view.
+_VIEW_CLASSES = {}
+
+
+def _dumper_of(obj_type):
+    """Find dump function by exact type, fall back to base classes once per type."""
+    dumper = _DUMPERS.get(obj_type)
+    if dumper is None:
+        for each_base in obj_type.__mro__[1:]:
+            if each_base in _DUMPERS:
+                dumper = _DUMPERS[each_base]
+                _DUMPERS[obj_type] = dumper
+                break
+    return dumper
+
+
+def register_view(view_cls, metadata_cls):
+    """Serialize objects of view_cls like those of metadata_cls.
+
+    :param view_cls: Class offering the fields of metadata_cls, without
+                     deriving from it.
+    :type view_cls: class.
+    :param metadata_cls: Metadata class.
+    :type metadata_cls: class.
+    """
+    _DUMPERS[view_cls] = _DUMPERS[metadata_cls]
+    _CANONICALIZERS[view_cls] = _CANONICALIZERS[metadata_cls]
+    _VIEW_CLASSES[view_cls] = metadata_cls
+
+
+def to_struct(metadata_obj, strict=False):
+    """Serialize a metadata object to a dict.
+
+    :param metadata_obj: Metadata object.
+    :type metadata_obj: An instance of *MetaData or DatabaseMetaDataBank.
+    :param strict: Go through the marshmallow schema instead of the
+                   generated dump function.
+    :type strict: bool.
+    :returns: dict, None if the object is not a known metadata type.
+    """
+    if strict:
+        view_of = _VIEW_CLASSES.get(type(metadata_obj))
+        if view_of is not None:
+            return SCHEMA_MAP[view_of]().dump(metadata_obj).data
+        for k, v in SCHEMA_MAP.items():
+            if isinstance(metadata_obj, k):
+                return v().dump(metadata_obj).data
+        return None
+
+    dumper = _dumper_of(type(metadata_obj))
+    return dumper(metadata_obj) if dumper is not None else None
+
+
+def to_canonical(metadata_obj):
+    """Return field values of a metadata object as a tuple, ordered by field
+    name and converted like to_struct, nested objects the same
+    way. Equal objects give equal tuples, which marshal to equal bytes.
+
+    :param metadata_obj: Metadata object.
+    :type metadata_obj: An instance of *MetaData.
+    :returns: tuple, None if the object is not a known metadata type.
+    """
+    canonicalizer = _CANONICALIZERS.get(type(metadata_obj))
+    if canonicalizer is None:
+        for each_base in type(metadata_obj).__mro__[1:]:
+            if each_base in _CANONICALIZERS:
+                canonicalizer = _CANONICALIZERS[each_base]
+                break
+        else:
+            return None
+    return canonicalizer(metadata_obj)
+
+
+def from_struct(data, cls=DatabaseMetaDataBank, strict=False):
+    """Deserialize a dict produced by to_struct.
+
+    :param data: Serialized object.
+    :type data: dict.
+    :param cls: Metadata class of the object.
+    :type cls: class.
+    :param strict: Validate data with the marshmallow schema first.
+    :type strict: bool.
+    :returns: An instance of cls.
+    :raises: ValueError if strict and data is not valid.
+    """
+    if strict:
+        result = SCHEMA_MAP[cls]().load(data)
+        if result.errors:
+            raise ValueError("Invalid {}: {}".format(cls.__name__, result.errors))
+        if result.data is None:
+            raise ValueError("Invalid {}, see the log for details.".format(cls.__name__))
+        data = result.data
+
+    obj = data if isinstance(data, cls) else _LOADERS[cls](data)
+    if cls is DatabaseMetaDataBank:
+        obj.rebuild_indexes()
+    return obj
+
+
+# Objects serialized per task of a parallel save.
+SAVE_CHUNK_SIZE = 256
+
+# (entries, text_store, db_dir) of the running parallel save. Worker
+# processes are forked after it is set and read objects from their copy,
+# so objects are never pickled to them.
+_FORK_SAVE_JOB = None
+
+
+def _dump_json_range(job_range):
+    """Serialize entries[start:end] of the parallel save job to json texts.
+
+    :param job_range: (start, end).
+    :type job_range: tuple.
+    :returns: list of json texts, None for objects failed to serialize.
+    """
+    entries, text_store, db_dir = _FORK_SAVE_JOB
+    start, end = job_range
+    json_texts = []
+    for metadata_obj, obj_dir in entries[start:end]:
+        try:
+            struct_obj = to_struct(metadata_obj)
+            if text_store is not None:
+                text_store.externalize(struct_obj, db_dir)
+            json_texts.append(json.dumps(struct_obj))
+        except:
+            logger.error(traceback.format_exc())
+            json_texts.append(None)
+    return json_texts
+
+
 class MetaDataBank(object):
     """Container holds meta data of all objects in a database."""
 
-    def __init__(self, temp_dir):
-        self._db_metadatas = DatabaseMetaDataBank()
+    def __init__(self, temp_dir, max_memory_bytes=None):
+        """
+        :param temp_dir: Temporary working directory.
+        :type temp_dir: str.
+        :param max_memory_bytes: Memory budget of tables, tables above it are
+                                 spilled to temp_dir. No budget if None.
+        :type max_memory_bytes: int.
+        """
+        if max_memory_bytes is None:
+            self._db_metadatas = DatabaseMetaDataBank()
+        else:
+            self._db_metadatas = SpillingDatabaseMetaDataBank(max_memory_bytes, temp_dir)
         self.temp_dir = temp_dir
 
 
+    def get_database_bank(self):
+        """Return container of all collected meta data.
+
+        :returns: An instance of DatabaseMetaDataBank.
+        """
+        return self._db_metadatas
+
+
     def set_database(self, db_metadata):
         """Set database to the bank.
 
@@ -540,6 +1254,23 @@ class MetaDataBank(object):
             raise TypeError("Wrong type of schema metadata, expect SchemaMetaData, Got {}".format(type(sm_metadata)))
 
 
+    def set_schema_template(self, schemaname, template_schemaname):
+        """Record that a schema has the same objects as another one, which
+           holds them for both.
+
+        :param schemaname: Name of the tenant schema.
+        :type schemaname: str.
+        :param template_schemaname: Name of the schema holding the objects.
+        :type template_schemaname: str.
+        :raises: ValueError.
+        """
+        for each_schema in self._db_metadatas.schemas:
+            if each_schema.schema_name == schemaname:
+                each_schema.schema_template = template_schemaname
+                return
+        raise ValueError("No schema named {} in the bank".format(schemaname))
+
+
     def add_table(self, tb_metadata):
         """Add table in the database to the bank.
 
@@ -549,6 +1280,7 @@ class MetaDataBank(object):
         """
         if isinstance(tb_metadata, TableMetaData):
             self._db_metadatas.tables.append(tb_metadata)
+            self._db_metadatas.index_table(tb_metadata)
         else:
             raise TypeError("Wrong type of table metadata, expect TableMetaData, Got {}".format(type(tb_metadata)))
 
@@ -562,6 +1294,7 @@ class MetaDataBank(object):
         """
         if isinstance(vw_metadata, ViewMetaData):
             self._db_metadatas.views.append(vw_metadata)
+            self._db_metadatas.index_view(vw_metadata)
         else:
             raise TypeError("Wrong type of view metadata, expect ViewMetaData, Got {}".format(type(vw_metadata)))
 
@@ -588,97 +1321,306 @@ class MetaDataBank(object):
         """
         if isinstance(ftb_metadata, FTableMetaData):
             self._db_metadatas.foreign_tables.append(ftb_metadata)
+            self._db_metadatas.index_foreign_table(ftb_metadata)
         else:
             raise TypeError("Wrong type of foreign table metadata, expect FTableMetaData, Got {}".format(type(ftb_metadata)))
 
 
-    def iter_and_save_metadata(self, des_loc, des_root_dir):
+    def iter_and_save_metadata(self, des_loc, des_root_dir, bank_dumper=None, text_store=None,
+                               archive_writer=None, compression=None, serialize_workers=1, io_workers=4,
+                               skip_unchanged=False):
         """Iter metadata objects in metabank and store them into store location.
 
         :param des_loc: Store media of the des_path.
         :type des_loc: An instance of Location.
         :param des_root_dir: Store root directory.
         :type des_root_dir: str.
+        :param bank_dumper: Function writes the bank to a binary file object,
+                            called as bank_dumper(DatabaseMetaDataBank, file).
+                            Pickle of marshmallow dump is used if None.
+        :type bank_dumper: function.
+        :param text_store: Moves large texts of metadata files into shared
+                           text files, texts stay inline if None.
+        :type text_store: An instance of TextFileStore.
+        :param archive_writer: Class of archive all metadata documents are
+                               written into, called with the archive path.
+                               One json file per object if None.
+        :type archive_writer: class, like JsonLinesArchiveWriter.
+        :param compression: Codec compressing the bank file and the archive,
+                            not compressed if None.
+        :type compression: A codec from Compression.get_codec.
+        :param serialize_workers: Number of processes serializing objects,
+                                  serialized in this process if 1.
+        :type serialize_workers: int.
+        :param io_workers: Number of threads writing json files
+                           of a parallel save.
+        :type io_workers: int.
+        :param skip_unchanged: Keep a manifest of content hashes of json
+                               files, only write files changed since the
+                               previous save and remove files of objects
+                               gone. Not used with archive_writer.
+        :type skip_unchanged: bool.
         """
         db_name = self._db_metadatas.database.get_name()
+        des_db_dir = os.path.join(des_root_dir, db_name)
         logger.debug("Use target root directory: %s" % des_root_dir)
-        logger.debug("Use temporary stage directory: %s" % self.temp_dir)
 
-        topdir = os.path.join(self.temp_dir, db_name)
-        logger.debug("Use temporary database directory: %s" % topdir)
-        if os.path.isdir(topdir):
-            shutil.rmtree(topdir)
-        os.makedirs(topdir)
+        manifest = None
+        previous = None
+        if skip_unchanged and archive_writer is None:
+            manifest_path = os.path.join(des_db_dir, MANIFEST_NAME_PATTERN.format(db_name))
+            previous = Manifest.load(des_loc, manifest_path)
+            manifest = Manifest(previous)
+
+        if previous is None:
+            # Files are written straight into the database directory of the
+            # location, staged under temp_dir only if it is remote.
+            staged_dir = des_loc.open_write_dir(des_db_dir, self.temp_dir)
+        else:
+            logger.info("Only write files changed since the previous save to %s" % des_db_dir)
+            staged_dir = des_loc.open_update_dir(des_db_dir, self.temp_dir)
+            if text_store is not None:
+                text_store.mark_saved(manifest.previous_paths(), staged_dir.path)
+        topdir = staged_dir.path
+        logger.debug("Write database directory at: %s" % topdir)
+        try:
+            self._save_all(topdir, bank_dumper, text_store, archive_writer, compression,
+                           serialize_workers, io_workers, manifest)
+        except:
+            staged_dir.abort()
+            raise
+
+        try:
+            logger.info("Finally commit %s to %s" % (topdir, des_db_dir))
+            staged_dir.commit()
+
+            if manifest is not None:
+                if previous is not None:
+                    stale_paths = manifest.stale_paths()
+                    logger.info("%d files unchanged, remove %d stale files." % (manifest.unchanged_count(),
+                                                                                len(stale_paths)))
+                    for each_path in stale_paths:
+                        des_loc.remove_file(os.path.join(des_db_dir, each_path))
+                # Written last, files it lists are all in place.
+                with des_loc.open_write(manifest_path, self.temp_dir) as wf:
+                    wf.write(manifest.dumps())
+        except:
+            logger.error(traceback.format_exc())
+
+
+    def _save_all(self, topdir, bank_dumper, text_store, archive_writer, compression,
+                  serialize_workers, io_workers, manifest=None):
+        """Write json files or the archive and the bank under topdir,
+           see iter_and_save_metadata.
+        """
+        db_name = self._db_metadatas.database.get_name()
+        if archive_writer is None:
+            archive = None
+        else:
+            archive = archive_writer(os.path.join(topdir, ARCHIVE_NAME_PATTERN.format(db_name)),
+                                     compression=compression)
+
+        entries = self._iter_save_entries(topdir, archive is None)
+        if serialize_workers > 1 and isinstance(self._db_metadatas, SpillingDatabaseMetaDataBank) \
+           and self._db_metadatas.tables_spilled():
+            # Workers need all objects in memory, save spilled tables one by one.
+            logger.info("Tables are spilled to disk, serialize them in the main process.")
+            serialize_workers = 1
+        if serialize_workers > 1:
+            entries = list(entries)
+        if serialize_workers > 1 and len(entries) > SAVE_CHUNK_SIZE:
+            logger.debug("Serialize %d objects with %d processes." % (len(entries), serialize_workers))
+            self._save_entries_parallel(entries, topdir, text_store, archive,
+                                        serialize_workers, io_workers, manifest)
+        else:
+            for metadata_obj, obj_dir in entries:
+                if archive is None:
+                    self.save_metadata_to_location(metadata_obj, obj_dir, text_store, topdir, manifest)
+                else:
+                    struct_obj = to_struct(metadata_obj)
+                    if text_store is not None:
+                        text_store.externalize(struct_obj, topdir)
+                    archive.add(self._archive_key(metadata_obj, obj_dir, topdir), struct_obj)
+
+        # Tenant schemas have no files of their own, this lists where theirs are.
+        tenants = schema_templates(self._db_metadatas)
+        if tenants:
+            tenants_name = TENANTS_NAME_PATTERN.format(db_name)
+            if archive is None:
+                self.save_json_to_location(tenants_name, json.dumps(tenants), topdir, manifest, topdir)
+            else:
+                archive.add_json(tenants_name, json.dumps(tenants))
+
+        if archive is not None:
+            archive.close()
 
+        # this meta data bank
+        this_meta_bank = os.path.join(topdir, BANK_NAME_PATTERN.format(db_name))
+        logger.debug("Save this meta data bank to %s" % this_meta_bank)
+        # Renamed into place, topdir may be the database directory itself.
+        temp_meta_bank = "{}.tmp".format(this_meta_bank)
+        with Compression.open_writer(temp_meta_bank, compression) as wf:
+            if bank_dumper is not None:
+                bank_dumper(self._db_metadatas, wf)
+            else:
+                pickle.dump(to_struct(self._db_metadatas), wf)
+        os.rename(temp_meta_bank, this_meta_bank)
+
+
+    def _iter_save_entries(self, topdir, make_dirs):
+        """Yield (metadata object, directory of its json file) of all objects,
+           in the order they are saved.
+
+        :param topdir: Database directory being written.
+        :type topdir: str.
+        :param make_dirs: Create the directory of each schema.
+        :type make_dirs: bool.
+        """
         # database its self meta data
-        self.save_metadata_to_location(des_loc, self._db_metadatas.database, topdir)
+        yield self._db_metadatas.database, topdir
 
         # tablespaces in the database.
         for each_tbs in self._db_metadatas.tablespaces:
-            self.save_metadata_to_location(des_loc, each_tbs, topdir)
+            yield each_tbs, topdir
 
         # foreign servers in the database.
         for each_fsvc in self._db_metadatas.foreign_servers:
-            self.save_metadata_to_location(des_loc, each_fsvc, topdir)
+            yield each_fsvc, topdir
 
         # schemas in the database.
         for each_schema in self._db_metadatas.schemas:
             each_schema_name = each_schema.get_name()
             each_schema_dir = os.path.join(topdir, each_schema_name)
-            os.makedirs(each_schema_dir)
+            if make_dirs and not os.path.isdir(each_schema_dir):
+                os.makedirs(each_schema_dir)
 
             # tables belong to this schema.
-            for each_table in (t for t in self._db_metadatas.tables if t.table_schemaname == each_schema_name):
-                self.save_metadata_to_location(des_loc, each_table, each_schema_dir)
+            for each_table in self._db_metadatas.tables_in_schema(each_schema_name):
+                yield each_table, each_schema_dir
 
             # views belong to this schema.
-            for each_view in (v for v in self._db_metadatas.views if v.view_schemaname == each_schema_name):
-                self.save_metadata_to_location(des_loc, each_view, each_schema_dir)
+            for each_view in self._db_metadatas.views_in_schema(each_schema_name):
+                yield each_view, each_schema_dir
 
             # foreign tables belong to this schema
-            for each_ftables in (f for f in self._db_metadatas.foreign_tables if f.foreign_schemaname == each_schema_name):
-                self.save_metadata_to_location(des_loc, each_ftables, each_schema_dir)
+            for each_ftables in self._db_metadatas.foreign_tables_in_schema(each_schema_name):
+                yield each_ftables, each_schema_dir
 
-        # this meta data bank
-        this_meta_bank = os.path.join(topdir, BANK_NAME_PATTERN.format(db_name))
-        logger.debug("Save this meta data bank to %s" % this_meta_bank)
-        with open(this_meta_bank, "wb") as wf:
-            pickle.dump(to_struct(self._db_metadatas), wf)
 
+    @staticmethod
+    def _archive_key(metadata_obj, obj_dir, topdir):
+        """Return key of an object in an archive, its path in the files layout."""
+        return os.path.relpath(os.path.join(obj_dir, metadata_obj.get_name(True)), topdir)
+
+
+    def _save_entries_parallel(self, entries, topdir, text_store, archive,
+                               serialize_workers, io_workers, manifest=None):
+        """Serialize objects in worker processes, write json files on threads.
+
+        Worker processes are forked and read objects from their copy of the
+        bank. Results come back in order, so json files and the archive get
+        the same content as a serial save.
+        """
+        global _FORK_SAVE_JOB
+
+        ranges = [(i, min(i + SAVE_CHUNK_SIZE, len(entries)))
+                  for i in xrange(0, len(entries), SAVE_CHUNK_SIZE)]
+
+        _FORK_SAVE_JOB = (entries, text_store, topdir)
+        # Fork before any thread of io_pool exists.
+        proc_pool = multiprocessing.Pool(serialize_workers)
+        io_pool = ThreadPool(io_workers) if archive is None else None
+        # Bounds chunks serialized but not written yet.
+        pending = threading.BoundedSemaphore(io_workers * 2)
         try:
-            des_db_dir = os.path.join(des_root_dir, db_name)
-            logger.info("Finally move %s to %s" % (topdir, des_db_dir))
-            des_loc.move_file_to(topdir, des_db_dir)
+            for (start, end), json_texts in izip(ranges, proc_pool.imap(_dump_json_range, ranges)):
+                chunk = [(metadata_obj, obj_dir, json_text)
+                         for (metadata_obj, obj_dir), json_text in izip(entries[start:end], json_texts)
+                         if json_text is not None]
+                if archive is not None:
+                    for metadata_obj, obj_dir, json_text in chunk:
+                        archive.add_json(self._archive_key(metadata_obj, obj_dir, topdir), json_text)
+                else:
+                    pending.acquire()
+                    io_pool.apply_async(self._save_json_chunk, (chunk, pending, manifest, topdir))
+            proc_pool.close()
+            if io_pool is not None:
+                io_pool.close()
+                io_pool.join()
         except:
-            logger.error(traceback.format_exc())
+            proc_pool.terminate()
+            if io_pool is not None:
+                io_pool.terminate()
+            raise
         finally:
-            if os.path.isdir(topdir):
-                shutil.rmtree(topdir)
+            proc_pool.join()
+            _FORK_SAVE_JOB = None
 
 
-    def save_metadata_to_location(self, des_loc, metadata_obj, des_path):
-        """Save metadata as json file, and put it to the target location.
+    def _save_json_chunk(self, chunk, pending, manifest, db_dir):
+        """Write json files of serialized objects, on an I/O thread."""
+        try:
+            for metadata_obj, obj_dir, json_text in chunk:
+                self.save_json_to_location(metadata_obj.get_name(True), json_text, obj_dir,
+                                           manifest, db_dir)
+        finally:
+            pending.release()
+
+
+    def save_metadata_to_location(self, metadata_obj, des_path, text_store=None, db_dir=None,
+                                  manifest=None):
+        """Save metadata as json file in the database directory being written.
 
-        :param des_loc: Store media of the des_path.
-        :type des_loc: An instance of Location.
         :param metadata_obj: Metadata object.
         :type metadata_obj: An instance of *MetaData.
         :param des_path: Target location for saving the json files.
         :type des_path: str.
+        :param text_store: Moves large texts out of the json file, see iter_and_save_metadata.
+        :type text_store: An instance of TextFileStore.
+        :param db_dir: Database directory holding the text files of text_store.
+        :type db_dir: str.
+        :param manifest: Records the file, see save_json_to_location.
+        :type manifest: An instance of Manifest.
         """
         objname = metadata_obj.get_name(True)
-        tempname = os.path.join(self.temp_dir, objname)
+        try:
+            struct_obj = to_struct(metadata_obj)
+            if text_store is not None:
+                text_store.externalize(struct_obj, db_dir)
+        except:
+            logger.error(traceback.format_exc())
+            return
+
+        self.save_json_to_location(objname, json.dumps(struct_obj), des_path, manifest, db_dir)
+
+
+    def save_json_to_location(self, objname, json_text, des_path, manifest=None, db_dir=None):
+        """Save json text of a metadata object as file in the database
+           directory being written.
+
+        :param objname: Name of the json file.
+        :type objname: str.
+        :param json_text: Serialized metadata object.
+        :type json_text: str.
+        :param des_path: Target location for saving the json files.
+        :type des_path: str.
+        :param manifest: Records the file, it is not written if the previous
+                         save wrote the same content.
+        :type manifest: An instance of Manifest.
+        :param db_dir: Database directory paths in manifest are relative to.
+        :type db_dir: str.
+        """
         finalname = os.path.join(des_path, objname)
+        rel_path = os.path.relpath(finalname, db_dir) if manifest is not None else None
+        if manifest is not None and not manifest.record(rel_path, json_text):
+            return
 
-        logger.debug("Save %s to %s ." % (objname, tempname))
+        logger.debug("Save %s to %s ." % (objname, finalname))
         try:
-            with open(tempname, "wb") as wf:
-                json.dump(to_struct(metadata_obj), wf)
-
-            logger.debug("Move %s to %s ." % (tempname, finalname))
-            des_loc.move_file_to(tempname, finalname)
+            with open(finalname, "wb") as wf:
+                wf.write(json_text)
         except:
             logger.error(traceback.format_exc())
-        finally:
-            if os.path.exists(tempname):
-                os.remove(tempname)
+            if manifest is not None:
+                # Not written, the manifest must not list the new content.
+                manifest.revert(rel_path)
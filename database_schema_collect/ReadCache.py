@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import simplejson as json
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+CACHE_VERSION = 1
+CACHE_INDEX_NAME = "cache.json"
+CACHE_LOCK_NAME = "cache.lock"
+DEFAULT_MAX_MB = 1024
+# Temp files older than this are left by a run that died while writing them.
+STALE_TEMP_SECONDS = 3600
+
+
+class ReadCache(object):
+    """Local copies of remote files in a directory, kept across runs.
+
+    Each entry is keyed by a string, like the remote path of the file, and
+    holds the status of the remote file it was made from. An entry is used
+    only while the remote file still has that status, a changed file makes
+    it stale. Above max_bytes, least recently used entries are removed.
+
+    Entries are listed in cache.json of the directory. Runs may share the
+    directory: each change reads cache.json again and writes it back while
+    holding a lock on cache.lock, so entries of other runs are kept. Files
+    listed by no entry are removed when the cache is opened.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        """
+        :param cache_dir: Directory of the cached files.
+        :type cache_dir: str.
+        :param max_bytes: Total size of cached files kept.
+        :type max_bytes: int.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self._entries = {}
+        with self._locked():
+            self._remove_orphans()
+
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, CACHE_INDEX_NAME)
+
+
+    @contextmanager
+    def _locked(self):
+        """Hold the cache against other threads and runs, with entries read
+           again from cache.json.
+        """
+        with self._lock:
+            lock_file = open(os.path.join(self.cache_dir, CACHE_LOCK_NAME), "ab")
+            try:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                self._entries = self._load_index()
+                yield
+            finally:
+                # Closing the file releases the lock.
+                lock_file.close()
+
+
+    def _remove_orphans(self):
+        """Remove files of entries lost by runs which died, or by versions
+           of the cache not sharing cache.json.
+        """
+        listed = set(entry["file"] for entry in self._entries.values())
+        listed.update([CACHE_INDEX_NAME, CACHE_LOCK_NAME])
+        now = time.time()
+        for each_name in os.listdir(self.cache_dir):
+            file_path = os.path.join(self.cache_dir, each_name)
+            if each_name in listed or not os.path.isfile(file_path):
+                continue
+            # Temp files are being written by other runs, unless they are old.
+            if each_name.endswith(".tmp") and now - os.path.getmtime(file_path) < STALE_TEMP_SECONDS:
+                continue
+            logger.debug("Remove %s, not in the cache." % file_path)
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), "rb") as rf:
+                doc = json.load(rf)
+        except (IOError, ValueError):
+            return {}
+        if doc.get("version") != CACHE_VERSION:
+            return {}
+        # Files removed by hand, or by another run, are gone from the cache.
+        return dict((key, entry) for key, entry in doc["entries"].items()
+                    if os.path.exists(os.path.join(self.cache_dir, entry["file"])))
+
+
+    def _save_index(self):
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        with os.fdopen(fd, "wb") as wf:
+            json.dump({"version": CACHE_VERSION, "entries": self._entries}, wf)
+        os.rename(temp_path, self._index_path())
+
+
+    def _remove_entry(self, key):
+        entry = self._entries.pop(key)
+        file_path = os.path.join(self.cache_dir, entry["file"])
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+    def get(self, key, status):
+        """Return path of the cached file of key, None if it is not cached or
+           was made from a file of another status.
+
+        :param key: Key of the entry.
+        :type key: str.
+        :param status: Status of the remote file now, see Location.file_status.
+        :type status: tuple.
+        """
+        with self._locked():
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["status"] != list(status):
+                logger.debug("Cached %s is stale." % key)
+                self._remove_entry(key)
+                self._save_index()
+                return None
+            entry["used"] = time.time()
+            self._save_index()
+            return os.path.join(self.cache_dir, entry["file"])
+
+
+    def put(self, key, status, write):
+        """Cache a file, replacing the entry of key.
+
+        :param key: Key of the entry.
+        :type key: str.
+        :param status: Status of the remote file the content is made from.
+        :type status: tuple.
+        :param write: Called with a binary file object to write the content to.
+        :type write: function.
+        :returns: Path of the cached file, None if it is larger than max_bytes.
+        """
+        file_name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as wf:
+                write(wf)
+        except:
+            os.remove(temp_path)
+            raise
+        size = os.path.getsize(temp_path)
+        if size > self.max_bytes:
+            logger.info("%s is larger than the cache, %d bytes, not cached." % (key, size))
+            os.remove(temp_path)
+            return None
+
+        with self._locked():
+            if key in self._entries:
+                self._remove_entry(key)
+            os.rename(temp_path, os.path.join(self.cache_dir, file_name))
+            self._entries[key] = {"file": file_name, "status": list(status),
+                                  "size": size, "used": time.time()}
+            self._evict(key)
+            self._save_index()
+        return os.path.join(self.cache_dir, file_name)
+
+
+    def _evict(self, keep_key):
+        total = sum(e["size"] for e in self._entries.values())
+        if total <= self.max_bytes:
+            return
+        for each_key in sorted(self._entries, key=lambda k: self._entries[k]["used"]):
+            if total <= self.max_bytes:
+                break
+            if each_key == keep_key:
+                continue
+            total -= self._entries[each_key]["size"]
+            logger.debug("Evict %s from the cache." % each_key)
+            self._remove_entry(each_key)
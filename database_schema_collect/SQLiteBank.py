@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import os
+import shutil
+import logging
+import sqlite3
+import tempfile
+
+from marshmallow import fields
+
+from database_schema_collect.MetaDataBank import SCHEMA_MAP
+from database_schema_collect.MetaDataBank import DatabaseMetaDataBank
+from database_schema_collect.MetaDataBank import SpillingDatabaseMetaDataBank
+from database_schema_collect.MetaDataBank import DatabaseMetaData
+from database_schema_collect.MetaDataBank import TablespaceMetaData
+from database_schema_collect.MetaDataBank import SchemaMetaData
+from database_schema_collect.MetaDataBank import FServerMetaData
+from database_schema_collect.MetaDataBank import TableMetaData
+from database_schema_collect.MetaDataBank import ViewMetaData
+from database_schema_collect.MetaDataBank import FTableMetaData
+from database_schema_collect.MetaDataBank import ColumnMetaData
+from database_schema_collect.MetaDataBank import PKMetaData
+from database_schema_collect.MetaDataBank import FKMetaData
+from database_schema_collect.MetaDataBank import UKMetaData
+from database_schema_collect.MetaDataBank import IndexMetaData
+from database_schema_collect.MetaDataBank import CheckMetaData
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+# A SQLite bank has one SQL table per kind of object, named after the
+# attribute holding them, with one column per field of the object:
+#
+#   database                                    one row
+#   tablespaces, schemas, foreign_servers
+#   tables                                      table_id INTEGER PRIMARY KEY
+#   views, foreign_tables
+#   columns, primary_key, foreign_keys,         table_id of their table
+#   unique_keys, indexes, checks
+#
+# Rows keep the order of the lists they come from, by rowid. Tables, views
+# and foreign tables are indexed on (schema, name), objects of tables on
+# table_id.
+MAGIC = b"SQLite format 3\x00"
+
+# SQL table -> class of its objects.
+DATABASE_TABLE = ("database", DatabaseMetaData)
+OBJECT_TABLES = (("tablespaces", TablespaceMetaData),
+                 ("schemas", SchemaMetaData),
+                 ("foreign_servers", FServerMetaData),
+                 ("tables", TableMetaData),
+                 ("views", ViewMetaData),
+                 ("foreign_tables", FTableMetaData))
+TABLE_OBJECT_TABLES = (("columns", ColumnMetaData),
+                       ("primary_key", PKMetaData),
+                       ("foreign_keys", FKMetaData),
+                       ("unique_keys", UKMetaData),
+                       ("indexes", IndexMetaData),
+                       ("checks", CheckMetaData))
+
+# SQL table -> (schema name column, object name column) of objects in schemas.
+NAMED_TABLES = {"tables": ("table_schemaname", "table_name"),
+                "views": ("view_schemaname", "view_name"),
+                "foreign_tables": ("foreign_schemaname", "foreign_tablename")}
+
+TABLE_ID = "table_id"
+
+_SQL_TYPES = {fields.Int: "INTEGER", fields.Bool: "INTEGER"}
+
+
+def _scalar_fields(cls):
+    """Return [(name, marshmallow field)] of fields of a class which are not nested."""
+    schema_fields = SCHEMA_MAP[cls]._declared_fields
+    return [(n, schema_fields.get(n)) for n in cls.field_names()
+            if not isinstance(schema_fields.get(n), fields.Nested)]
+
+
+def _quote(identifier):
+    return '"{}"'.format(identifier)
+
+
+def _create_sql(sql_table, cls, id_column=None):
+    columns = [] if id_column is None else [id_column]
+    for each_name, each_field in _scalar_fields(cls):
+        columns.append("{} {}".format(_quote(each_name), _SQL_TYPES.get(type(each_field), "TEXT")))
+    return "CREATE TABLE {} ({})".format(_quote(sql_table), ", ".join(columns))
+
+
+def _insert_sql(sql_table, cls, with_table_id=False):
+    names = [n for n, f in _scalar_fields(cls)]
+    if with_table_id:
+        names.insert(0, TABLE_ID)
+    return "INSERT INTO {} ({}) VALUES ({})".format(_quote(sql_table),
+                                                   ", ".join(_quote(n) for n in names),
+                                                   ", ".join("?" * len(names)))
+
+
+def _to_db(value):
+    # 8-bit strings are refused by sqlite3, unless they are ascii.
+    if isinstance(value, str):
+        return value.decode("utf-8")
+    return value
+
+
+def _row_values(obj, names):
+    return tuple(_to_db(getattr(obj, n, None)) for n in names)
+
+
+def is_sqlite_bank(data):
+    """Check whether the content of a bank file is a SQLite database."""
+    return data is not None and data[:len(MAGIC)] == MAGIC
+
+
+def write_bank(bank_obj, db_path):
+    """Write a bank into a new SQLite database, in one transaction.
+
+    :param bank_obj: The meta data container.
+    :type bank_obj: An instance of DatabaseMetaDataBank.
+    :param db_path: Path of the SQLite database, must not exist.
+    :type db_path: str.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        # The file is built aside and moved into place when complete.
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        with conn:
+            sql_table, cls = DATABASE_TABLE
+            conn.execute(_create_sql(sql_table, cls))
+            if bank_obj.database is not None:
+                conn.execute(_insert_sql(sql_table, cls),
+                             _row_values(bank_obj.database, [n for n, f in _scalar_fields(cls)]))
+
+            for sql_table, cls in OBJECT_TABLES:
+                id_column = "{} INTEGER PRIMARY KEY".format(TABLE_ID) if cls is TableMetaData else None
+                conn.execute(_create_sql(sql_table, cls, id_column))
+                names = [n for n, f in _scalar_fields(cls)]
+                conn.executemany(_insert_sql(sql_table, cls),
+                                 (_row_values(o, names) for o in getattr(bank_obj, sql_table)))
+
+            for sql_table, cls in TABLE_OBJECT_TABLES:
+                conn.execute(_create_sql(sql_table, cls, "{} INTEGER NOT NULL".format(TABLE_ID)))
+                names = [n for n, f in _scalar_fields(cls)]
+                # Tables are inserted in list order, their ids start at 1.
+                conn.executemany(_insert_sql(sql_table, cls, with_table_id=True),
+                                 ((table_id,) + _row_values(o, names)
+                                  for table_id, each_table in enumerate(bank_obj.tables, 1)
+                                  for o in getattr(each_table, sql_table) or ()))
+
+            # Indexes are built once, after all rows are in.
+            for sql_table, (schema_column, name_column) in sorted(NAMED_TABLES.items()):
+                conn.execute("CREATE INDEX {} ON {} ({}, {})".format(_quote("ix_{}_name".format(sql_table)),
+                                                                    _quote(sql_table),
+                                                                    _quote(schema_column), _quote(name_column)))
+            for sql_table, cls in TABLE_OBJECT_TABLES:
+                conn.execute("CREATE INDEX {} ON {} ({})".format(_quote("ix_{}_table".format(sql_table)),
+                                                                _quote(sql_table), TABLE_ID))
+    finally:
+        conn.close()
+
+
+def dump_bank(bank_obj, wf, temp_dir=None):
+    """Write a bank as a SQLite database to a file object, bank dumper of
+       MetaDataBank.iter_and_save_metadata.
+
+    :param bank_obj: The meta data container.
+    :type bank_obj: An instance of DatabaseMetaDataBank.
+    :param wf: A file object opened for binary writing.
+    :type wf: file.
+    :param temp_dir: Directory to build the database in, system default if None.
+    :type temp_dir: str.
+    """
+    build_dir = tempfile.mkdtemp(dir=temp_dir)
+    try:
+        db_path = os.path.join(build_dir, "bank.sqlite")
+        write_bank(bank_obj, db_path)
+        with open(db_path, "rb") as rf:
+            shutil.copyfileobj(rf, wf, 1024 * 1024)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def _selection(sql_table, schemas, tables):
+    """Return (where clause, params) selecting objects of schemas and
+       objects named in tables, as "schemaname.objectname"."""
+    schema_column, name_column = NAMED_TABLES[sql_table]
+    conditions = []
+    params = []
+    if schemas:
+        conditions.append("{} IN ({})".format(_quote(schema_column), ", ".join("?" * len(schemas))))
+        params.extend(schemas)
+    for each_name in tables or ():
+        schemaname, sep, objectname = each_name.partition(".")
+        if not sep:
+            raise ValueError("Table names must be schemaname.tablename, got {}".format(each_name))
+        conditions.append("({} = ? AND {} = ?)".format(_quote(schema_column), _quote(name_column)))
+        params.extend([schemaname, objectname])
+    if not conditions:
+        return "", []
+    return " WHERE " + " OR ".join(conditions), params
+
+
+class SQLiteBank(object):
+    """Bank stored in a SQLite database, loaded in whole or in part."""
+
+    def __init__(self, db_path):
+        """
+        :param db_path: Path of the SQLite database.
+        :type db_path: str.
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+
+
+    def close(self):
+        self.conn.close()
+
+
+    def query(self, sql_str, params=()):
+        """Run a query on the bank and yield its rows one by one.
+
+        :param sql_str: SQL statement, with ? placeholders.
+        :type sql_str: str.
+        :param params: Values of placeholders.
+        :type params: tuple.
+        :returns: Generator of sqlite3.Row, readable by index or column name.
+        """
+        return self._iter_rows(sql_str, params, sqlite3.Row)
+
+
+    def _iter_rows(self, sql_str, params=(), row_factory=None):
+        cursor = self.conn.cursor()
+        cursor.row_factory = row_factory
+        cursor.execute(sql_str, params)
+        try:
+            for each_row in cursor:
+                yield each_row
+        finally:
+            cursor.close()
+
+
+    def _load_objects(self, sql_table, cls, where="", params=(), with_table_id=False):
+        """Return objects of a SQL table, as (table_id, object) with_table_id."""
+        return list(self._iter_objects(sql_table, cls, where, params, with_table_id))
+
+
+    def _iter_objects(self, sql_table, cls, where="", params=(), with_table_id=False):
+        scalar_fields = _scalar_fields(cls)
+        names = [n for n, f in scalar_fields]
+        bools = [isinstance(f, fields.Bool) for n, f in scalar_fields]
+        nested_names = [n for n in cls.field_names() if n not in names]
+        columns = ([TABLE_ID] if with_table_id else []) + names
+        first = 1 if with_table_id else 0
+
+        for each_row in self._iter_rows("SELECT {} FROM {}{} ORDER BY rowid".format(", ".join(_quote(c) for c in columns),
+                                                                                  _quote(sql_table), where),
+                                        params):
+            obj = cls.__new__(cls)
+            for each_name, is_bool, value in zip(names, bools, each_row[first:]):
+                setattr(obj, each_name, bool(value) if is_bool and value is not None else value)
+            for each_name in nested_names:
+                setattr(obj, each_name, [])
+            yield (each_row[0], obj) if with_table_id else obj
+
+
+    def load(self, schemas=None, tables=None, max_memory_bytes=None, spill_dir=None):
+        """Load the bank, or only some of its objects.
+
+        Tablespaces, foreign servers and the database object are always
+        loaded. With schemas or tables, only tables, views and foreign
+        tables of these schemas, and those named in tables are loaded.
+        Tables are read one by one with their columns, keys and indexes.
+
+        :param schemas: Names of schemas to load.
+        :type schemas: list.
+        :param tables: Names of tables, views or foreign tables to load, as
+                       schemaname.objectname.
+        :type tables: list.
+        :param max_memory_bytes: Memory budget of tables, tables above it are
+                                 spilled to spill_dir. No budget if None.
+        :type max_memory_bytes: int.
+        :param spill_dir: Directory of the spill file, system default if None.
+        :type spill_dir: str.
+        :returns: An instance of DatabaseMetaDataBank.
+        :raises: ValueError.
+        """
+        if max_memory_bytes is None:
+            bank_obj = DatabaseMetaDataBank()
+        else:
+            bank_obj = SpillingDatabaseMetaDataBank(max_memory_bytes, spill_dir)
+        databases = self._load_objects(*DATABASE_TABLE)
+        bank_obj.database = databases[0] if databases else None
+        bank_obj.tablespaces = self._load_objects("tablespaces", TablespaceMetaData)
+        bank_obj.foreign_servers = self._load_objects("foreign_servers", FServerMetaData)
+        all_schemas = self._load_objects("schemas", SchemaMetaData)
+
+        # Objects of tenant schemas are those of their template schema.
+        templates = dict((s.schema_name, s.schema_template) for s in all_schemas
+                         if s.schema_template is not None)
+        requested_tenants = set(s for s in schemas or () if s in templates)
+        if templates and schemas:
+            schemas = [templates.get(s, s) for s in schemas]
+        if templates and tables:
+            source_tables = []
+            for each_name in tables:
+                schemaname, sep, objectname = each_name.partition(".")
+                if sep and schemaname in templates:
+                    requested_tenants.add(schemaname)
+                    each_name = "{}.{}".format(templates[schemaname], objectname)
+                source_tables.append(each_name)
+            tables = source_tables
+
+        for sql_table, cls in (("views", ViewMetaData), ("foreign_tables", FTableMetaData)):
+            setattr(bank_obj, sql_table, self._load_objects(sql_table, cls, *_selection(sql_table, schemas, tables)))
+
+        loaded_schemas = set(schemas or ())
+        where, params = _selection("tables", schemas, tables)
+        child_where = "" if not where else \
+            " WHERE {} IN (SELECT {} FROM {}{})".format(TABLE_ID, TABLE_ID, _quote("tables"), where)
+        # Objects of tables come in the order of their tables, merge them
+        # into each table as it is read: [SQL table, objects, next object].
+        child_streams = []
+        for sql_table, cls in TABLE_OBJECT_TABLES:
+            stream = self._iter_objects(sql_table, cls, child_where, params, with_table_id=True)
+            child_streams.append([sql_table, stream, next(stream, None)])
+        for table_id, each_table in self._iter_objects("tables", TableMetaData, where, params, with_table_id=True):
+            for each_stream in child_streams:
+                sql_table, stream, pending = each_stream
+                objs = getattr(each_table, sql_table)
+                while pending is not None and pending[0] == table_id:
+                    objs.append(pending[1])
+                    pending = next(stream, None)
+                each_stream[2] = pending
+            bank_obj.tables.append(each_table)
+            bank_obj.index_table(each_table)
+            loaded_schemas.add(each_table.table_schemaname)
+
+        for each_obj in bank_obj.views:
+            loaded_schemas.add(each_obj.view_schemaname)
+        for each_obj in bank_obj.foreign_tables:
+            loaded_schemas.add(each_obj.foreign_schemaname)
+        loaded_schemas.update(s for s in requested_tenants if templates[s] in loaded_schemas)
+        bank_obj.schemas = [s for s in all_schemas
+                            if (not schemas and not tables) or s.schema_name in loaded_schemas]
+
+        for each_view in bank_obj.views:
+            bank_obj.index_view(each_view)
+        for each_ftable in bank_obj.foreign_tables:
+            bank_obj.index_foreign_table(each_ftable)
+        return bank_obj
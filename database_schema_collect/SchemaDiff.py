@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import marshal
+import hashlib
+import logging
+
+import simplejson as json
+
+from database_schema_collect.MetaDataBank import to_struct
+from database_schema_collect.MetaDataBank import to_canonical
+from database_schema_collect.SnapshotStore import TABLE_LISTS
+from database_schema_collect import Compression
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+DIGEST_VERSION = 1
+
+# Group of objects which do not belong to a schema: the database itself,
+# tablespaces and foreign servers.
+DATABASE_GROUP = ""
+
+# Kinds of objects which are compared field by field, with lists of items
+# compared item by item.
+_NESTED_LISTS = {"table": TABLE_LISTS}
+
+
+def object_hash(metadata_obj):
+    """Return structural hash of a metadata object, hex sha1 of its canonical form."""
+    return hashlib.sha1(marshal.dumps(to_canonical(metadata_obj), 2)).hexdigest()
+
+
+def _object_key(kind, name):
+    return "{}:{}".format(kind, name)
+
+
+def _split_key(key):
+    return key.split(":", 1)
+
+
+def _rollup(object_hashes):
+    """Return hash of a group, over the sorted keys and hashes of its objects."""
+    digest = hashlib.sha1()
+    for k in sorted(object_hashes):
+        digest.update(k.encode("utf-8") if isinstance(k, unicode) else k)
+        digest.update(b"\x00")
+        digest.update(object_hashes[k])
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def _iter_grouped_objects(bank_obj):
+    """Yield (group, kind, name, object) of all objects of a bank."""
+    if bank_obj.database is not None:
+        yield DATABASE_GROUP, "database", bank_obj.database.database_name, bank_obj.database
+    for each_tbs in bank_obj.tablespaces:
+        yield DATABASE_GROUP, "tablespace", each_tbs.tablespace_name, each_tbs
+    for each_fsvr in bank_obj.foreign_servers:
+        yield DATABASE_GROUP, "foreign_server", each_fsvr.foreign_servername, each_fsvr
+    for each_schema in bank_obj.schemas:
+        yield each_schema.schema_name, "schema", each_schema.schema_name, each_schema
+    for each_table in bank_obj.tables:
+        yield each_table.table_schemaname, "table", each_table.table_name, each_table
+    for each_view in bank_obj.views:
+        yield each_view.view_schemaname, "view", each_view.view_name, each_view
+    for each_ftable in bank_obj.foreign_tables:
+        yield each_ftable.foreign_schemaname, "foreign_table", each_ftable.foreign_tablename, each_ftable
+
+
+class BankDigest(object):
+    """Structural hashes of all objects of a bank, grouped by schema, with
+    one rolled up hash per group.
+
+    Two groups with the same rolled up hash hold the same objects, they are
+    not compared further.
+    """
+
+    def __init__(self, groups, bank_status=None):
+        """
+        :param groups: {group: {"hash": rolled up hash, "objects": {"kind:name": hash}}}.
+        :type groups: dict.
+        :param bank_status: Status of the bank file the hashes are computed
+                            from, see Location.file_status.
+        :type bank_status: list.
+        """
+        self.groups = groups
+        self.bank_status = bank_status
+
+
+    @classmethod
+    def compute(cls, bank_obj, bank_status=None):
+        """Hash all objects of a bank.
+
+        :param bank_obj: The meta data container.
+        :type bank_obj: An instance of DatabaseMetaDataBank or BankFormat.LazyBank.
+        :param bank_status: Status of the saved bank file of bank_obj.
+        :type bank_status: tuple.
+        :returns: An instance of BankDigest.
+        """
+        objects = {}
+        for group, kind, name, metadata_obj in _iter_grouped_objects(bank_obj):
+            objects.setdefault(group, {})[_object_key(kind, name)] = object_hash(metadata_obj)
+        return cls(dict((g, {"hash": _rollup(o), "objects": o}) for g, o in objects.iteritems()),
+                   None if bank_status is None else list(bank_status))
+
+
+    def matches(self, bank_status):
+        """Whether the hashes are computed from a bank file of this status,
+           a digest of an older bank is stale.
+
+        :param bank_status: Status of the bank file now, see Location.file_status.
+        :type bank_status: tuple.
+        """
+        return bank_status is not None and self.bank_status == list(bank_status)
+
+
+    @classmethod
+    def loads(cls, content):
+        """Read a digest written by dumps.
+
+        :param content: Content of a digest file, decompressed.
+        :type content: str.
+        :returns: An instance of BankDigest.
+        :raises: ValueError.
+        """
+        doc = json.loads(content)
+        if doc.get("format_version") != DIGEST_VERSION:
+            raise ValueError("Unsupported digest version {}".format(doc.get("format_version")))
+        return cls(doc["groups"], doc.get("bank_status"))
+
+
+    def dumps(self):
+        """Return content of a digest file, gzip compressed."""
+        return Compression.GzipCodec().compress(json.dumps({"format_version": DIGEST_VERSION,
+                                                            "groups": self.groups,
+                                                            "bank_status": self.bank_status},
+                                                           sort_keys=True))
+
+
+def _find_object(bank_obj, group, kind, name):
+    """Return an object of a bank by its group, kind and name."""
+    if kind in ("table", "view", "foreign_table"):
+        return bank_obj.get_object(group, name)
+    if kind == "database":
+        return bank_obj.database
+    candidates = {"tablespace": (bank_obj.tablespaces, "tablespace_name"),
+                  "foreign_server": (bank_obj.foreign_servers, "foreign_servername"),
+                  "schema": (bank_obj.schemas, "schema_name")}
+    objs, name_field = candidates[kind]
+    for each_obj in objs:
+        if getattr(each_obj, name_field) == name:
+            return each_obj
+    return None
+
+
+def _field_changes(old_item, new_item, skip=()):
+    return dict((k, [old_item.get(k), v]) for k, v in new_item.iteritems()
+                if k not in skip and old_item.get(k) != v)
+
+
+def _item_key(item, key_fields):
+    return tuple(item.get(k) for k in key_fields)
+
+
+def _list_changes(old_items, new_items, key_fields):
+    """Return {"added": [key], "removed": [key], "changed": [[key, field changes]]}
+    of two lists of serialized items, only keys which are not empty.
+    """
+    old_keyed = dict((_item_key(i, key_fields), i) for i in old_items)
+    new_keyed = dict((_item_key(i, key_fields), i) for i in new_items)
+    changes = {}
+    added = [list(k) for k in (_item_key(i, key_fields) for i in new_items) if k not in old_keyed]
+    removed = [list(k) for k in (_item_key(i, key_fields) for i in old_items) if k not in new_keyed]
+    changed = []
+    for each_item in new_items:
+        key = _item_key(each_item, key_fields)
+        if key in old_keyed:
+            fields_changed = _field_changes(old_keyed[key], each_item)
+            if fields_changed:
+                changed.append([list(key), fields_changed])
+    if added:
+        changes["added"] = added
+    if removed:
+        changes["removed"] = removed
+    if changed:
+        changes["changed"] = changed
+    return changes
+
+
+def _object_changes(kind, old_obj, new_obj):
+    """Return field changes of an object, and changes of its lists for tables."""
+    old_struct = to_struct(old_obj)
+    new_struct = to_struct(new_obj)
+    nested_lists = _NESTED_LISTS.get(kind, {})
+    details = {}
+    fields_changed = _field_changes(old_struct, new_struct, skip=nested_lists)
+    if fields_changed:
+        details["fields"] = fields_changed
+    for each_list, key_fields in sorted(nested_lists.items()):
+        list_changes = _list_changes(old_struct.get(each_list) or [], new_struct.get(each_list) or [],
+                                     key_fields)
+        if list_changes:
+            details[each_list] = list_changes
+    return details
+
+
+def diff_banks(base_bank, target_bank, base_digest=None, target_digest=None):
+    """Compare two banks.
+
+    Groups are compared by their rolled up hashes first, objects by their
+    hashes next. Only objects with different hashes are loaded and compared
+    down to columns, constraints and indexes.
+
+    :param base_bank: The bank compared against.
+    :type base_bank: An instance of DatabaseMetaDataBank or BankFormat.LazyBank.
+    :param target_bank: The bank compared.
+    :type target_bank: An instance of DatabaseMetaDataBank or BankFormat.LazyBank.
+    :param base_digest: Digest of base_bank, computed if None.
+    :type base_digest: An instance of BankDigest.
+    :param target_digest: Digest of target_bank, computed if None.
+    :type target_digest: An instance of BankDigest.
+    :returns: Report as dict, see format_report.
+    """
+    if base_digest is None:
+        base_digest = BankDigest.compute(base_bank)
+    if target_digest is None:
+        target_digest = BankDigest.compute(target_bank)
+
+    summary = {"groups": 0, "unchanged_groups": 0, "added": 0, "removed": 0, "changed": 0}
+    changes = []
+    all_groups = set(base_digest.groups) | set(target_digest.groups)
+    for each_group in sorted(all_groups):
+        summary["groups"] += 1
+        base_group = base_digest.groups.get(each_group)
+        target_group = target_digest.groups.get(each_group)
+        if base_group is not None and target_group is not None and \
+           base_group["hash"] == target_group["hash"]:
+            summary["unchanged_groups"] += 1
+            continue
+
+        base_objects = base_group["objects"] if base_group is not None else {}
+        target_objects = target_group["objects"] if target_group is not None else {}
+        for each_key in sorted(set(base_objects) | set(target_objects)):
+            base_hash = base_objects.get(each_key)
+            target_hash = target_objects.get(each_key)
+            if base_hash == target_hash:
+                continue
+            kind, name = _split_key(each_key)
+            entry = {"group": each_group, "kind": kind, "name": name}
+            if base_hash is None:
+                entry["change"] = "added"
+            elif target_hash is None:
+                entry["change"] = "removed"
+            else:
+                entry["change"] = "changed"
+                entry["details"] = _object_changes(kind,
+                                                   _find_object(base_bank, each_group, kind, name),
+                                                   _find_object(target_bank, each_group, kind, name))
+            summary[entry["change"]] += 1
+            changes.append(entry)
+
+    return {"summary": summary, "changes": changes}
+
+
+def _format_value(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _format_key(key):
+    return "/".join(u"{}".format(k) for k in key)
+
+
+def format_report(report, base_label, target_label):
+    """Return a diff report as text for people.
+
+    :param report: Output of diff_banks.
+    :type report: dict.
+    :param base_label: Name of the base bank.
+    :type base_label: str.
+    :param target_label: Name of the target bank.
+    :type target_label: str.
+    :returns: unicode.
+    """
+    summary = report["summary"]
+    lines = [u"Diff of {} -> {}".format(base_label, target_label),
+             u"{} groups compared, {} unchanged. {} added, {} removed, {} changed objects.".format(
+                 summary["groups"], summary["unchanged_groups"],
+                 summary["added"], summary["removed"], summary["changed"]),
+             u""]
+    marks = {"added": u"+", "removed": u"-", "changed": u"~"}
+    for each_entry in report["changes"]:
+        group = each_entry["group"]
+        full_name = each_entry["name"] if group == DATABASE_GROUP or each_entry["kind"] == "schema" \
+            else u"{}.{}".format(group, each_entry["name"])
+        lines.append(u"{} {} {}".format(marks[each_entry["change"]], each_entry["kind"], full_name))
+        details = each_entry.get("details", {})
+        for k, (old_v, new_v) in sorted(details.get("fields", {}).items()):
+            lines.append(u"    {}: {} -> {}".format(k, _format_value(old_v), _format_value(new_v)))
+        for each_list in sorted(k for k in details if k != "fields"):
+            list_changes = details[each_list]
+            for each_key in list_changes.get("added", []):
+                lines.append(u"    + {} {}".format(each_list, _format_key(each_key)))
+            for each_key in list_changes.get("removed", []):
+                lines.append(u"    - {} {}".format(each_list, _format_key(each_key)))
+            for each_key, fields_changed in list_changes.get("changed", []):
+                lines.append(u"    ~ {} {}: {}".format(each_list, _format_key(each_key),
+                                                        u", ".join(u"{} {} -> {}".format(k, _format_value(o), _format_value(n))
+                                                                   for k, (o, n) in sorted(fields_changed.items()))))
+    return u"\n".join(lines) + u"\n"
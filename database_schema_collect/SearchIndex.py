@@ -0,0 +1,560 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import re
+import shlex
+import struct
+import marshal
+import logging
+from bisect import bisect_left
+from array import array
+from collections import namedtuple
+from cStringIO import StringIO
+
+from database_schema_collect.util import format_pg_type
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+# Layout of a search index file:
+#
+#   header      MAGIC | version u16 | flags u16 | section count u32
+#   directory   section count * (tag 4s | offset u64 | length u64)
+#   sections    META: marshal of {"kinds": {kind: (first doc, end doc)},
+#                                 "fields": {field: (first value, end value)},
+#                                 "bank_status": status of the bank file}.
+#               STRS: u32 count | count * u32 end offsets | utf-8 bytes of
+#                     all distinct strings.
+#               DOCS: one entry per searchable object, sorted by kind,
+#                     6 * u32 string ids: kind, schema, table, name, type,
+#                     comment. NO_STRING for missing ones.
+#               VALS: u32 count | count * (field u32 | string id u32),
+#                     sorted by field | postings, doc ids of each value.
+#               WORD: words of values, lower cased | postings, value ids.
+#               TGRM: trigrams of values, lower cased | postings, value ids.
+#
+# Postings are u32 count | count * u32 end offsets (in items) | u32 items.
+# Terms of WORD and TGRM are stored like STRS, sorted by their utf-8 bytes,
+# followed by their postings.
+#
+# Searches look up words and trigrams of the distinct values, check the
+# few candidate values, and only then map them to objects, so a query reads
+# a few postings and never the metadata of the whole database.
+MAGIC = b"DSCSRCH\x00"
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<8sHHI")
+_SECTION = struct.Struct("<4sQQ")
+_U32 = struct.Struct("<I")
+_DOC = struct.Struct("<6I")
+
+SECTION_META = b"META"
+SECTION_STRINGS = b"STRS"
+SECTION_DOCS = b"DOCS"
+SECTION_VALUES = b"VALS"
+SECTION_WORDS = b"WORD"
+SECTION_TRIGRAMS = b"TGRM"
+
+NO_STRING = 0xFFFFFFFF
+
+# Kinds of searchable objects, in the order of their documents.
+KINDS = ("table", "view", "foreign_table", "column", "index", "constraint")
+
+# Searchable fields of a document, in the order of their values.
+FIELDS = ("name", "type", "comment")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Wildcards of a query term, any run of characters.
+_WILDCARD_RE = re.compile(r"[%*]")
+
+# Stop intersecting postings when the candidates are this many times fewer
+# than the items of the next postings, checking them is cheaper.
+_VERIFY_RATIO = 16
+
+SearchHit = namedtuple("SearchHit", ["kind", "schema", "table", "name", "type", "comment"])
+
+
+def _words(value):
+    return _WORD_RE.findall(value.lower())
+
+
+def _trigrams(value):
+    value = value.lower()
+    return set(value[i:i + 3] for i in xrange(len(value) - 2))
+
+
+def _to_unicode(value):
+    return value if isinstance(value, unicode) else str(value).decode("utf-8")
+
+
+def _constraint_docs(constraints, name_field, constraint_type):
+    """Yield (name, type) of constraints, keys hold one entry per column."""
+    seen = set()
+    for each_constraint in constraints or []:
+        name = getattr(each_constraint, name_field, None)
+        if name is not None and name not in seen:
+            seen.add(name)
+            yield name, constraint_type
+
+
+def _iter_documents(bank_obj):
+    """Yield (kind, schema, table, name, type, comment) of searchable objects,
+       grouped by kind in the order of KINDS."""
+    for each_table in bank_obj.tables:
+        yield ("table", each_table.table_schemaname, None, each_table.table_name,
+               "table", each_table.table_comment)
+    for each_view in bank_obj.views:
+        yield ("view", each_view.view_schemaname, None, each_view.view_name,
+               "view", each_view.view_comment)
+    for each_ftable in bank_obj.foreign_tables:
+        yield ("foreign_table", each_ftable.foreign_schemaname, None, each_ftable.foreign_tablename,
+               "foreign table", None)
+
+    # Columns, indexes and constraints are read in one pass over tables.
+    indexes = []
+    constraints = []
+    for each_table in bank_obj.tables:
+        schemaname = each_table.table_schemaname
+        tablename = each_table.table_name
+        for each_column in each_table.columns:
+            yield ("column", schemaname, tablename, each_column.column_name,
+                   format_pg_type(each_column.column_data_type, each_column.column_length,
+                                  each_column.column_precision, each_column.column_scale),
+                   each_column.column_comment)
+        for each_index in each_table.indexes or []:
+            indexes.append(("index", schemaname, tablename, each_index.index_name,
+                            each_index.index_type, None))
+        for name_field, constraint_type, attr_name in (("pk_name", "primary key", "primary_key"),
+                                                      ("uk_name", "unique", "unique_keys"),
+                                                      ("fk_name", "foreign key", "foreign_keys"),
+                                                      ("check_name", "check", "checks")):
+            for name, type_name in _constraint_docs(getattr(each_table, attr_name), name_field, constraint_type):
+                constraints.append(("constraint", schemaname, tablename, name, type_name, None))
+    for each_doc in indexes:
+        yield each_doc
+    for each_doc in constraints:
+        yield each_doc
+
+
+def _pack_u32(values):
+    packed = array('I', values)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tostring()
+
+
+def _read_u32(data, offset, count):
+    values = array('I')
+    values.fromstring(data[offset:offset + values.itemsize * count])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _pack_strings(values):
+    encoded = [v.encode("utf-8") for v in values]
+    ends = []
+    end = 0
+    for each_value in encoded:
+        end += len(each_value)
+        ends.append(end)
+    return b"".join([_U32.pack(len(encoded)), _pack_u32(ends)] + encoded)
+
+
+def _pack_postings(postings):
+    ends = []
+    end = 0
+    for each_items in postings:
+        end += len(each_items)
+        ends.append(end)
+    return b"".join([_U32.pack(len(postings)), _pack_u32(ends)] + [_pack_u32(p) for p in postings])
+
+
+def _pack_terms(term_postings):
+    terms = sorted((t.encode("utf-8"), p) for t, p in term_postings.iteritems())
+    return _pack_strings([t.decode("utf-8") for t, p in terms]) + _pack_postings([p for t, p in terms])
+
+
+class _StringTable(object):
+    """Packed strings, sorted ones can be searched with bisect."""
+
+    def __init__(self, data, offset):
+        count, = _U32.unpack_from(data, offset)
+        self._ends = _read_u32(data, offset + _U32.size, count)
+        self._data = data
+        self._base = offset + _U32.size * (count + 1)
+        self.size = self._base - offset + (self._ends[-1] if count else 0)
+        self._cache = {}
+
+
+    def __len__(self):
+        return len(self._ends)
+
+
+    def __getitem__(self, string_id):
+        """Return a string as utf-8 bytes."""
+        start = self._ends[string_id - 1] if string_id > 0 else 0
+        return self._data[self._base + start:self._base + self._ends[string_id]]
+
+
+    def text(self, string_id):
+        """Return a string as unicode, decoded once."""
+        value = self._cache.get(string_id)
+        if value is None and string_id != NO_STRING:
+            value = self[string_id].decode("utf-8")
+            self._cache[string_id] = value
+        return value
+
+
+class _Postings(object):
+    """Postings stored one after another."""
+
+    def __init__(self, data, offset):
+        count, = _U32.unpack_from(data, offset)
+        self._ends = _read_u32(data, offset + _U32.size, count)
+        self._data = data
+        self._base = offset + _U32.size * (count + 1)
+
+
+    def length(self, entry_id):
+        return self._ends[entry_id] - (self._ends[entry_id - 1] if entry_id > 0 else 0)
+
+
+    def __getitem__(self, entry_id):
+        start = self._ends[entry_id - 1] if entry_id > 0 else 0
+        return _read_u32(self._data, self._base + _U32.size * start, self._ends[entry_id] - start)
+
+
+class _TermTable(object):
+    """Sorted terms with the postings of each one."""
+
+    def __init__(self, data, offset):
+        self._terms = _StringTable(data, offset)
+        self._postings = _Postings(data, offset + self._terms.size)
+
+
+    def find(self, term):
+        """Return id of a term, None if it is not indexed."""
+        key = term.encode("utf-8")
+        term_id = bisect_left(self._terms, key)
+        if term_id < len(self._terms) and self._terms[term_id] == key:
+            return term_id
+        return None
+
+
+    def length(self, term_id):
+        return self._postings.length(term_id)
+
+
+    def postings(self, term_id):
+        return self._postings[term_id]
+
+
+def dump_index(bank_obj, wf, bank_status=None):
+    """Write the search index of a bank.
+
+    :param bank_obj: The meta data container.
+    :type bank_obj: An instance of DatabaseMetaDataBank or BankFormat.LazyBank.
+    :param wf: A file object opened for binary writing.
+    :type wf: file.
+    :param bank_status: Status of the saved bank file of bank_obj, see
+                        Location.file_status.
+    :type bank_status: tuple.
+    """
+    strings = []
+    string_ids = {}
+
+    def encode(value):
+        if value is None:
+            return NO_STRING
+        # Ascii str and unicode of the same text are equal keys.
+        string_id = string_ids.get(value)
+        if string_id is None:
+            value = _to_unicode(value)
+            string_id = string_ids.get(value)
+            if string_id is None:
+                string_id = len(strings)
+                strings.append(value)
+                string_ids[value] = string_id
+        return string_id
+
+    docs = array('I')
+    # string id -> doc ids, one dict per field.
+    value_docs = [{} for f in FIELDS]
+    kind_ranges = {}
+    kind = None
+    doc_id = 0
+    for each_doc in _iter_documents(bank_obj):
+        if each_doc[0] != kind:
+            kind = each_doc[0]
+            kind_ranges[kind] = (doc_id, doc_id)
+        doc_ids = [encode(v) for v in each_doc]
+        docs.extend(doc_ids)
+        for field_docs, string_id in zip(value_docs, doc_ids[3:]):
+            if string_id != NO_STRING:
+                field_docs.setdefault(string_id, []).append(doc_id)
+        doc_id += 1
+        kind_ranges[kind] = (kind_ranges[kind][0], doc_id)
+
+    values = []
+    field_ranges = {}
+    for field_name, field_docs in zip(FIELDS, value_docs):
+        field_ranges[field_name] = (len(values), len(values) + len(field_docs))
+        values.extend((FIELDS.index(field_name), i) for i in sorted(field_docs, key=strings.__getitem__))
+
+    words = {}
+    trigrams = {}
+    for value_id, (field_no, string_id) in enumerate(values):
+        for each_word in set(_words(strings[string_id])):
+            words.setdefault(each_word, []).append(value_id)
+        for each_trigram in _trigrams(strings[string_id]):
+            trigrams.setdefault(each_trigram, []).append(value_id)
+
+    logger.debug("Index %d objects, %d distinct values, %d words, %d trigrams." %
+                 (doc_id, len(values), len(words), len(trigrams)))
+
+    if sys.byteorder == "big":
+        docs.byteswap()
+    meta = {"kinds": kind_ranges, "fields": field_ranges,
+            "bank_status": None if bank_status is None else list(bank_status)}
+    sections = [(SECTION_META, marshal.dumps(meta, 2)),
+                (SECTION_STRINGS, _pack_strings(strings)),
+                (SECTION_DOCS, docs.tostring()),
+                (SECTION_VALUES, b"".join([_U32.pack(len(values)),
+                                           _pack_u32(n for v in values for n in v),
+                                           _pack_postings([value_docs[f][i] for f, i in values])])),
+                (SECTION_WORDS, _pack_terms(words)),
+                (SECTION_TRIGRAMS, _pack_terms(trigrams))]
+
+    offset = _HEADER.size + _SECTION.size * len(sections)
+    wf.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(sections)))
+    for tag, body in sections:
+        wf.write(_SECTION.pack(tag, offset, len(body)))
+        offset += len(body)
+    for tag, body in sections:
+        wf.write(body)
+
+
+def _like_regex(pattern):
+    pieces = _WILDCARD_RE.split(pattern)
+    return re.compile(u"^{}$".format(u".*".join(re.escape(p) for p in pieces)),
+                      re.IGNORECASE | re.UNICODE | re.DOTALL)
+
+
+def _contains_phrase(words, phrase):
+    size = len(phrase)
+    for i in xrange(len(words) - size + 1):
+        if words[i:i + size] == phrase:
+            return True
+    return False
+
+
+def parse_query(query):
+    """Split a query into terms.
+
+    Terms are separated by spaces, quote them to keep spaces. A term is
+    [field:]text, field is one of FIELDS or kind, all fields are searched
+    if it is omitted. Text with % or * is matched as a pattern against the
+    whole value, case insensitive, other text matches values containing
+    its words in this order: comment:pii, type:"numeric(38,10)",
+    name:%customer_id%, kind:column.
+
+    :param query: The query.
+    :type query: str or unicode.
+    :returns: List of (field or None, text).
+    :raises: ValueError.
+    """
+    terms = []
+    for each_term in shlex.split(_to_unicode(query).encode("utf-8")):
+        each_term = each_term.decode("utf-8")
+        field, sep, text = each_term.partition(u":")
+        if sep and field.lower() in FIELDS + ("kind",):
+            terms.append((str(field.lower()), text))
+        else:
+            terms.append((None, each_term))
+    if not terms:
+        raise ValueError("Empty search query.")
+    for field, text in terms:
+        if field == "kind" and text.lower() not in KINDS:
+            raise ValueError("Valid kinds are: {}, got {}".format("|".join(KINDS), text))
+    return terms
+
+
+class SearchIndex(object):
+    """Search index over the content of a search index file."""
+
+    def __init__(self, data):
+        """
+        :param data: Content of a search index file.
+        :type data: str, buffer or mmap.
+        :raises: ValueError.
+        """
+        magic, version, flags, section_count = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a search index file.")
+        if version > FORMAT_VERSION:
+            raise ValueError("Unsupported search index format version {}, newest supported is {}".format(version, FORMAT_VERSION))
+
+        sections = {}
+        pos = _HEADER.size
+        for i in xrange(section_count):
+            tag, offset, length = _SECTION.unpack_from(data, pos)
+            sections[tag] = (offset, length)
+            pos += _SECTION.size
+
+        self._data = data
+        meta_offset, meta_length = sections[SECTION_META]
+        meta = marshal.loads(data[meta_offset:meta_offset + meta_length])
+        self._kind_ranges = meta["kinds"]
+        self._field_ranges = meta["fields"]
+        self.bank_status = meta.get("bank_status")
+        self._strings = _StringTable(data, sections[SECTION_STRINGS][0])
+        self._docs_offset = sections[SECTION_DOCS][0]
+        self.doc_count = sections[SECTION_DOCS][1] // _DOC.size
+
+        values_offset = sections[SECTION_VALUES][0]
+        value_count, = _U32.unpack_from(data, values_offset)
+        self._values = _read_u32(data, values_offset + _U32.size, value_count * 2)
+        self._value_docs = _Postings(data, values_offset + _U32.size * (1 + value_count * 2))
+        self._words = _TermTable(data, sections[SECTION_WORDS][0])
+        self._trigrams = _TermTable(data, sections[SECTION_TRIGRAMS][0])
+
+
+    @classmethod
+    def from_bank(cls, bank_obj):
+        """Build an index in memory, for banks collected without one.
+
+        :param bank_obj: The meta data container.
+        :type bank_obj: An instance of DatabaseMetaDataBank or BankFormat.LazyBank.
+        :returns: An instance of SearchIndex.
+        """
+        buf = StringIO()
+        dump_index(bank_obj, buf)
+        return cls(buf.getvalue())
+
+
+    def matches(self, bank_status):
+        """Whether the index is built from a bank file of this status, an
+           index of an older bank is stale.
+
+        :param bank_status: Status of the bank file now, see Location.file_status.
+        :type bank_status: tuple.
+        """
+        return bank_status is not None and self.bank_status == list(bank_status)
+
+
+    def _value_ids(self, fields):
+        for each_field in fields:
+            first, end = self._field_ranges.get(each_field, (0, 0))
+            for value_id in xrange(first, end):
+                yield value_id
+
+
+    def _value_text(self, value_id):
+        return self._strings.text(self._values[value_id * 2 + 1])
+
+
+    def _value_field(self, value_id):
+        return FIELDS[self._values[value_id * 2]]
+
+
+    def _candidate_values(self, table, terms):
+        """Intersect postings of terms, rarest first.
+
+        :returns: Set of value ids, None if no term is indexed at all.
+        """
+        term_ids = [table.find(t) for t in set(terms)]
+        if None in term_ids:
+            return set()
+        candidates = None
+        for each_id in sorted(term_ids, key=table.length):
+            if candidates is not None and len(candidates) * _VERIFY_RATIO < table.length(each_id):
+                break
+            postings = table.postings(each_id)
+            candidates = set(postings) if candidates is None else candidates.intersection(postings)
+            if not candidates:
+                break
+        return candidates
+
+
+    def _matching_values(self, field, text):
+        """Return ids of values in field (all fields if None) matched by the text of a term."""
+        fields = FIELDS if field is None else (field,)
+        text = text.lower()
+        if _WILDCARD_RE.search(text):
+            regex = _like_regex(text)
+            terms = set()
+            for each_piece in _WILDCARD_RE.split(text):
+                terms.update(_trigrams(each_piece))
+            candidates = self._candidate_values(self._trigrams, terms) if terms else None
+            match = lambda value: regex.match(value) is not None
+        else:
+            phrase = _words(text)
+            if phrase:
+                candidates = self._candidate_values(self._words, phrase)
+                match = lambda value: _contains_phrase(_words(value), phrase)
+            else:
+                # Only punctuation, match it anywhere in values.
+                candidates = self._candidate_values(self._trigrams, _trigrams(text)) if len(text) >= 3 else None
+                match = lambda value: text in value.lower()
+
+        if candidates is None:
+            candidates = self._value_ids(fields)
+        return [v for v in sorted(candidates)
+                if self._value_field(v) in fields and match(self._value_text(v))]
+
+
+    def _term_docs(self, field, text):
+        doc_ids = set()
+        for value_id in self._matching_values(field, text):
+            doc_ids.update(self._value_docs[value_id])
+        return doc_ids
+
+
+    def _hit(self, doc_id):
+        ids = _DOC.unpack_from(self._data, self._docs_offset + _DOC.size * doc_id)
+        return SearchHit(*[self._strings.text(i) for i in ids])
+
+
+    def search(self, query, limit=None):
+        """Find objects matching all terms of a query, see parse_query.
+
+        :param query: The query.
+        :type query: str or unicode.
+        :param limit: Return at most this many objects, all if None.
+        :type limit: int.
+        :returns: List of SearchHit, grouped by kind.
+        :raises: ValueError.
+        """
+        terms = parse_query(query)
+        kinds = set(t.lower() for f, t in terms if f == "kind")
+        ranges = [self._kind_ranges[k] for k in KINDS if k in self._kind_ranges and (not kinds or k in kinds)]
+
+        doc_ids = None
+        for field, text in terms:
+            if field == "kind":
+                continue
+            term_docs = self._term_docs(field, text)
+            doc_ids = term_docs if doc_ids is None else doc_ids.intersection(term_docs)
+            if not doc_ids:
+                return []
+
+        if doc_ids is None:
+            matched = (d for first, end in ranges for d in xrange(first, end))
+        else:
+            matched = (d for d in sorted(doc_ids) if any(first <= d < end for first, end in ranges))
+
+        hits = []
+        for each_doc in matched:
+            if limit is not None and len(hits) >= limit:
+                break
+            hits.append(self._hit(each_doc))
+        return hits
+
@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import os
+import logging
+from datetime import datetime
+
+import simplejson as json
+
+from database_schema_collect.MetaDataBank import to_struct
+from database_schema_collect.MetaDataBank import from_struct
+from database_schema_collect import Compression
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+SNAPSHOT_VERSION = 1
+
+# A full bank is stored at least once per this many versions.
+DEFAULT_CHECKPOINT_INTERVAL = 30
+
+CATALOG_NAME = "versions.json"
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Lists of a bank and of a table, with the fields identifying their items.
+BANK_LISTS = {"tablespaces": ("tablespace_name",),
+              "schemas": ("schema_name",),
+              "tables": ("table_schemaname", "table_name"),
+              "views": ("view_schemaname", "view_name"),
+              "foreign_servers": ("foreign_servername",),
+              "foreign_tables": ("foreign_schemaname", "foreign_tablename")}
+
+TABLE_LISTS = {"columns": ("column_name",),
+               "primary_key": ("pk_name", "pk_column"),
+               "foreign_keys": ("fk_name", "fk_column", "fk_ref_column"),
+               "unique_keys": ("uk_name", "uk_column"),
+               "checks": ("check_name",),
+               "indexes": ("index_name",)}
+
+# Lists of items of a bank list diffed item by item, not replaced whole.
+_NESTED_LISTS = {"tables": TABLE_LISTS}
+
+
+def _item_key(item, key_fields):
+    return tuple(item.get(k) for k in key_fields)
+
+
+def _keyed(items, key_fields):
+    """Return {key: item} of a list, None if keys are not unique."""
+    keyed = dict((_item_key(each_item, key_fields), each_item) for each_item in items)
+    return keyed if len(keyed) == len(items) else None
+
+
+def diff_item(old_item, new_item, nested_lists=None):
+    """Return changes turning old_item into new_item, None if they are equal.
+
+    :param old_item: Serialized object.
+    :type old_item: dict.
+    :param new_item: Serialized object.
+    :type new_item: dict.
+    :param nested_lists: {field: key fields} of lists diffed item by item.
+    :type nested_lists: dict.
+    :returns: {"set": {field: value}, "lists": {field: list delta}}.
+    """
+    nested_lists = nested_lists or {}
+    changed_fields = {}
+    list_deltas = {}
+    for k, v in new_item.iteritems():
+        old_v = old_item.get(k)
+        if old_v == v:
+            continue
+        if k in nested_lists and isinstance(old_v, list) and isinstance(v, list):
+            list_deltas[k] = diff_list(old_v, v, nested_lists[k])
+        else:
+            changed_fields[k] = v
+    for k in old_item:
+        if k not in new_item:
+            changed_fields[k] = None
+
+    if not changed_fields and not list_deltas:
+        return None
+    delta = {}
+    if changed_fields:
+        delta["set"] = changed_fields
+    if list_deltas:
+        delta["lists"] = list_deltas
+    return delta
+
+
+def apply_item(item, delta, nested_lists=None):
+    """Return a copy of item with changes of diff_item applied."""
+    nested_lists = nested_lists or {}
+    new_item = dict(item)
+    new_item.update(delta.get("set", {}))
+    for k, list_delta in delta.get("lists", {}).iteritems():
+        new_item[k] = apply_list(item.get(k) or [], list_delta, nested_lists[k])
+    return new_item
+
+
+def diff_list(old_items, new_items, key_fields, nested_lists=None):
+    """Return changes turning a list of serialized objects into another one,
+    None if they are equal. Items are matched by key_fields.
+
+    :param old_items: Serialized objects.
+    :type old_items: list.
+    :param new_items: Serialized objects.
+    :type new_items: list.
+    :param key_fields: Fields identifying an item.
+    :type key_fields: tuple.
+    :param nested_lists: {field: key fields} of lists of items diffed item by item.
+    :type nested_lists: dict.
+    :returns: {"removed": [key], "added": [item], "changed": [[key, item delta]],
+               "order": [key]}, only keys which are not empty. Or
+              {"replace": new_items} if keys of items are not unique.
+    """
+    if old_items == new_items:
+        return None
+
+    old_keyed = _keyed(old_items, key_fields)
+    new_keyed = _keyed(new_items, key_fields)
+    if old_keyed is None or new_keyed is None:
+        return {"replace": new_items}
+
+    delta = {}
+    removed = [list(k) for k in (_item_key(i, key_fields) for i in old_items) if k not in new_keyed]
+    if removed:
+        delta["removed"] = removed
+
+    added = []
+    changed = []
+    for each_item in new_items:
+        key = _item_key(each_item, key_fields)
+        old_item = old_keyed.get(key)
+        if old_item is None:
+            added.append(each_item)
+            continue
+        item_delta = diff_item(old_item, each_item, nested_lists)
+        if item_delta is not None:
+            changed.append([list(key), item_delta])
+    if added:
+        delta["added"] = added
+    if changed:
+        delta["changed"] = changed
+
+    # Kept items stay in their order and added ones follow, the order is
+    # only stored if that is not the new order.
+    new_order = [_item_key(i, key_fields) for i in new_items]
+    kept_order = [_item_key(i, key_fields) for i in old_items if _item_key(i, key_fields) in new_keyed]
+    if kept_order + [_item_key(i, key_fields) for i in added] != new_order:
+        delta["order"] = [list(k) for k in new_order]
+    return delta
+
+
+def apply_list(old_items, delta, key_fields, nested_lists=None):
+    """Return a new list with changes of diff_list applied to old_items."""
+    if "replace" in delta:
+        return delta["replace"]
+
+    removed = set(tuple(k) for k in delta.get("removed", []))
+    changed = dict((tuple(k), item_delta) for k, item_delta in delta.get("changed", []))
+    new_items = []
+    for each_item in old_items:
+        key = _item_key(each_item, key_fields)
+        if key in removed:
+            continue
+        if key in changed:
+            each_item = apply_item(each_item, changed[key], nested_lists)
+        new_items.append(each_item)
+    new_items.extend(delta.get("added", []))
+
+    if "order" in delta:
+        keyed = dict((_item_key(i, key_fields), i) for i in new_items)
+        new_items = [keyed[tuple(k)] for k in delta["order"]]
+    return new_items
+
+
+def diff_bank(old_struct, new_struct):
+    """Return changes turning a serialized bank into another one.
+
+    :param old_struct: Output of to_struct of a DatabaseMetaDataBank.
+    :type old_struct: dict.
+    :param new_struct: Output of to_struct of a DatabaseMetaDataBank.
+    :type new_struct: dict.
+    :returns: {"database": database if changed, "lists": {list name: list delta}}.
+    """
+    delta = {}
+    if old_struct.get("database") != new_struct.get("database"):
+        delta["database"] = new_struct.get("database")
+    list_deltas = {}
+    for each_name, key_fields in BANK_LISTS.iteritems():
+        list_delta = diff_list(old_struct.get(each_name) or [], new_struct.get(each_name) or [],
+                               key_fields, _NESTED_LISTS.get(each_name))
+        if list_delta is not None:
+            list_deltas[each_name] = list_delta
+    if list_deltas:
+        delta["lists"] = list_deltas
+    return delta
+
+
+def apply_bank(old_struct, delta):
+    """Return a serialized bank with changes of diff_bank applied to old_struct."""
+    new_struct = dict(old_struct)
+    if "database" in delta:
+        new_struct["database"] = delta["database"]
+    for each_name, list_delta in delta.get("lists", {}).iteritems():
+        new_struct[each_name] = apply_list(old_struct.get(each_name) or [], list_delta,
+                                           BANK_LISTS[each_name], _NESTED_LISTS.get(each_name))
+    return new_struct
+
+
+def parse_as_of(text):
+    """Parse a point of time given as YYYY-MM-DD[ HH:MM[:SS]], a date alone
+    means the end of that day.
+
+    :param text: Time text, T may separate date and time.
+    :type text: str.
+    :returns: An instance of datetime.
+    :raises: ValueError.
+    """
+    text = text.strip().replace("T", " ")
+    for each_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M"):
+        try:
+            return datetime.strptime(text, each_format)
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(text, "%Y-%m-%d").replace(hour=23, minute=59, second=59)
+    except ValueError:
+        raise ValueError("Expect time as YYYY-MM-DD[ HH:MM[:SS]], got {}".format(text))
+
+
+class SnapshotStore(object):
+    """History of banks of a database in a directory of a location.
+
+    Each recorded bank is a version. A version is stored as the changes
+    against the previous version, added, removed and changed objects down
+    to columns, constraints and indexes of tables, or as the full bank
+    every checkpoint_interval versions. Loading a version applies at most
+    checkpoint_interval - 1 deltas to a full bank.
+
+    Files are gzip compressed json, <version>.full.json.gz or
+    <version>.delta.json.gz, listed with the time they were collected at in
+    versions.json.
+    """
+
+    def __init__(self, location, store_dir, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 temp_dir=None):
+        """
+        :param location: Location of store_dir.
+        :type location: An instance of Location.
+        :param store_dir: Directory of the snapshots.
+        :type store_dir: str.
+        :param checkpoint_interval: Store a full bank at least once per this many versions.
+        :type checkpoint_interval: int.
+        :param temp_dir: Local directory staging files of remote locations.
+        :type temp_dir: str.
+        """
+        if checkpoint_interval < 1:
+            raise ValueError("Checkpoint interval must be at least 1, got {}".format(checkpoint_interval))
+        self.location = location
+        self.store_dir = store_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.temp_dir = temp_dir
+        self._catalog = None
+
+
+    def _path(self, file_name):
+        return os.path.join(self.store_dir, file_name)
+
+
+    def versions(self):
+        """Return catalog entries of all versions, oldest first. Each is a
+           dict of version, kind (full|delta), collected_at and file.
+        """
+        if self._catalog is None:
+            content = self.location.open_file(self._path(CATALOG_NAME))
+            if content is None:
+                self._catalog = []
+            else:
+                doc = json.loads(content)
+                if doc.get("format_version") != SNAPSHOT_VERSION:
+                    raise ValueError("Unsupported snapshot catalog version {}".format(doc.get("format_version")))
+                self._catalog = doc["versions"]
+        return self._catalog
+
+
+    def latest_version(self):
+        """Return the latest version number, None if nothing is recorded."""
+        catalog = self.versions()
+        return catalog[-1]["version"] if catalog else None
+
+
+    def _entry(self, version):
+        for each_entry in self.versions():
+            if each_entry["version"] == version:
+                return each_entry
+        raise ValueError("No version {} in {}".format(version, self.store_dir))
+
+
+    def version_path(self, version):
+        """Return path of the file of a version, which is never written again.
+
+        :param version: Version number.
+        :type version: int.
+        :raises: ValueError.
+        """
+        return self._path(self._entry(version)["file"])
+
+
+    def _read(self, entry):
+        content = self.location.open_file(self._path(entry["file"]))
+        if content is None:
+            raise ValueError("Missing snapshot file {}".format(entry["file"]))
+        return json.loads(content)
+
+
+    def _write(self, file_name, doc):
+        with self.location.open_write(self._path(file_name), self.temp_dir) as wf:
+            wf.write(Compression.GzipCodec().compress(json.dumps(doc, sort_keys=True)))
+
+
+    def load_struct(self, version):
+        """Return the serialized bank of a version.
+
+        :param version: Version number.
+        :type version: int.
+        :returns: dict like to_struct of a DatabaseMetaDataBank.
+        :raises: ValueError.
+        """
+        catalog = self.versions()
+        pos = catalog.index(self._entry(version))
+        start = pos
+        while catalog[start]["kind"] != "full":
+            start -= 1
+
+        struct_obj = self._read(catalog[start])
+        for each_entry in catalog[start + 1:pos + 1]:
+            struct_obj = apply_bank(struct_obj, self._read(each_entry))
+        return struct_obj
+
+
+    def load(self, version):
+        """Return the bank of a version.
+
+        :param version: Version number.
+        :type version: int.
+        :returns: An instance of DatabaseMetaDataBank.
+        :raises: ValueError.
+        """
+        return from_struct(self.load_struct(version))
+
+
+    def version_as_of(self, when):
+        """Return the latest version collected at or before a time.
+
+        :param when: Point of time.
+        :type when: An instance of datetime.
+        :returns: Version number.
+        :raises: ValueError.
+        """
+        found = None
+        for each_entry in self.versions():
+            if datetime.strptime(each_entry["collected_at"], TIME_FORMAT) <= when:
+                found = each_entry["version"]
+        if found is None:
+            raise ValueError("No version collected before {}".format(when.strftime(TIME_FORMAT)))
+        return found
+
+
+    def record(self, bank_obj, collected_at=None):
+        """Record a bank as a new version.
+
+        :param bank_obj: The collected bank.
+        :type bank_obj: An instance of DatabaseMetaDataBank.
+        :param collected_at: Time of the collect, now if None.
+        :type collected_at: An instance of datetime.
+        :returns: The new version number.
+        """
+        catalog = list(self.versions())
+        new_struct = to_struct(bank_obj)
+        version = catalog[-1]["version"] + 1 if catalog else 1
+
+        doc = new_struct
+        kind = "full"
+        since_full = 0
+        for each_entry in reversed(catalog):
+            if each_entry["kind"] == "full":
+                break
+            since_full += 1
+        if catalog and since_full + 1 < self.checkpoint_interval:
+            delta = diff_bank(self.load_struct(catalog[-1]["version"]), new_struct)
+            # A delta touching most of the bank is not worth applying.
+            if len(json.dumps(delta)) < len(json.dumps(new_struct)) // 2:
+                doc = delta
+                kind = "delta"
+
+        file_name = "{:08d}.{}.json.gz".format(version, kind)
+        logger.info("Record version %d of the bank as %s" % (version, file_name))
+        self._write(file_name, doc)
+
+        collected_at = collected_at or datetime.now()
+        catalog.append({"version": version,
+                        "kind": kind,
+                        "collected_at": collected_at.strftime(TIME_FORMAT),
+                        "file": file_name})
+        # Written last, versions it lists are all in place.
+        with self.location.open_write(self._path(CATALOG_NAME), self.temp_dir) as wf:
+            wf.write(json.dumps({"format_version": SNAPSHOT_VERSION, "versions": catalog}, indent=1))
+        self._catalog = catalog
+        return version
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import os
+import logging
+import tempfile
+import threading
+from collections import deque
+
+import cPickle as pickle
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+PICKLE_PROTOCOL = 2
+
+# Memory held by an object per byte of its pickle. Metadata objects take
+# 1.5 to 2 times their pickled size, the rest covers allocator overhead.
+MEMORY_PER_PICKLED_BYTE = 3
+
+# Objects are pickled to learn their size until this many units are seen,
+# later ones are estimated by their units, see _units.
+CALIBRATION_UNITS = 1000
+
+
+def _units(obj):
+    """Return number of objects obj holds in its list fields, itself included.
+
+    Sizes of objects of one kind grow with it, far cheaper to count than
+    pickling them.
+    """
+    units = 1
+    field_names = getattr(obj, "field_names", None)
+    if field_names is None:
+        return units
+    for each_name in field_names():
+        value = getattr(obj, each_name, None)
+        if isinstance(value, (list, tuple)):
+            units += len(value)
+    return units
+
+
+class _SpilledSpan(object):
+    """Place of an object written to a spill file."""
+
+    __slots__ = ("offset", "length")
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+
+class SpillFile(object):
+    """Append only file of pickled objects, read back by their span.
+
+    The file has no name, it is gone when closed or when the process exits.
+    """
+
+    def __init__(self, spill_dir=None):
+        """
+        :param spill_dir: Directory of the file, system default if None.
+        :type spill_dir: str.
+        """
+        if spill_dir is not None and not os.path.exists(spill_dir):
+            os.makedirs(spill_dir)
+        self._file = tempfile.TemporaryFile(suffix=".spill", dir=spill_dir)
+        self._end = 0
+        self._lock = threading.Lock()
+        self.size = 0
+
+
+    def write(self, content):
+        """Append pickled content.
+
+        :param content: Pickle of an object.
+        :type content: str.
+        :returns: An instance of _SpilledSpan.
+        """
+        with self._lock:
+            self._file.seek(self._end)
+            self._file.write(content)
+            span = _SpilledSpan(self._end, len(content))
+            self._end += len(content)
+            self.size = self._end
+        return span
+
+
+    def read(self, span):
+        """Load an object written at span."""
+        with self._lock:
+            self._file.seek(span.offset)
+            content = self._file.read(span.length)
+        return pickle.loads(content)
+
+
+    def close(self):
+        self._file.close()
+
+
+class SpillingList(object):
+    """List of objects holding at most max_bytes of them in memory.
+
+    Objects are only appended. Once the objects in memory are estimated to
+    take more than max_bytes, the least recently appended ones are pickled
+    to a spill file and replaced by their span. They are loaded again on
+    every access and not kept, so memory use follows what the caller holds
+    on to. Sizes are estimated from the pickled bytes per unit of the
+    objects pickled so far, the first ones are pickled only for that.
+    """
+
+    def __init__(self, max_bytes, spill_dir=None):
+        """
+        :param max_bytes: Memory budget of the objects in memory.
+        :type max_bytes: int.
+        :param spill_dir: Directory of the spill file, system default if None.
+        :type spill_dir: str.
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.resident_bytes = 0
+        self.spilled_count = 0
+        self._items = []
+        # (position, estimated size, units) of objects in memory, oldest first.
+        self._resident = deque()
+        self._spill_file = None
+        # Totals over all objects pickled, for estimates of the others.
+        self._pickled_bytes = 0
+        self._pickled_units = 0
+
+
+    def _pickle(self, obj, units):
+        content = pickle.dumps(obj, PICKLE_PROTOCOL)
+        self._pickled_bytes += len(content)
+        self._pickled_units += units
+        return content
+
+
+    def append(self, obj):
+        units = _units(obj)
+        content = None
+        if self._pickled_units < CALIBRATION_UNITS:
+            content = self._pickle(obj, units)
+            size = len(content) * MEMORY_PER_PICKLED_BYTE
+        else:
+            size = units * self._pickled_bytes * MEMORY_PER_PICKLED_BYTE // self._pickled_units
+        if size > self.max_bytes:
+            # Too large to ever stay, spill it right away.
+            self._items.append(self._spill(content if content is not None else self._pickle(obj, units)))
+        else:
+            self._items.append(obj)
+            self._resident.append((len(self._items) - 1, size, units))
+            self.resident_bytes += size
+        while self.resident_bytes > self.max_bytes and self._resident:
+            position, size, units = self._resident.popleft()
+            self._items[position] = self._spill(self._pickle(self._items[position], units))
+            self.resident_bytes -= size
+
+
+    def _spill(self, content):
+        if self._spill_file is None:
+            self._spill_file = SpillFile(self.spill_dir)
+            logger.info("Memory budget of %.1f MB reached, spill objects to %s." %
+                        (self.max_bytes / (1024.0 * 1024), self.spill_dir or tempfile.gettempdir()))
+        self.spilled_count += 1
+        return self._spill_file.write(content)
+
+
+    def _load(self, item):
+        return self._spill_file.read(item) if type(item) is _SpilledSpan else item
+
+
+    def extend(self, objs):
+        for each_obj in objs:
+            self.append(each_obj)
+
+
+    def __len__(self):
+        return len(self._items)
+
+
+    def __nonzero__(self):
+        return len(self._items) > 0
+
+
+    __bool__ = __nonzero__
+
+
+    def __iter__(self):
+        for i in xrange(len(self._items)):
+            yield self._load(self._items[i])
+
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._load(i) for i in self._items[key]]
+        return self._load(self._items[key])
+
+
+    def select(self, positions):
+        """Return a read only list of the objects at some positions.
+
+        :param positions: Positions of objects, in the order to return them.
+        :type positions: list.
+        :returns: An instance of SpillingListView.
+        """
+        return SpillingListView(self, positions)
+
+
+    def close(self):
+        """Remove the spill file, spilled objects can not be read anymore."""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, SpillingList, SpillingListView)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+
+    def __repr__(self):
+        return "<SpillingList of {} objects, {} spilled>".format(len(self), self.spilled_count)
+
+
+class SpillingListView(object):
+    """Read only list of some objects of a SpillingList."""
+
+    def __init__(self, spilling_list, positions):
+        self._list = spilling_list
+        self._positions = positions
+
+
+    def __len__(self):
+        return len(self._positions)
+
+
+    def __nonzero__(self):
+        return len(self._positions) > 0
+
+
+    __bool__ = __nonzero__
+
+
+    def __iter__(self):
+        for each_position in self._positions:
+            yield self._list[each_position]
+
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._list[p] for p in self._positions[key]]
+        return self._list[self._positions[key]]
+
+
+    def __eq__(self, other):
+        if isinstance(other, (list, tuple, SpillingList, SpillingListView)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
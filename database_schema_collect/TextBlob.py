@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import sys
+import os
+import gzip
+import zlib
+import struct
+import hashlib
+import logging
+from array import array
+
+from database_schema_collect.MetaDataBank import DeferredText
+from database_schema_collect.MetaDataBank import LARGE_TEXT_FIELDS
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+# Texts shorter than this many utf-8 bytes stay inline.
+DEFAULT_MIN_SIZE = 1024
+
+# Names of all fields which may be stored out of line.
+TEXT_FIELD_NAMES = frozenset(n for names in LARGE_TEXT_FIELDS.values() for n in names)
+
+# Directory under the database directory holding texts of metadata files.
+TEXT_DIR_NAME = "_text"
+
+_U32 = struct.Struct("<I")
+
+_RAW = 0
+_ZLIB = 1
+
+
+def _text_bytes(value):
+    return value.encode("utf-8") if isinstance(value, unicode) else str(value)
+
+
+class TextBlobWriter(object):
+    """Collect large texts for the blob section of a binary bank.
+
+    Equal texts are stored once. With compress, each text is zlib
+    compressed if that makes it smaller.
+    """
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, compress=True):
+        """
+        :param min_size: Texts of at least this many bytes are stored as blobs,
+                         0 disables blobs.
+        :type min_size: int.
+        :param compress: Compress blobs.
+        :type compress: bool.
+        """
+        self.min_size = min_size
+        self.compress = compress
+        self._ids = {}
+        self._flags = array('B')
+        self._blobs = []
+
+
+    def add(self, value):
+        """Store a text if it is large enough.
+
+        :param value: A text.
+        :type value: str or unicode.
+        :returns: Blob id, or None if the text should stay inline.
+        """
+        if self.min_size <= 0:
+            return None
+        raw = _text_bytes(value)
+        if len(raw) < self.min_size:
+            return None
+
+        digest = hashlib.sha1(raw).digest()
+        blob_id = self._ids.get(digest)
+        if blob_id is None:
+            flag = _RAW
+            if self.compress:
+                packed = zlib.compress(raw)
+                if len(packed) < len(raw):
+                    raw, flag = packed, _ZLIB
+            blob_id = len(self._blobs)
+            self._blobs.append(raw)
+            self._flags.append(flag)
+            self._ids[digest] = blob_id
+        return blob_id
+
+
+    def __len__(self):
+        return len(self._blobs)
+
+
+    def pack(self):
+        """Return content of the blob section:
+        u32 count | count * u8 flag | count * u32 end offset | blobs.
+        """
+        ends = array('I')
+        end = 0
+        for each_blob in self._blobs:
+            end += len(each_blob)
+            ends.append(end)
+        if sys.byteorder == "big":
+            ends.byteswap()
+        return b"".join([_U32.pack(len(self._blobs)), self._flags.tostring(), ends.tostring()] + self._blobs)
+
+
+class TextBlobReader(object):
+    """Read texts from the blob section of a binary bank."""
+
+    def __init__(self, data, offset, length):
+        """
+        :param data: Content of a bank file.
+        :type data: str, buffer or mmap.
+        :param offset: Offset of the blob section.
+        :type offset: int.
+        :param length: Length of the blob section.
+        :type length: int.
+        """
+        count, = _U32.unpack_from(data, offset)
+        pos = offset + _U32.size
+        self._flags = array('B')
+        self._flags.fromstring(data[pos:pos + count])
+        pos += count
+        self._ends = array('I')
+        self._ends.fromstring(data[pos:pos + self._ends.itemsize * count])
+        if sys.byteorder == "big":
+            self._ends.byteswap()
+        self._data = data
+        self._base = pos + self._ends.itemsize * count
+
+
+    def get(self, blob_id):
+        """Return text of a blob."""
+        start = self._ends[blob_id - 1] if blob_id > 0 else 0
+        raw = self._data[self._base + start:self._base + self._ends[blob_id]]
+        if self._flags[blob_id] == _ZLIB:
+            raw = zlib.decompress(raw)
+        return raw.decode("utf-8")
+
+
+    def deferred(self, blob_id):
+        """Return a DeferredText of a blob."""
+        return DeferredText(self.get, blob_id)
+
+
+class TextFileStore(object):
+    """Move large texts of serialized metadata objects into shared files.
+
+    A text is written once to <database directory>/_text/<sha1>.txt[.gz] and
+    the field refers to it as {"text_blob": "_text/<sha1>.txt[.gz]"}.
+    """
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, compress=True):
+        """
+        :param min_size: Texts of at least this many bytes are moved out.
+        :type min_size: int.
+        :param compress: Gzip text files.
+        :type compress: bool.
+        """
+        self.min_size = min_size
+        self.compress = compress
+        self._written = set()
+
+
+    def _save(self, raw, db_dir):
+        suffix = ".txt.gz" if self.compress else ".txt"
+        rel_path = "{}/{}{}".format(TEXT_DIR_NAME, hashlib.sha1(raw).hexdigest(), suffix)
+        file_path = os.path.join(db_dir, rel_path)
+        if file_path not in self._written:
+            text_dir = os.path.join(db_dir, TEXT_DIR_NAME)
+            if not os.path.isdir(text_dir):
+                try:
+                    os.makedirs(text_dir)
+                except OSError:
+                    # Created by another process of a parallel save.
+                    if not os.path.isdir(text_dir):
+                        raise
+            # Written aside and renamed, processes of a parallel save may
+            # write the same text at once.
+            temp_path = "{}.{}.tmp".format(file_path, os.getpid())
+            with open(temp_path, "wb") as raw_wf:
+                if self.compress:
+                    # Header holds the final name, not the temporary one.
+                    with gzip.GzipFile(os.path.basename(file_path), "wb", fileobj=raw_wf, mtime=0) as wf:
+                        wf.write(raw)
+                else:
+                    raw_wf.write(raw)
+            os.rename(temp_path, file_path)
+            self._written.add(file_path)
+        return rel_path
+
+
+    def mark_saved(self, rel_paths, db_dir):
+        """Treat text files at rel_paths as written already, they are
+           not written again.
+
+        :param rel_paths: Paths relative to db_dir.
+        :type rel_paths: list.
+        :param db_dir: Database directory the text files are written under.
+        :type db_dir: str.
+        """
+        self._written.update(os.path.join(db_dir, p) for p in rel_paths)
+
+
+    def externalize(self, struct_obj, db_dir):
+        """Replace large texts in a serialized object by references, in place.
+
+        :param struct_obj: Output of to_struct.
+        :type struct_obj: dict.
+        :param db_dir: Database directory the text files are written under.
+        :type db_dir: str.
+        :returns: struct_obj.
+        """
+        if self.min_size <= 0:
+            return struct_obj
+
+        stack = [struct_obj]
+        while stack:
+            each_obj = stack.pop()
+            if isinstance(each_obj, list):
+                stack.extend(each_obj)
+                continue
+            if not isinstance(each_obj, dict):
+                continue
+            for k, v in each_obj.items():
+                if isinstance(v, (list, dict)):
+                    stack.append(v)
+                elif k in TEXT_FIELD_NAMES and isinstance(v, basestring):
+                    raw = _text_bytes(v)
+                    if len(raw) >= self.min_size:
+                        each_obj[k] = {"text_blob": self._save(raw, db_dir)}
+        return struct_obj
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from functools import partial
+from cStringIO import StringIO
+
+import cPickle as pickle
+
+from database_schema_collect.util import load_conf
+from database_schema_collect.Collector import PGCollector
+from database_schema_collect.MetaDataBank import MetaDataBank
+from database_schema_collect.MetaDataBank import ColumnMetaData
+from database_schema_collect.MetaDataBank import DatabaseMetaData
+from database_schema_collect.MetaDataBank import SchemaMetaData
+from database_schema_collect.MetaDataBank import TableMetaData
+from database_schema_collect.MetaDataBank import PKMetaData
+from database_schema_collect.MetaDataBank import IndexMetaData
+from database_schema_collect.MetaDataBank import DatabaseMetaDataBank
+from database_schema_collect.MetaDataBank import to_struct
+from database_schema_collect.MetaDataBank import from_struct
+from database_schema_collect.MetaDataBank import select_objects
+from database_schema_collect import BankFormat
+from database_schema_collect import SQLiteBank
+from database_schema_collect.Location import LocalLocation
+from database_schema_collect import Compression
+
+reload(sys)
+sys.setdefaultencoding("utf-8")
+
+
+logger = logging.getLogger("database_schema_collect")
+
+
+def _timeit(func, *args, **kwargs):
+    """Run func once, return (result, elapsed seconds)."""
+    start = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - start
+
+
+def _report(title, rows):
+    """Print a small result table.
+
+    :param title: Title of the benchmark.
+    :type title: str.
+    :param rows: List of (label, value) pairs.
+    :type rows: list.
+    """
+    print(title)
+    label_width = max(len(r[0]) for r in rows) if rows else 0
+    for label, value in rows:
+        print("  {}  {}".format(label.ljust(label_width), value))
+
+
+def bench_extract(conf_obj, schemaname):
+    """Compare rows per second of the regular query path and the COPY path
+    for the bulk column query of a schema.
+
+    :param conf_obj: Configuration object.
+    :type conf_obj: ConfigParser.
+    :param schemaname: Schema to read columns from.
+    :type schemaname: str.
+    """
+    collector = PGCollector(conf_obj.get("datasource", "uri"), MetaDataBank("."))
+    agent = collector.pgagent
+    params = {"schemaname": schemaname}
+
+    def by_query():
+        row_count = 0
+        for each_row in agent.query_all(collector.sql_bulk_colinfo, params):
+            if each_row is None:
+                break
+            row_count += 1
+        return row_count
+
+    def by_copy():
+        return agent.copy_query(collector.sql_bulk_colinfo, params)
+
+    rows = []
+    for label, func in (("query", by_query), ("copy", by_copy)):
+        row_count, elapsed = _timeit(func)
+        rows.append((label, "{} rows in {:.3f}s, {:.0f} rows/s".format(row_count, elapsed,
+                                                                    row_count / elapsed if elapsed > 0 else 0)))
+    _report("Bulk column extraction of schema {}".format(schemaname), rows)
+
+
+def _deep_sizeof(objs):
+    """Sum sizes of objects and everything they refer to, counting shared objects once."""
+    seen = set()
+    total = 0
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+        elif hasattr(obj, "__slots__"):
+            stack.extend(getattr(obj, f, None) for f in obj.field_names())
+    return total
+
+
+class _PlainColumn(object):
+    """Column with a per instance __dict__ and no string pooling, as before
+    metadata classes got __slots__."""
+
+    def __init__(self, **kwargs):
+        for k in ColumnMetaData.field_names():
+            setattr(self, k, kwargs.get(k))
+
+
+def _fake_column_rows(column_count):
+    """Rows shaped like the ones the collector reads. Every string is a
+    distinct object, like values decoded from a database driver."""
+    data_types = ("integer", "bigint", "character varying", "numeric",
+                  "timestamp without time zone", "text", "boolean")
+    for i in range(column_count):
+        col_name = "column_{}".format(i % 50)
+        yield {"name": ''.join(list(col_name)),
+               "column_name": ''.join(list(col_name)),
+               "column_index": i % 50 + 1,
+               "column_data_type": ''.join(list(data_types[i % len(data_types)])),
+               "column_length": 64 if i % 7 == 2 else None,
+               "column_comment": "comment of column {}".format(i),
+               "column_default_value": ''.join(list('')),
+               "column_is_nullable": i % 2 == 0,
+               "column_in_pk": '',
+               "column_in_fk": ''}
+
+
+def bench_column_footprint(column_count):
+    """Compare memory footprint per column of plain objects and the compact
+    ColumnMetaData.
+
+    :param column_count: Number of columns to build.
+    :type column_count: int.
+    """
+    rows = []
+    for label, factory in (("plain object", _PlainColumn), ("compact ColumnMetaData", ColumnMetaData)):
+        columns = [factory(**r) for r in _fake_column_rows(column_count)]
+        total = _deep_sizeof(columns) - sys.getsizeof(columns)
+        rows.append((label, "{:.1f} bytes/column".format(total / column_count)))
+    _report("Memory footprint of {} columns".format(column_count), rows)
+
+
+def fake_bank(column_count, columns_per_table=20, schema_count=10):
+    """Build a bank of synthetic tables with column_count columns in total.
+
+    :param column_count: Number of columns of all tables.
+    :type column_count: int.
+    :param columns_per_table: Number of columns of each table.
+    :type columns_per_table: int.
+    :param schema_count: Tables are spread over this many schemas.
+    :type schema_count: int.
+    :returns: An instance of DatabaseMetaDataBank.
+    """
+    bank_obj = DatabaseMetaDataBank()
+    bank_obj.database = DatabaseMetaData(name="benchdb", database_name="benchdb", database_encoding="UTF8")
+    for i in range(schema_count):
+        schemaname = "schema_{}".format(i)
+        bank_obj.schemas.append(SchemaMetaData(name=schemaname, schema_name=schemaname, schema_owner="owner"))
+
+    col_rows = _fake_column_rows(column_count)
+    table_count = (column_count + columns_per_table - 1) // columns_per_table
+    for i in range(table_count):
+        tablename = "table_{}".format(i)
+        tb_meta = TableMetaData(name=tablename, table_name=tablename,
+                                table_schemaname="schema_{}".format(i % schema_count),
+                                table_owner="owner", table_comment="comment of table {}".format(i),
+                                column_longest_length=10)
+        for each_row in col_rows:
+            tb_meta.columns.append(ColumnMetaData(**each_row))
+            if len(tb_meta.columns) == columns_per_table:
+                break
+        pk_name = "pk_{}".format(tablename)
+        tb_meta.primary_key.append(PKMetaData(name=pk_name, pk_name=pk_name, pk_column="column_0", pk_column_index=1))
+        idx_name = "idx_{}".format(tablename)
+        tb_meta.indexes.append(IndexMetaData(name=idx_name, index_name=idx_name, index_columns="column_1",
+                                             index_type="btree",
+                                             index_define="CREATE INDEX {} ON {} USING btree (column_1)".format(idx_name,
+                                                                                                               tablename)))
+        bank_obj.tables.append(tb_meta)
+    bank_obj.rebuild_indexes()
+    return bank_obj
+
+
+def _dump_pickle(bank_obj):
+    return pickle.dumps(to_struct(bank_obj))
+
+
+def _load_pickle(data):
+    return from_struct(pickle.loads(data))
+
+
+def _dump_binary(bank_obj):
+    buf = StringIO()
+    BankFormat.dump_bank(bank_obj, buf)
+    return buf.getvalue()
+
+
+BANK_FORMATS = (("pickle", _dump_pickle, _load_pickle),
+                ("binary", _dump_binary, BankFormat.load_bank))
+
+
+def bench_bank_format(column_counts):
+    """Compare save and load time of bank formats.
+
+    :param column_counts: Sizes of banks, in number of columns.
+    :type column_counts: list.
+    """
+    for column_count in column_counts:
+        bank_obj = fake_bank(column_count)
+        rows = []
+        for label, dumper, loader in BANK_FORMATS:
+            data, save_time = _timeit(dumper, bank_obj)
+            _, load_time = _timeit(loader, data)
+            rows.append((label, "save {:.3f}s  load {:.3f}s  size {:.1f} MB".format(save_time, load_time,
+                                                                                   len(data) / 1024.0 / 1024.0)))
+        _report("Bank of {} columns".format(column_count), rows)
+
+
+def bench_lazy_open(column_counts):
+    """Compare time to the first table of one schema between loading a whole
+    binary bank and opening it lazily from a memory mapped file.
+
+    :param column_counts: Sizes of banks, in number of columns.
+    :type column_counts: list.
+    """
+    for column_count in column_counts:
+        bank_obj = fake_bank(column_count)
+        fd, bank_path = tempfile.mkstemp(suffix=".bank")
+        try:
+            with os.fdopen(fd, "wb") as wf:
+                BankFormat.dump_bank(bank_obj, wf)
+            del bank_obj
+
+            def first_table(lazy):
+                opened = BankFormat.open_bank(LocalLocation().map_file(bank_path), lazy=lazy)
+                return next(opened.iter_tables("schema_0"))
+
+            rows = []
+            for label, lazy in (("load all", False), ("lazy mmap", True)):
+                _, elapsed = _timeit(first_table, lazy)
+                rows.append((label, "{:.3f}s".format(elapsed)))
+            _report("First table of a schema, bank of {} columns".format(column_count), rows)
+        finally:
+            os.remove(bank_path)
+
+
+def bench_sqlite_bank(column_counts, schemaname):
+    """Compare save time, full load time and load time of one schema between
+    a pickled bank and a SQLite bank.
+
+    :param column_counts: Sizes of banks, in number of columns.
+    :type column_counts: list.
+    :param schemaname: Schema loaded by partial loads.
+    :type schemaname: str.
+    """
+    for column_count in column_counts:
+        bank_obj = fake_bank(column_count)
+        build_dir = tempfile.mkdtemp()
+        try:
+            pickle_path = os.path.join(build_dir, "bank.pickle")
+            sqlite_path = os.path.join(build_dir, "bank.sqlite")
+
+            def save_pickle():
+                with open(pickle_path, "wb") as wf:
+                    wf.write(_dump_pickle(bank_obj))
+
+            def load_pickle(schemas):
+                with open(pickle_path, "rb") as rf:
+                    return select_objects(_load_pickle(rf.read()), schemas)
+
+            def load_sqlite(schemas):
+                sqlite_bank = SQLiteBank.SQLiteBank(sqlite_path)
+                try:
+                    return sqlite_bank.load(schemas)
+                finally:
+                    sqlite_bank.close()
+
+            rows = []
+            for label, save, load in (("pickle", save_pickle, load_pickle),
+                                      ("sqlite", partial(SQLiteBank.write_bank, bank_obj, sqlite_path), load_sqlite)):
+                _, save_time = _timeit(save)
+                _, full_time = _timeit(load, None)
+                _, partial_time = _timeit(load, [schemaname])
+                size = os.path.getsize(pickle_path if label == "pickle" else sqlite_path)
+                rows.append((label, "save {:.3f}s  load all {:.3f}s  load {} {:.3f}s  size {:.1f} MB".format(
+                    save_time, full_time, schemaname, partial_time, size / 1024.0 / 1024.0)))
+            _report("Bank of {} columns".format(column_count), rows)
+        finally:
+            shutil.rmtree(build_dir)
+
+
+def bench_compression(column_count, levels):
+    """Compare size, write time and read time of a binary bank per compression.
+
+    :param column_count: Size of the bank, in number of columns.
+    :type column_count: int.
+    :param levels: Compression levels to try for each codec, None for its default.
+    :type levels: list.
+    """
+    bank_obj = fake_bank(column_count)
+    data = _dump_binary(bank_obj)
+    del bank_obj
+
+    fd, bank_path = tempfile.mkstemp(suffix=".bank")
+    os.close(fd)
+    try:
+        rows = []
+        for name in ["none"] + Compression.available_codecs():
+            for level in ([None] if name == "none" else levels):
+                codec = Compression.get_codec(name, level)
+
+                def write():
+                    with Compression.open_writer(bank_path, codec) as wf:
+                        wf.write(data)
+
+                _, write_time = _timeit(write)
+                _, read_time = _timeit(LocalLocation().open_file, bank_path)
+                size = os.path.getsize(bank_path)
+                label = name if codec is None else "{} level {}".format(name, codec.level)
+                rows.append((label, "size {:.1f} MB ({:.0%})  write {:.3f}s  read {:.3f}s".format(
+                    size / 1024.0 / 1024.0, size / float(len(data)), write_time, read_time)))
+        _report("Compression of a binary bank of {} columns".format(column_count), rows)
+    finally:
+        os.remove(bank_path)
+
+
+def parse_input():
+    """Command line interface of benchmarks."""
+    parser = argparse.ArgumentParser(description="Benchmarks of database_schema_collect.")
+    parser.add_argument("--config", dest="conf_path", type=str, default=None,
+                        help="Path of the config file, needed by benchmarks touching a database.")
+    subparsers = parser.add_subparsers(dest="bench")
+
+    p_extract = subparsers.add_parser("extract", help="Regular query vs COPY catalog extraction.")
+    p_extract.add_argument("--schema", dest="schemaname", type=str, default="public")
+
+    p_memory = subparsers.add_parser("memory", help="Memory footprint per column.")
+    p_memory.add_argument("--columns", dest="column_count", type=int, default=100000)
+
+    p_bank = subparsers.add_parser("bank", help="Save and load time of bank formats.")
+    p_bank.add_argument("--columns", dest="column_counts", type=int, nargs="+",
+                        default=[10000, 100000, 1000000])
+
+    p_lazy = subparsers.add_parser("lazy", help="Open time of a binary bank, loaded at once vs lazily.")
+    p_lazy.add_argument("--columns", dest="column_counts", type=int, nargs="+",
+                        default=[100000, 1000000])
+
+    p_sqlite = subparsers.add_parser("sqlite", help="Save and full or partial load time, pickle vs SQLite bank.")
+    p_sqlite.add_argument("--columns", dest="column_counts", type=int, nargs="+",
+                          default=[100000, 1000000])
+    p_sqlite.add_argument("--schema", dest="schemaname", type=str, default="schema_0",
+                          help="Schema loaded by partial loads, synthetic banks have schema_0 to schema_9.")
+
+    p_compress = subparsers.add_parser("compression", help="Size and time of bank compressions.")
+    p_compress.add_argument("--columns", dest="column_count", type=int, default=1000000)
+    p_compress.add_argument("--levels", dest="levels", type=int, nargs="+", default=None,
+                            help="Compression levels to try, default level of each codec if not given.")
+
+    return parser.parse_args()
+
+
+def main():
+    in_args = parse_input()
+
+    if in_args.bench == "extract":
+        bench_extract(load_conf(in_args.conf_path), in_args.schemaname)
+    elif in_args.bench == "memory":
+        bench_column_footprint(in_args.column_count)
+    elif in_args.bench == "bank":
+        bench_bank_format(in_args.column_counts)
+    elif in_args.bench == "lazy":
+        bench_lazy_open(in_args.column_counts)
+    elif in_args.bench == "sqlite":
+        bench_sqlite_bank(in_args.column_counts, in_args.schemaname)
+    elif in_args.bench == "compression":
+        bench_compression(in_args.column_count, in_args.levels or [None])
+
+
+if __name__ == "__main__":
+    main()
@@ -19,7 +19,8 @@ sys.setdefaultencoding("utf-8")
 logger = logging.getLogger("database_schema_collect")
 
 
-def handler_dispatcher(config_filepath, action):
+def handler_dispatcher(config_filepath, action, version=None, as_of=None, base=None, base_version=None,
+                       query=None, limit=None, schemas=None, tables=None):
     config_obj = load_conf(config_filepath)
     datasrc_type = config_obj.get("datasource", "type").strip().lower()
 
@@ -34,6 +35,6 @@ def handler_dispatcher(config_filepath, action):
     logger.debug("Use %s metadata handler." % datasrc_type)
     if datasrc_type == "postgresql":
         handler = PGMetadataHandler(config_obj)
-        handler.process(action)
+        handler.process(action, version, as_of, base, base_version, query, limit, schemas, tables)
     else:
         raise ValueError("Unsupport data source type %s" % datasrc_type)
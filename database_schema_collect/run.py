@@ -24,12 +24,35 @@ def parse_input():
     parser.add_argument("--config", dest="conf_path", type=str, required=True,
                         help="Path of the config file.")
     parser.add_argument("--do", dest="action", type=str, required=True,
-                        choices=("collect", "ddl", "erd", "dict"),
+                        choices=("collect", "ddl", "erd", "dict", "diff", "search"),
                         help="""Action will be performed.
                                 - collect: collect the meta data of target database and store them.
                                 - ddl: generate ddl sql files of objects in the target database.
                                 - erd: generate database erd to png file.
-                                - dict: genderate data dictionary of database to Excel file. """)
+                                - dict: genderate data dictionary of database to Excel file.
+                                - diff: compare meta data with --base or --base-version, report as json and text.
+                                - search: print tables, views, columns, indexes and constraints matching --query. """)
+    version_group = parser.add_mutually_exclusive_group()
+    version_group.add_argument("--version", dest="version", type=int,
+                               help="Export from this recorded version of the meta data, needs snapshots.")
+    version_group.add_argument("--as-of", dest="as_of", type=str,
+                               help="""Export from the latest version recorded at or before this time,
+                                       YYYY-MM-DD[ HH:MM[:SS]], needs snapshots.""")
+    base_group = parser.add_mutually_exclusive_group()
+    base_group.add_argument("--base", dest="base", type=str,
+                            help="For diff, path of the metabank file in the storage to compare against.")
+    base_group.add_argument("--base-version", dest="base_version", type=int,
+                            help="For diff, the recorded version to compare against, needs snapshots.")
+    parser.add_argument("--schemas", dest="schemas", type=str, nargs="+",
+                        help="For ddl, erd and dict, only export objects of these schemas.")
+    parser.add_argument("--tables", dest="tables", type=str, nargs="+",
+                        help="For ddl, erd and dict, only export these tables or views, as schemaname.tablename.")
+    parser.add_argument("--query", dest="query", type=str,
+                        help="""For search, terms matched by names, types and comments, all of them must match.
+                                A term is [name:|type:|comment:|kind:]text, %% or * in text matches any run of
+                                characters, e.g. 'name:%%customer_id%%', 'type:"numeric(38,10)"', 'comment:pii'.""")
+    parser.add_argument("--limit", dest="limit", type=int,
+                        help="For search, print at most this many objects.")
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -45,7 +68,15 @@ def main():
     in_args = parse_input()
 
     handler_dispatcher(in_args["conf_path"],
-                       in_args["action"])
+                       in_args["action"],
+                       version=in_args["version"],
+                       as_of=in_args["as_of"],
+                       base=in_args["base"],
+                       base_version=in_args["base_version"],
+                       query=in_args["query"],
+                       limit=in_args["limit"],
+                       schemas=in_args["schemas"],
+                       tables=in_args["tables"])
 
 
 if __name__ == "__main__":
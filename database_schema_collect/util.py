@@ -33,6 +33,13 @@ LOG_LVL_MAP = {"critical": logging.CRITICAL,
                "info": logging.INFO,
                "debug": logging.DEBUG}
 BANK_NAME_PATTERN = "{}.bank.map"
+ARCHIVE_NAME_PATTERN = "{}.metadata.jsonl"
+ARCHIVE_INDEX_SUFFIX = ".index"
+MANIFEST_NAME_PATTERN = "{}.manifest.json"
+HISTORY_DIR_PATTERN = "{}.history"
+DIGEST_NAME_PATTERN = "{}.digest.json.gz"
+SEARCH_INDEX_NAME_PATTERN = "{}.search.idx"
+TENANTS_NAME_PATTERN = "{}.tenants.json"
 
 
 def load_conf(conf_path):
@@ -50,6 +57,25 @@ def load_conf(conf_path):
     return conf_loader
 
 
+def conf_get(conf_obj, section, option, default=None):
+    """Read an optional key from configuration.
+
+    :param conf_obj: Configuration object.
+    :type conf_obj: ConfigParser.
+    :param section: Section name.
+    :type section: str.
+    :param option: Key name in the section.
+    :type option: str.
+    :param default: Value returned when the key is absent or empty.
+    :returns: Stripped value of the key, or default.
+    """
+    if conf_obj.has_option(section, option):
+        value = conf_obj.get(section, option)
+        if value is not None and value.strip() != '':
+            return value.strip()
+    return default
+
+
 def set_log_level(log_level):
     if log_level is not None and isinstance(log_level, str):
         log_level = log_level.strip().lower()
@@ -113,6 +139,146 @@ class PGAgent(object):
             yield None
 
 
+    def render_query(self, sql_str, params=None):
+        """Render a SQL statement with named parameters bound as literals.
+
+        :param sql_str: String of SQL statement with named parameters.
+        :type sql_str: str.
+        :param params: Values of parameters.
+        :type params: dict.
+        :returns: SQL statement without any parameter placeholder.
+        :rtype: str.
+        """
+        stmt = text(sql_str)
+        if params is not None and isinstance(params, dict):
+            stmt = stmt.bindparams(**params)
+        return str(stmt.compile(dialect=self.eng.dialect,
+                                compile_kwargs={"literal_binds": True}))
+
+
+    def copy_query(self, sql_str, params=None, row_handler=None):
+        """Run a query as COPY (...) TO STDOUT and parse its output as a stream.
+
+        Rows are handed to row_handler as lists of strings (None for NULL)
+        while the server is still sending, without building row objects.
+
+        :param sql_str: String of SQL statement with named parameters.
+        :type sql_str: str.
+        :param params: Values of parameters.
+        :type params: dict.
+        :param row_handler: Callable receives every parsed row.
+        :type row_handler: function.
+        :returns: Number of rows copied.
+        :rtype: int.
+        """
+        copy_sql = "COPY ({}) TO STDOUT".format(self.render_query(sql_str, params))
+        parser = CopyTextParser(row_handler if row_handler is not None else (lambda row: None))
+
+        raw_conn = self.eng.raw_connection()
+        try:
+            cursor = raw_conn.cursor()
+            cursor.copy_expert(copy_sql, parser)
+            parser.close()
+            cursor.close()
+            raw_conn.commit()
+        except:
+            logger.error("SQL: %s" % copy_sql)
+            logger.error(traceback.format_exc())
+            raise
+        finally:
+            raw_conn.close()
+
+        return parser.row_count
+
+
+COPY_TEXT_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r',
+                     't': '\t', 'v': '\v', '\\': '\\'}
+
+
+def decode_copy_text_field(field):
+    """Decode one field of COPY text format output.
+
+    :param field: Raw field, backslash escaped.
+    :type field: str.
+    :returns: Decoded string, None for NULL.
+    """
+    if field == '\\N':
+        return None
+    if '\\' not in field:
+        return field
+
+    chars = []
+    i = 0
+    field_len = len(field)
+    while i < field_len:
+        c = field[i]
+        if c == '\\' and i + 1 < field_len:
+            i += 1
+            chars.append(COPY_TEXT_ESCAPES.get(field[i], field[i]))
+        else:
+            chars.append(c)
+        i += 1
+    return ''.join(chars)
+
+
+class CopyTextParser(object):
+    """File like sink for COPY ... TO STDOUT, which parses rows incrementally.
+
+    Each complete line is split into fields and passed to row_handler, so
+    the whole result set is never held in memory.
+    """
+
+    def __init__(self, row_handler):
+        self.row_handler = row_handler
+        self.row_count = 0
+        self._pending = ''
+
+
+    def write(self, data):
+        if not data:
+            return
+        lines = (self._pending + data).split('\n')
+        self._pending = lines.pop()
+        for each_line in lines:
+            self._feed_line(each_line)
+
+
+    def _feed_line(self, line):
+        self.row_handler([decode_copy_text_field(f) for f in line.split('\t')])
+        self.row_count += 1
+
+
+    def close(self):
+        if self._pending != '':
+            self._feed_line(self._pending)
+            self._pending = ''
+
+
+def format_pg_type(data_type, length, precision, scale):
+    """Format a PostgreSQL column type from its parts.
+
+    :param data_type: Name of the data type.
+    :type data_type: str.
+    :param length: Character maximum length, or None.
+    :param precision: Numeric precision, or None.
+    :param scale: Numeric scale, or None.
+    :returns: Type string like "numeric(38,10)".
+    :rtype: str.
+    """
+    if length is not None:
+        col_type = "{}({})".format(data_type, length)
+    elif data_type in ('smaillint', 'integer', 'bigint', 'serial', 'bigserial'):
+        col_type = "{}".format(data_type)
+    elif precision is not None and scale is not None and scale > 0:
+        col_type = "{}({},{})".format(data_type, precision, scale)
+    elif precision is not None and precision > 0:
+        col_type = "{}({})".format(data_type, precision)
+    else:
+        col_type = "{}".format(data_type)
+
+    return col_type
+
+
 def format_pg_col_str(column_obj):
     """Format (column name, column type) pair for PostgreSQL.
     :param column_obj: Column information.
@@ -121,20 +287,9 @@ def format_pg_col_str(column_obj):
     :returns: A pair of (column name, column type).
     :rtype: tuple.
     """
-    if column_obj.column_length is not None:
-        col_type = "{}({})".format(column_obj.column_data_type,
-                                   column_obj.column_length)
-    elif column_obj.column_data_type in ('smaillint', 'integer', 'bigint', 'serial', 'bigserial'):
-        col_type = "{}".format(column_obj.column_data_type)
-    elif column_obj.column_precision is not None and \
-            column_obj.column_scale is not None and column_obj.column_scale > 0:
-        col_type = "{}({},{})".format(column_obj.column_data_type,
-                                      column_obj.column_precision,
-                                      column_obj.column_scale)
-    elif column_obj.column_precision is not None and column_obj.column_precision > 0:
-        col_type = "{}({})".format(column_obj.column_data_type,
-                                   column_obj.column_precision)
-    else:
-        col_type = "{}".format(column_obj.column_data_type)
+    col_type = format_pg_type(column_obj.column_data_type,
+                              column_obj.column_length,
+                              column_obj.column_precision,
+                              column_obj.column_scale)
 
     return (column_obj.column_name, col_type)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import re
+import time
+import urllib
+import hashlib
+import urlparse
+import threading
+import email.utils
+import BaseHTTPServer
+import SocketServer
+from xml.sax.saxutils import escape
+
+from database_schema_collect.Location import S3_MIN_PART_SIZE
+from database_schema_collect.Location import sign_v4
+
+
+_AUTHORIZATION_RE = re.compile(r"AWS4-HMAC-SHA256 Credential=([^/]+)/(\d{8})/([^/]+)/s3/aws4_request, "
+                               r"SignedHeaders=([^,]+), Signature=(\w+)$")
+_RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)$")
+_NAMESPACE = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+
+    def _send(self, status, body="", headers=None):
+        headers = dict(headers or {})
+        headers.setdefault("Content-Length", str(len(body)))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+    def _send_error(self, status, code):
+        self._send(status, "<Error><Code>{}</Code></Error>".format(code))
+
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return "".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+
+    def _signed(self, body):
+        """Whether the request is signed by the access key of the fake."""
+        fake = self.server.fake
+        match = _AUTHORIZATION_RE.match(self.headers.get("Authorization", ""))
+        if match is None or match.group(1) != fake.access_key:
+            return False
+        payload_hash = self.headers.get("x-amz-content-sha256")
+        if payload_hash != "UNSIGNED-PAYLOAD" and payload_hash != hashlib.sha256(body).hexdigest():
+            return False
+        headers = dict((n, self.headers.get(n)) for n in match.group(4).split(";")
+                       if n not in ("host", "x-amz-date", "x-amz-content-sha256"))
+        now = time.strptime(self.headers.get("x-amz-date"), "%Y%m%dT%H%M%SZ")
+        url = "http://{}{}".format(self.headers.get("Host"), self.path)
+        expected = sign_v4(self.command, url, headers, payload_hash, fake.access_key, fake.secret_key,
+                           match.group(3), now)
+        return expected["Authorization"] == self.headers.get("Authorization")
+
+
+    def _handle(self):
+        body = self._read_body()
+        url = urlparse.urlsplit(self.path)
+        query = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        parts = urllib.unquote(url.path).lstrip("/").split("/", 1)
+        key = parts[1] if len(parts) > 1 else None
+        op = _operation(self.command, key, query)
+
+        fake = self.server.fake
+        if not self._signed(body):
+            with fake._lock:
+                fake.bad_signatures += 1
+            return self._send_error(403, "SignatureDoesNotMatch")
+        status = fake._record(op, key)
+        if status is not None:
+            return self._send_error(status, "SlowDown")
+        getattr(fake, "_" + op.lower())(self, key, query, body)
+
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = _handle
+
+
+def _operation(method, key, query):
+    if key is None:
+        return "LIST"
+    if method == "POST":
+        return "CREATE_UPLOAD" if "uploads" in query else "COMPLETE_UPLOAD"
+    if method == "PUT" and "partNumber" in query:
+        return "PUT_PART"
+    if method == "DELETE" and "uploadId" in query:
+        return "ABORT_UPLOAD"
+    return method
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeS3(object):
+    """A bucket of an S3 compatible object store in a local HTTP server.
+
+    Requests must be signed with AWS signature version 4 by access_key and
+    secret_key. Supports single and multipart uploads, ranged reads and
+    paged listing. Keys are utf-8 encoded. Failures are injected by fail,
+    the operation of each request is listed in requests.
+    """
+
+    def __init__(self, access_key, secret_key, list_page_size=3):
+        """
+        :param list_page_size: Keys listed per page.
+        :type list_page_size: int.
+        """
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.list_page_size = list_page_size
+        self.objects = {}
+        self.uploads = {}
+        self.requests = []
+        self.bad_signatures = 0
+        self._failures = {}
+        self._clock = 0
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        self.endpoint = "http://127.0.0.1:{}".format(self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05})
+        self._thread.daemon = True
+
+
+    def start(self):
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+    def fail(self, op, times, status=503):
+        """Answer the next requests of an operation with an error.
+
+        :param op: Operation, one of GET, HEAD, PUT, DELETE, LIST,
+                   CREATE_UPLOAD, PUT_PART, COMPLETE_UPLOAD, ABORT_UPLOAD.
+        :type op: str.
+        :param times: Number of requests failed.
+        :type times: int.
+        :param status: Status code of the failed requests.
+        :type status: int.
+        """
+        with self._lock:
+            self._failures[op] = [times, status]
+
+
+    def count(self, op):
+        """Return number of requests of an operation received."""
+        with self._lock:
+            return len([r for r in self.requests if r[0] == op])
+
+
+    def put(self, key, content):
+        """Store an object as if it was uploaded."""
+        with self._lock:
+            self._store(key, content)
+
+
+    def _store(self, key, content):
+        self._clock += 1
+        self.objects[key] = (content, self._clock)
+
+
+    def _record(self, op, key):
+        with self._lock:
+            self.requests.append((op, key))
+            failure = self._failures.get(op)
+            if failure is None or failure[0] <= 0:
+                return None
+            failure[0] -= 1
+            return failure[1]
+
+
+    def _object_headers(self, key):
+        content, clock = self.objects[key]
+        return {"ETag": '"{}"'.format(hashlib.md5(content).hexdigest()),
+                "Last-Modified": email.utils.formatdate(1000000000 + clock, usegmt=True)}
+
+
+    def _put(self, handler, key, query, body):
+        with self._lock:
+            self._store(key, body)
+            headers = self._object_headers(key)
+        handler._send(200, headers={"ETag": headers["ETag"]})
+
+
+    def _get(self, handler, key, query, body):
+        with self._lock:
+            if key not in self.objects:
+                return handler._send_error(404, "NoSuchKey")
+            content = self.objects[key][0]
+            headers = self._object_headers(key)
+        match = _RANGE_RE.match(handler.headers.get("Range", ""))
+        if match is None:
+            return handler._send(200, content, headers)
+        first, last = int(match.group(1)), int(match.group(2))
+        if first >= len(content):
+            return handler._send_error(416, "InvalidRange")
+        handler._send(206, content[first:last + 1], headers)
+
+
+    def _head(self, handler, key, query, body):
+        with self._lock:
+            if key not in self.objects:
+                return handler._send(404)
+            headers = self._object_headers(key)
+            headers["Content-Length"] = str(len(self.objects[key][0]))
+        handler._send(200, headers=headers)
+
+
+    def _delete(self, handler, key, query, body):
+        with self._lock:
+            self.objects.pop(key, None)
+        handler._send(204)
+
+
+    def _list(self, handler, key, query, body):
+        with self._lock:
+            keys = sorted(k for k in self.objects if k.startswith(query.get("prefix", "")))
+        start = int(query.get("continuation-token", 0))
+        end = start + self.list_page_size
+        xml = ["<ListBucketResult xmlns=\"{}\">".format(_NAMESPACE)]
+        xml.extend("<Contents><Key>{}</Key></Contents>".format(escape(k)) for k in keys[start:end])
+        xml.append("<IsTruncated>{}</IsTruncated>".format("true" if end < len(keys) else "false"))
+        if end < len(keys):
+            xml.append("<NextContinuationToken>{}</NextContinuationToken>".format(end))
+        xml.append("</ListBucketResult>")
+        handler._send(200, "".join(xml))
+
+
+    def _create_upload(self, handler, key, query, body):
+        with self._lock:
+            upload_id = "upload{}".format(len(self.requests))
+            self.uploads[upload_id] = {}
+        handler._send(200, "<InitiateMultipartUploadResult xmlns=\"{}\"><Key>{}</Key><UploadId>{}</UploadId>"
+                           "</InitiateMultipartUploadResult>".format(_NAMESPACE, escape(key), upload_id))
+
+
+    def _put_part(self, handler, key, query, body):
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        with self._lock:
+            if query["uploadId"] not in self.uploads:
+                return handler._send_error(404, "NoSuchUpload")
+            self.uploads[query["uploadId"]][int(query["partNumber"])] = (etag, body)
+        handler._send(200, headers={"ETag": etag})
+
+
+    def _complete_upload(self, handler, key, query, body):
+        numbers = [int(n) for n in re.findall(r"<PartNumber>(\d+)</PartNumber>", body)]
+        etags = re.findall(r"<ETag>([^<]+)</ETag>", body)
+        with self._lock:
+            parts = self.uploads.get(query["uploadId"])
+            if parts is None:
+                return handler._send_error(404, "NoSuchUpload")
+            if numbers != sorted(parts) or etags != [parts[n][0] for n in numbers]:
+                return handler._send_error(400, "InvalidPart")
+            if any(len(parts[n][1]) < S3_MIN_PART_SIZE for n in numbers[:-1]):
+                return handler._send_error(400, "EntityTooSmall")
+            del self.uploads[query["uploadId"]]
+            self._store(key, "".join(parts[n][1] for n in numbers))
+        handler._send(200, "<CompleteMultipartUploadResult><Key>{}</Key></CompleteMultipartUploadResult>".format(
+            escape(key)))
+
+
+    def _abort_upload(self, handler, key, query, body):
+        with self._lock:
+            self.uploads.pop(query["uploadId"], None)
+        handler._send(204)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import json
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+
+WEBHDFS_PREFIX = "/webhdfs/v1"
+# Path prefix of requests to the DataNode, served by the same server.
+DATANODE_PREFIX = "/datanode"
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+
+    def _send(self, status, body="", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def _send_json(self, status, doc):
+        self._send(status, json.dumps(doc), {"Content-Type": "application/json"})
+
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return "".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+
+    def _route(self):
+        """Return (node, op, path, query) of the request."""
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        node = "namenode"
+        path = url.path
+        if path.startswith(DATANODE_PREFIX):
+            node = "datanode"
+            path = path[len(DATANODE_PREFIX):]
+        if path.startswith(WEBHDFS_PREFIX):
+            path = path[len(WEBHDFS_PREFIX):]
+        return node, query.get("op"), path or "/", query
+
+
+    def _handle(self):
+        node, op, path, query = self._route()
+        body = self._read_body()
+        fake = self.server.fake
+        key = "DATANODE" if node == "datanode" else op
+        status = fake._record(self.command, key, path, body)
+        if status is not None:
+            return self._send_json(status, {"RemoteException": {"message": "injected"}})
+        getattr(fake, "_{}_{}".format(node, self.command.lower()))(self, op, path, query, body)
+
+
+    do_GET = do_PUT = do_DELETE = _handle
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeWebHDFS(object):
+    """A NameNode and a DataNode of WebHDFS in one local HTTP server.
+
+    CREATE is answered by the NameNode with a 307 redirect to the DataNode,
+    which stores the body and answers 201. Failures are injected by fail,
+    each request is listed in requests.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.dirs = set(["/"])
+        self.mtimes = {}
+        self.requests = []
+        self._failures = {}
+        self._clock = 1000
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05})
+        self._thread.daemon = True
+
+
+    def start(self):
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+    def fail(self, key, times, status=503):
+        """Answer the next requests of an operation with an error.
+
+        :param key: Operation, like CREATE or OPEN, DATANODE for uploads to
+                    the DataNode.
+        :type key: str.
+        :param times: Number of requests failed.
+        :type times: int.
+        :param status: Status code of the failed requests.
+        :type status: int.
+        """
+        with self._lock:
+            self._failures[key] = [times, status]
+
+
+    def count(self, method, key):
+        """Return number of requests of an operation received."""
+        with self._lock:
+            return len([r for r in self.requests if r[0] == method and r[1] == key])
+
+
+    def _record(self, method, key, path, body):
+        with self._lock:
+            self.requests.append((method, key, path, len(body)))
+            failure = self._failures.get(key)
+            if failure is None or failure[0] <= 0:
+                return None
+            failure[0] -= 1
+            return failure[1]
+
+
+    def _namenode_put(self, handler, op, path, query, body):
+        if op == "CREATE":
+            location = "http://127.0.0.1:{}{}{}{}?op=CREATE&overwrite={}".format(
+                self.port, DATANODE_PREFIX, WEBHDFS_PREFIX, path, query.get("overwrite", "false"))
+            return handler._send(307, headers={"Location": location})
+        if op == "MKDIRS":
+            with self._lock:
+                parts = path.strip("/").split("/")
+                for i in xrange(1, len(parts) + 1):
+                    self.dirs.add("/" + "/".join(parts[:i]))
+            return handler._send_json(200, {"boolean": True})
+        if op == "RENAME":
+            return handler._send_json(200, {"boolean": self._rename(path, query["destination"])})
+        handler._send_json(400, {"RemoteException": {"message": "unsupported op {}".format(op)}})
+
+
+    def _rename(self, src_path, des_path):
+        with self._lock:
+            if src_path not in self.files and src_path not in self.dirs:
+                return False
+            for each_path in [p for p in self.files if p == src_path or p.startswith(src_path + "/")]:
+                new_path = des_path + each_path[len(src_path):]
+                self.files[new_path] = self.files.pop(each_path)
+                self.mtimes[new_path] = self.mtimes.pop(each_path)
+            for each_dir in [d for d in self.dirs if d == src_path or d.startswith(src_path + "/")]:
+                self.dirs.discard(each_dir)
+                self.dirs.add(des_path + each_dir[len(src_path):])
+            return True
+
+
+    def _namenode_delete(self, handler, op, path, query, body):
+        with self._lock:
+            found = False
+            for each_path in [p for p in self.files if p == path or p.startswith(path + "/")]:
+                del self.files[each_path]
+                del self.mtimes[each_path]
+                found = True
+            for each_dir in [d for d in self.dirs if d == path or d.startswith(path + "/")]:
+                self.dirs.discard(each_dir)
+                found = True
+        handler._send_json(200, {"boolean": found})
+
+
+    def _namenode_get(self, handler, op, path, query, body):
+        with self._lock:
+            content = self.files.get(path)
+            mtime = self.mtimes.get(path)
+            is_dir = path in self.dirs
+        if op == "OPEN":
+            if content is None:
+                return handler._send_json(404, {"RemoteException": {"message": "not found"}})
+            offset = int(query.get("offset", 0))
+            length = int(query.get("length", len(content)))
+            return handler._send(200, content[offset:offset + length])
+        if op == "GETFILESTATUS":
+            if content is not None:
+                return handler._send_json(200, {"FileStatus": {"type": "FILE", "length": len(content),
+                                                               "modificationTime": mtime}})
+            if is_dir:
+                return handler._send_json(200, {"FileStatus": {"type": "DIRECTORY", "length": 0,
+                                                               "modificationTime": 0}})
+            return handler._send_json(404, {"RemoteException": {"message": "not found"}})
+        handler._send_json(400, {"RemoteException": {"message": "unsupported op {}".format(op)}})
+
+
+    def _datanode_put(self, handler, op, path, query, body):
+        with self._lock:
+            self._clock += 1
+            self.files[path] = body
+            self.mtimes[path] = self._clock
+        handler._send(201)
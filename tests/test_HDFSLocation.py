@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+import requests
+
+from database_schema_collect.Location import HDFSLocation
+
+from FakeWebHDFS import FakeWebHDFS
+
+
+logging.getLogger("database_schema_collect").setLevel(logging.CRITICAL)
+
+
+MAX_RETRIES = 3
+
+
+class HDFSLocationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeWebHDFS().start()
+        self.location = HDFSLocation("127.0.0.1", self.fake.port, upload_workers=4,
+                                     max_retries=MAX_RETRIES, retry_backoff=0.001)
+        self.local_dir = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        # Kept alive connections would be left to the server threads.
+        self.location._global_api_session.close()
+        self.fake.stop()
+        shutil.rmtree(self.local_dir)
+
+
+    def _local_file(self, rel_path, content):
+        path = os.path.join(self.local_dir, rel_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as wf:
+            wf.write(content)
+        return path
+
+
+    def test_create_in_two_steps(self):
+        src = self._local_file("bank.map", "\x00\x01bank")
+        self.location.move_file_to(src, "/meta/db/db.bank.map")
+
+        self.assertEqual(self.fake.files["/meta/db/db.bank.map"], "\x00\x01bank")
+        self.assertEqual([r for r in self.fake.requests if r[0] == "PUT"],
+                         [("PUT", "CREATE", "/meta/db/db.bank.map", 0),
+                          ("PUT", "DATANODE", "/meta/db/db.bank.map", 6)])
+
+
+    def test_upload_directory_tree(self):
+        self._local_file("a/t0.json", "t0")
+        self._local_file("a/s1/t1.json", "t1")
+        self._local_file("a/s1/s2/t2.json", "t2")
+        self.location.move_file_to(os.path.join(self.local_dir, "a"), "/meta/db")
+
+        self.assertEqual(self.fake.files, {"/meta/db/t0.json": "t0",
+                                           "/meta/db/s1/t1.json": "t1",
+                                           "/meta/db/s1/s2/t2.json": "t2"})
+        self.assertTrue(set(["/meta/db", "/meta/db/s1", "/meta/db/s1/s2"]) <= self.fake.dirs)
+
+
+    def test_datanode_server_error_asks_namenode_again(self):
+        src = self._local_file("f.json", "content")
+        self.fake.fail("DATANODE", 2)
+        self.location.move_file_to(src, "/meta/f.json")
+
+        self.assertEqual(self.fake.files["/meta/f.json"], "content")
+        self.assertEqual(self.fake.count("PUT", "CREATE"), 3)
+        self.assertEqual(self.fake.count("PUT", "DATANODE"), 3)
+
+
+    def test_datanode_client_error_is_not_retried(self):
+        src = self._local_file("f.json", "content")
+        self.fake.fail("DATANODE", 1, status=403)
+        with self.assertRaises(requests.HTTPError) as cm:
+            self.location.move_file_to(src, "/meta/f.json")
+
+        self.assertEqual(cm.exception.response.status_code, 403)
+        self.assertEqual(self.fake.count("PUT", "CREATE"), 1)
+        self.assertEqual(self.fake.count("PUT", "DATANODE"), 1)
+
+
+    def test_retries_are_bounded(self):
+        src = self._local_file("f.json", "content")
+        self.fake.fail("DATANODE", 100)
+        with self.assertRaises(requests.HTTPError):
+            self.location.move_file_to(src, "/meta/f.json")
+
+        self.assertEqual(self.fake.count("PUT", "CREATE"), MAX_RETRIES + 1)
+        self.assertEqual(self.fake.count("PUT", "DATANODE"), MAX_RETRIES + 1)
+        self.assertNotIn("/meta/f.json", self.fake.files)
+
+
+    def test_namenode_server_error_is_retried(self):
+        src = self._local_file("f.json", "content")
+        self.fake.fail("CREATE", 2)
+        self.location.move_file_to(src, "/meta/f.json")
+
+        self.assertEqual(self.fake.files["/meta/f.json"], "content")
+        self.assertEqual(self.fake.count("PUT", "CREATE"), 3)
+        self.assertEqual(self.fake.count("PUT", "DATANODE"), 1)
+
+
+    def test_commit_staged_directory_is_renamed_over_destination(self):
+        self.fake.files["/meta/db/stale.json"] = "old"
+        self.fake.mtimes["/meta/db/stale.json"] = 1
+        self.fake.dirs.add("/meta/db")
+        self._local_file("staged/t0.json", "new")
+        self.location.commit_staged(os.path.join(self.local_dir, "staged"), "/meta/db")
+
+        self.assertEqual(self.fake.files, {"/meta/db/t0.json": "new"})
+        self.assertEqual(self.fake.count("PUT", "RENAME"), 1)
+        renamed = [r[2] for r in self.fake.requests if r[1] == "RENAME"][0]
+        self.assertTrue(renamed.startswith("/meta/db.") and renamed.endswith(".tmp"))
+
+
+    def test_failed_rename_raises(self):
+        self._local_file("staged/t0.json", "new")
+        self.fake.fail("RENAME", 1, status=403)
+        with self.assertRaises(requests.HTTPError):
+            self.location.commit_staged(os.path.join(self.local_dir, "staged"), "/meta/db")
+        self.assertEqual(self.fake.count("PUT", "RENAME"), 1)
+
+
+    def test_read_back(self):
+        src = self._local_file("bank.map", "0123456789")
+        self.location.move_file_to(src, "/meta/bank.map")
+
+        self.assertEqual(self.location.open_file("/meta/bank.map", raw=True), "0123456789")
+        self.assertEqual(self.location.read_range("/meta/bank.map", 2, 3), "234")
+        self.assertEqual(self.location.file_status("/meta/bank.map"),
+                         (self.fake.mtimes["/meta/bank.map"], 10))
+        self.assertIsNone(self.location.open_file("/meta/missing", raw=True))
+        self.assertIsNone(self.location.file_status("/meta/missing"))
+        self.assertIsNone(self.location.file_status("/meta"))
+
+        self.location.remove_file("/meta/bank.map")
+        self.assertNotIn("/meta/bank.map", self.fake.files)
+
+
+    def test_read_is_retried(self):
+        src = self._local_file("bank.map", "0123456789")
+        self.location.move_file_to(src, "/meta/bank.map")
+        self.fake.fail("OPEN", 2)
+
+        self.assertEqual(self.location.read_range("/meta/bank.map", 0, 4), "0123")
+        self.assertEqual(self.fake.count("GET", "OPEN"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()